@@ -1,8 +1,16 @@
+import os
+import sys
 from pathlib import Path
+from typing import Optional
 
 import click
+import numpy as np
 import pandas as pd
 
+sys.path.append(str(Path(__file__).parent / 'detector'))
+
+from manifest import Manifest, index_dir  # noqa: E402
+
 
 @click.command()
 @click.argument('match_file', type=click.Path(exists=True, dir_okay=False, path_type=Path))
@@ -12,24 +20,55 @@ import pandas as pd
               help='Column name for steganography embedding method')
 @click.option('--cover-dir-name', default='covers', type=str, help='Directory name for cover images')
 @click.option('--stego-dir-name', default='stegos', type=str, help='Directory name for stego images')
+@click.option('-o', '--output', type=click.Path(dir_okay=False, writable=True, path_type=Path),
+              help='Write a manifest for "detect.py --manifest" to this file instead of printing the pairs')
 def cover_stego_pairs(
         match_file: Path,
         covers_column: str,
         stegos_column: str,
         method_column: str,
         cover_dir_name: str,
-        stego_dir_name: str):
+        stego_dir_name: str,
+        output: Optional[Path]):
     """Extracts cover-stego pairs from a CSV file
 
     MATCH_FILE is a CSV file with columns for cover images, stego images, and steganography embedding methods.
+
+    The files are looked up in a single listing of each directory, whose names are matched regardless of their
+    case, e.g. "1.png" to "1.PNG". Each pair with a missing file is reported on stderr and left out. Names that
+    only differ in their case are an error, as it is unclear which file is meant.
     """
 
-    df = pd.read_csv(match_file)
-    for _, row in df.iterrows():
-        cover = (match_file.parent / cover_dir_name / row[covers_column]).resolve()
-        stego = (match_file.parent / stego_dir_name / row[stegos_column]).resolve()
-        method = row[method_column]
-        click.echo(f'{cover}, {stego}, {method}')
+    df = pd.read_csv(match_file, usecols=[covers_column, stegos_column, method_column], dtype=str)
+    cover_dir = (match_file.parent / cover_dir_name).resolve()
+    stego_dir = (match_file.parent / stego_dir_name).resolve()
+
+    try:
+        covers = df[covers_column].str.lower().map(index_dir(cover_dir))
+        stegos = df[stegos_column].str.lower().map(index_dir(stego_dir))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    missing = covers.isna() | stegos.isna()
+    for cover, stego in zip(df.loc[missing, covers_column], df.loc[missing, stegos_column]):
+        click.echo(f'Skipping pair {cover_dir / str(cover)}, {stego_dir / str(stego)}: not all files exist', err=True)
+
+    df, covers, stegos = df[~missing], covers[~missing], stegos[~missing]
+    if output:
+        methods = df[method_column].astype('category')
+        Manifest(
+            dirs=[str(cover_dir), str(stego_dir)],
+            cover_dirs=np.zeros(len(df), dtype=np.int32),
+            covers=covers.to_numpy(dtype=str),
+            stego_dirs=np.ones(len(df), dtype=np.int32),
+            stegos=stegos.to_numpy(dtype=str),
+            methods=methods.cat.categories.tolist(),
+            method_codes=methods.cat.codes.to_numpy(dtype=np.int32)
+        ).save(output)
+    else:
+        methods = df[method_column].fillna('')
+        lines = str(cover_dir) + os.sep + covers + ', ' + str(stego_dir) + os.sep + stegos + ', ' + methods
+        if len(lines):
+            click.echo('\n'.join(lines))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,4 @@
+"""A self-contained benchmark of the detector on a synthetic corpus like StegoAppDB.
+
+Run it from the folder of the detector with `python -m bench run` (see `python -m bench --help`).
+"""
@@ -0,0 +1,102 @@
+import json
+from pathlib import Path
+from typing import Optional, Tuple
+
+import click
+
+from bench import corpus, runner
+
+
+def _parse_size(_ctx, _param, values: Tuple[str, ...]):
+    try:
+        return [tuple(int(v) for v in value.lower().split('x')) for value in values]
+    except ValueError:
+        raise click.BadParameter('Sizes must be given as WIDTHxHEIGHT like "256x256"')
+
+
+@click.group()
+def bench():
+    """Benchmarks the detector on a synthetic corpus of cover and stego images.
+
+    The stego images mimic the traces the rules of "rules/stegoapps.yaml" look for: the LSB signature,
+    significant bits and color type of MobiStego, the blue LSBs of PocketStego, the color type of Pictograph
+    and the file size differences of all tools.
+    """
+
+
+@bench.command()
+@click.argument('root', type=click.Path(file_okay=False, path_type=Path))
+@click.option('-n', '--covers', default=10, type=click.IntRange(min=1), help='Number of cover images')
+@click.option('--size', default='256x256', callback=lambda c, p, v: _parse_size(c, p, (v,))[0],
+              help='Width and height of the images like "256x256"')
+@click.option('--stegos-per-cover', default=3, type=click.IntRange(min=1), help='Number of stego images per cover')
+@click.option('--seed', default=0, type=int, help='Seed of the random content of the images')
+def generate(root: Path, covers: int, size: Tuple[int, int], stegos_per_cover: int, seed: int):
+    """Generates a corpus in ROOT with the pairs listed in "pairs.txt"."""
+    pairs = corpus.generate(root, covers, size=size, stegos_per_cover=stegos_per_cover, seed=seed)
+    click.echo(f'Generated {len(pairs)} pairs in {root}')
+
+
+@bench.command()
+@click.option('-c', '--config', default='rules/stegoapps.yaml',
+              type=click.Path(exists=True, dir_okay=False, path_type=Path), help='Path to the config file')
+@click.option('-n', '--covers', multiple=True, default=[10, 100], type=click.IntRange(min=1), show_default=True,
+              help='Number of cover images of a corpus (can be given multiple times)')
+@click.option('--size', 'sizes', multiple=True, default=['256x256', '1024x768'], callback=_parse_size,
+              show_default=True, help='Size of the images of a corpus (can be given multiple times)')
+@click.option('--stegos-per-cover', default=3, type=click.IntRange(min=1), help='Number of stego images per cover')
+@click.option('--seed', default=0, type=int, help='Seed of the random content of the images')
+@click.option('--corpus-dir', default='.bench', type=click.Path(file_okay=False, path_type=Path), show_default=True,
+              help='Folder to keep the generated corpora in, which are reused by later runs')
+@click.option('-o', '--output', type=click.Path(dir_okay=False, path_type=Path),
+              help='Path to save the results to as JSON')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False, path_type=Path),
+              help='Results of an earlier run to compare with')
+@click.option('--threshold', default=10.0, type=float, show_default=True,
+              help='Slowdown or memory growth in percent that is reported as regression')
+def run(config: Path, covers: Tuple[int, ...], sizes, stegos_per_cover: int, seed: int, corpus_dir: Path,
+        output: Optional[Path], baseline: Optional[Path], threshold: float):
+    """Measures pairs per second, the latency of each rule and the peak RSS for each corpus size and image size.
+
+    Exits with status 1 if a baseline is given and a case regressed.
+    """
+    cases = []
+    for size in sizes:
+        for count in covers:
+            case = runner.run_case(config, corpus_dir, count, size, stegos_per_cover, seed)
+            cases.append(case)
+            click.echo(f"{case['pairs']} pairs of {size[0]}x{size[1]}: {case['pairs_per_sec']:.1f} pairs/s, "
+                       f"{case['peak_rss_mb']:.0f} MB peak RSS, {case['errors']} errors")
+            for name, latency in case['rules'].items():
+                click.echo(f"  {latency['mean_ms']:8.3f} ms mean {latency['p95_ms']:8.3f} ms p95 "
+                           f"{latency['calls']:>6} calls  {name}")
+
+    results = {'environment': runner.environment(), 'config': str(config), 'cases': cases}
+    if output:
+        output.write_text(json.dumps(results, indent=2))
+
+    if baseline:
+        lines, regressed = runner.compare(json.loads(baseline.read_text()), results, threshold)
+        click.echo()
+        for line in lines:
+            click.echo(line)
+        if regressed:
+            raise SystemExit(1)
+
+
+@bench.command(name='compare')
+@click.argument('baseline', type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.argument('current', type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.option('--threshold', default=10.0, type=float, show_default=True,
+              help='Slowdown or memory growth in percent that is reported as regression')
+def compare_results(baseline: Path, current: Path, threshold: float):
+    """Compares the saved results CURRENT of a run with the results BASELINE of an earlier run."""
+    lines, regressed = runner.compare(json.loads(baseline.read_text()), json.loads(current.read_text()), threshold)
+    for line in lines:
+        click.echo(line)
+    if regressed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    bench()
@@ -0,0 +1,167 @@
+import struct
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+from PIL import Image, PngImagePlugin
+
+import png
+
+KINDS = ['MobiStego', 'PocketStego', 'Pictograph', 'PixelKnot', 'Passlok', 'Clean']
+"""The kinds of stego images of a corpus, which are named like the tool whose traces they mimic."""
+
+_SIZE_DIFFS = {
+    'MobiStego': 19.5,
+    'PocketStego': 4.5,
+    'Pictograph': 55.0,
+    'PixelKnot': -1.0,
+    'Passlok': 0.1,
+    'Clean': 0.0,
+}
+"""The file size difference of the stego images in percent, which is in the range of the rules of the tool."""
+
+_PADDING_CHUNK = b'bePd'
+"""A private ancillary chunk that pads the files to the wanted size difference and is ignored by decoders."""
+
+_MIN_PADDING = 12
+"""The size of an empty chunk with its length, type and checksum."""
+
+MOBISTEGO_START = b'@!#'
+MOBISTEGO_END = b'#!@'
+
+
+@dataclass(frozen=True)
+class Pair:
+    """Represents a generated pair of a cover and a stego image."""
+
+    cover: Path
+    stego: Path
+    kind: str
+    """The kind of the stego image (see `KINDS`)."""
+
+
+def generate(root: Path, covers: int, *, size: Tuple[int, int] = (256, 256), stegos_per_cover: int = 3,
+             seed: int = 0) -> List[Pair]:
+    """Generate a corpus like StegoAppDB with covers in "covers" and stego images in "stegos" of the root.
+
+    The kinds of the stego images are cycled through `KINDS`, so each kind appears about equally often.
+    The pairs are also written to "pairs.txt" as lines of cover, stego and kind separated by commas, which
+    can be piped into `detect.py --from-stdin`. The same seed always generates the same corpus.
+
+    :param root: The folder of the corpus
+    :param covers: The number of cover images
+    :param size: The width and height of the images
+    :param stegos_per_cover: The number of stego images of each cover
+    :param seed: The seed of the random content of the images
+    """
+
+    rng = np.random.default_rng(seed)
+    (root / 'covers').mkdir(parents=True, exist_ok=True)
+    (root / 'stegos').mkdir(parents=True, exist_ok=True)
+
+    pairs = []
+    for i in range(covers):
+        pixels = _natural_pixels(rng, size)
+        for j in range(stegos_per_cover):
+            kind = KINDS[(i * stegos_per_cover + j) % len(KINDS)]
+            cover = root / 'covers' / f'{i:06}-{j}.png'
+            stego = root / 'stegos' / f'{i:06}-{j}.png'
+            _write_pair(rng, kind, pixels, cover, stego)
+            pairs.append(Pair(cover, stego, kind))
+
+    with open(root / 'pairs.txt', 'w') as file:
+        file.writelines(f'{p.cover},{p.stego},{p.kind}\n' for p in pairs)
+    return pairs
+
+
+def _natural_pixels(rng: np.random.Generator, size: Tuple[int, int]) -> np.ndarray:
+    """Create RGB pixels of smooth gradients with noise, which compress about as well as photos."""
+    width, height = size
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    phases = rng.uniform(0, 2 * np.pi, 3)
+    scale = rng.uniform(20, 80)
+    base = np.stack([127 + 100 * np.sin(x / scale + y / (scale * 1.7) + p) for p in phases], axis=-1)
+    noise = rng.normal(0, 6, (height, width, 3))
+    return np.clip(base + noise, 0, 255).astype(np.uint8)
+
+
+def _write_pair(rng: np.random.Generator, kind: str, pixels: np.ndarray, cover: Path, stego: Path):
+    if kind == 'Pictograph':
+        # Pictograph converts grayscale covers to RGB
+        gray = Image.fromarray(pixels).convert('L')
+        gray.save(cover)
+        gray.convert('RGB').save(stego)
+    elif kind == 'MobiStego':
+        _save(Image.fromarray(pixels), cover, sbit=(8, 8, 8))
+        message = rng.integers(0, 256, max(16, pixels.size // 400), dtype=np.uint8).tobytes()
+        data = embed(pixels, MOBISTEGO_START + message + MOBISTEGO_END, bits=2)
+        _save(Image.fromarray(data).convert('RGBA'), stego, sbit=(8, 8, 8, 8))
+    elif kind == 'PocketStego':
+        _save(Image.fromarray(pixels), cover)
+        message = rng.integers(0, 256, max(16, pixels.size // 1200), dtype=np.uint8).tobytes()
+        data = embed(pixels, message, bits=1, channels='B', direction='col')
+        _save(Image.fromarray(data), stego)
+    else:
+        _save(Image.fromarray(pixels), cover)
+        _save(Image.fromarray(pixels), stego)
+    _pad_to_size_diff(cover, stego, _SIZE_DIFFS[kind])
+
+
+def embed(pixels: np.ndarray, message: bytes, bits: int = 1, channels: str = 'RGB',
+          direction: str = 'row') -> np.ndarray:
+    """Embed a message into the least significant bits of RGB pixels in big endian order.
+
+    This is the inverse of `lsb.extract` with the same parameters.
+    """
+
+    indices = {'R': 0, 'G': 1, 'B': 2}
+    data = pixels.copy()
+    view = data.transpose(1, 0, 2) if direction == 'col' else data
+    values = view[..., [indices[c] for c in channels]].reshape(-1)
+
+    message_bits = np.unpackbits(np.frombuffer(message, dtype=np.uint8))
+    message_bits = np.concatenate([message_bits, np.zeros(-len(message_bits) % bits, dtype=np.uint8)])
+    groups = message_bits.reshape(-1, bits) @ (1 << np.arange(bits - 1, -1, -1))
+    if len(groups) > len(values):
+        raise ValueError('The message is too long for the image')
+
+    mask = np.uint8(0xFF ^ ((1 << bits) - 1))
+    values[:len(groups)] = (values[:len(groups)] & mask) | groups.astype(np.uint8)
+    view[..., [indices[c] for c in channels]] = values.reshape(view.shape[:2] + (len(channels),))
+    return data
+
+
+def _save(image: Image.Image, path: Path, sbit: Tuple[int, ...] = ()):
+    info = PngImagePlugin.PngInfo()
+    if sbit:
+        info.add(b'sBIT', bytes(sbit))
+    image.save(path, pnginfo=info)
+
+
+def _pad_to_size_diff(cover: Path, stego: Path, size_diff: float):
+    """Pad the cover or the stego image, so the stego is the given percentage larger (or smaller) than the cover."""
+    cover_size, stego_size = cover.stat().st_size, stego.stat().st_size
+    target = cover_size * (1 + size_diff / 100)
+    if stego_size < target:
+        path, length, other = stego, round(target) - stego_size, cover
+    else:
+        path, length, other = cover, round(stego_size / (1 + size_diff / 100)) - cover_size, stego
+    if 0 < length < _MIN_PADDING:
+        # Padding the other image first makes the needed padding large enough for a chunk
+        _pad(other, 4096)
+        _pad_to_size_diff(cover, stego, size_diff)
+    else:
+        _pad(path, length)
+
+
+def _pad(path: Path, length: int):
+    """Insert a padding chunk of the given length after the IHDR chunk of a PNG file."""
+    if length < _MIN_PADDING:
+        return
+    data = bytes(length - _MIN_PADDING)
+    chunk = struct.pack('>I', len(data)) + _PADDING_CHUNK + data + struct.pack('>I', zlib.crc32(_PADDING_CHUNK + data))
+    content = path.read_bytes()
+    end_of_header = len(png.SIGNATURE) + 8 + 13 + 4
+    path.write_bytes(content[:end_of_header] + chunk + content[end_of_header:])
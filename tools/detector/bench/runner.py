@@ -0,0 +1,154 @@
+import os
+import platform
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import files
+import lsb
+import png
+from config import Config, Rule
+from detect import _iter_checks, _load_config
+from eval import Evaluator
+
+from bench import corpus
+
+NATIVE_GLOBALS = {'os': os, 'files': files, 'lsb': lsb, 'png': png}
+"""The globals of the rules with the native feature modules only, so no checkout of aletheia is needed."""
+
+
+class TimingEvaluator(Evaluator):
+    """An evaluator that measures the time of each rule without the time of the rules evaluated after it."""
+
+    def __init__(self, config: Config, **kwargs):
+        super().__init__(config, _globals=NATIVE_GLOBALS, **kwargs)
+        self.timings: Dict[str, List[float]] = {}
+        """The times of the evaluations of each rule by name in seconds."""
+
+        self._nested: List[float] = []
+
+    def _eval_rule(self, rule, /, level=0, group=None, position=None):
+        if not isinstance(rule, Rule):
+            return super()._eval_rule(rule, level, group, position)
+
+        self._nested.append(0.0)
+        start = time.perf_counter()
+        try:
+            return super()._eval_rule(rule, level, group, position)
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = self._nested.pop()
+            if self._nested:
+                self._nested[-1] += elapsed
+            self.timings.setdefault(rule.name, []).append(elapsed - nested)
+
+
+def run_case(config: Path, corpus_dir: Path, covers: int, size: Tuple[int, int], stegos_per_cover: int = 3,
+             seed: int = 0) -> dict:
+    """Benchmark the rules of the config on a generated corpus in a fresh process.
+
+    The corpus is generated once in a folder of `corpus_dir` named after its parameters and reused afterward.
+    The evaluation runs in its own process, so the peak memory is the one of this case alone.
+
+    :return: The results with the number of pairs, pairs per second, peak RSS and the latencies of the rules
+    """
+
+    root = corpus_dir / f'{covers}x{stegos_per_cover}-{size[0]}x{size[1]}-{seed}'
+    if (root / 'pairs.txt').exists():
+        pairs = _read_pairs(root / 'pairs.txt')
+    else:
+        pairs = [(p.cover, p.stego) for p in corpus.generate(root, covers, size=size,
+                                                             stegos_per_cover=stegos_per_cover, seed=seed)]
+
+    with ProcessPoolExecutor(1, mp_context=get_context('spawn')) as pool:
+        result = pool.submit(_evaluate, config, pairs).result()
+    return {'covers': covers, 'stegos_per_cover': stegos_per_cover, 'size': list(size), 'seed': seed, **result}
+
+
+def _read_pairs(path: Path) -> List[Tuple[Path, Path]]:
+    with open(path) as file:
+        return [tuple(Path(p) for p in line.strip().split(',')[:2]) for line in file if line.strip()]
+
+
+def _evaluate(config: Path, pairs: List[Tuple[Path, Path]]) -> dict:
+    evaluator = TimingEvaluator(_load_config(config))
+    errors = 0
+    start = time.perf_counter()
+    for _, error in _iter_checks(evaluator, pairs):
+        errors += error is not None
+    seconds = time.perf_counter() - start
+
+    return {
+        'pairs': len(pairs),
+        'errors': errors,
+        'seconds': seconds,
+        'pairs_per_sec': len(pairs) / seconds if seconds else 0.0,
+        'peak_rss_mb': _peak_rss() / 1024 ** 2,
+        'rules': {name: _latency(times) for name, times in sorted(evaluator.timings.items())}
+    }
+
+
+def _latency(times: List[float]) -> dict:
+    times = np.array(times) * 1000
+    return {
+        'calls': len(times),
+        'mean_ms': float(times.mean()),
+        'p95_ms': float(np.percentile(times, 95)),
+        'total_ms': float(times.sum())
+    }
+
+
+def _peak_rss() -> int:
+    """Return the peak resident set size of this process in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def environment() -> dict:
+    """Describe the machine the benchmark runs on, so results of different machines are not compared by mistake."""
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float = 10.0) -> Tuple[List[str], bool]:
+    """Compare the results of two benchmark runs case by case.
+
+    :param threshold: The decrease of pairs per second or increase of the peak RSS in percent counted as regression
+    :return: The lines of the comparison and whether any case regressed
+    """
+
+    def _key(case: dict) -> tuple:
+        return case['covers'], case['stegos_per_cover'], tuple(case['size']), case['seed']
+
+    base_cases = {_key(c): c for c in baseline['cases']}
+    lines, regressed = [], False
+    for case in current['cases']:
+        base: Optional[dict] = base_cases.get(_key(case))
+        name = f"{case['pairs']} pairs of {case['size'][0]}x{case['size'][1]}"
+        if base is None:
+            lines.append(f'{name}: no baseline')
+            continue
+
+        speed = _change(base['pairs_per_sec'], case['pairs_per_sec'])
+        rss = _change(base['peak_rss_mb'], case['peak_rss_mb'])
+        case_regressed = speed < -threshold or rss > threshold
+        regressed |= case_regressed
+        lines.append(f"{name}: {case['pairs_per_sec']:.1f} pairs/s ({speed:+.1f} %), "
+                     f"{case['peak_rss_mb']:.0f} MB peak RSS ({rss:+.1f} %)"
+                     + (' REGRESSION' if case_regressed else ''))
+    return lines, regressed
+
+
+def _change(before: float, after: float) -> float:
+    return (after - before) / before * 100 if before else 0.0
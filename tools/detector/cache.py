@@ -0,0 +1,220 @@
+import hashlib
+import pickle
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import click
+import numpy as np
+
+_CACHEABLE = (bool, int, float, str, bytes, tuple, list, dict, type(None), np.generic, np.ndarray)
+"""The types of values that are stored in the cache. Other values like lazy LSB streams are always computed."""
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS features (
+    key TEXT PRIMARY KEY,
+    feature TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS features_last_used ON features (last_used);
+'''
+
+_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+class FeatureCache:
+    """A persistent cache of the values of features in a SQLite database.
+
+    The values are stored by the normalized value expression, the version of the code of its feature providers
+    (see `features.version`) and the fingerprints of the cover and stego image.
+    A fingerprint consists of the resolved path, the modification time and the size of the file or, if
+    `by_content` is set, of the SHA-256 hash of its content. Changes are committed in batches and the least
+    recently used values are evicted if the cache grows beyond `max_size` bytes.
+    Lazy LSB streams are not stored, as storing them would extract all their bytes when they are computed instead
+    of only the bytes their conditions read.
+    """
+
+    def __init__(self, path: Path, *, max_size: Optional[int] = None, by_content: bool = False,
+                 batch_size: int = 100):
+        self.path = Path(path)
+        self.max_size = max_size
+        self.by_content = by_content
+        self.batch_size = batch_size
+        self.hits = 0
+        self.misses = 0
+        self._pending = 0
+        self._hashes: Dict[Tuple[str, int, int], str] = {}
+
+        self._db = sqlite3.connect(self.path, timeout=60)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(_SCHEMA)
+
+    def fingerprint(self, image) -> str:
+        """Return the fingerprint of an `ImageFile`."""
+        stat = image.stat()
+        path = str(image.path.resolve())
+        if not self.by_content:
+            return f'{path}:{stat.st_mtime_ns}:{stat.st_size}'
+
+        stat_key = (path, stat.st_mtime_ns, stat.st_size)
+        if stat_key not in self._hashes:
+            digest = hashlib.sha256()
+            with image.open() as file:
+                for block in iter(lambda: file.read(1 << 20), b''):
+                    digest.update(block)
+            self._hashes[stat_key] = digest.hexdigest()
+        return self._hashes[stat_key]
+
+    def _key(self, feature: str, cover, stego, version: str) -> str:
+        parts = (feature, version, self.fingerprint(cover), self.fingerprint(stego))
+        return hashlib.sha256('\0'.join(parts).encode()).hexdigest()
+
+    def get(self, feature: str, cover, stego, version: str = '') -> Tuple[bool, Any]:
+        """Return whether the value of a feature for the images is cached and the value.
+
+        :param version: The version of the code computing the feature the value must have been stored with
+        """
+        key = self._key(feature, cover, stego, version)
+        row = self._db.execute('SELECT value FROM features WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return False, None
+
+        self.hits += 1
+        self._db.execute('UPDATE features SET last_used = ? WHERE key = ?', (time.time(), key))
+        self._changed()
+        return True, pickle.loads(row[0])
+
+    def put(self, feature: str, cover, stego, value, *, name: Optional[str] = None, version: str = '') -> bool:
+        """Store the value of a feature for the images if it is of a cacheable type.
+
+        :param name: A readable name of the feature to show in the statistics (e.g. its expression)
+        :param version: The version of the code computing the feature
+        :return: Whether the value was stored
+        """
+        if not isinstance(value, _CACHEABLE):
+            return False
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        self._db.execute(
+            'INSERT OR REPLACE INTO features (key, feature, value, size, last_used) VALUES (?, ?, ?, ?, ?)',
+            (self._key(feature, cover, stego, version), name or feature, data, len(data), time.time())
+        )
+        self._changed()
+        return True
+
+    def _changed(self):
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self.commit()
+
+    def commit(self):
+        """Commit the pending changes and evict values if the cache is too large."""
+        if self.max_size is not None:
+            self.prune(self.max_size)
+        self._db.commit()
+        self._pending = 0
+
+    def prune(self, max_size: int) -> int:
+        """Evict the least recently used values until the values take at most `max_size` bytes.
+
+        :return: The number of evicted values
+        """
+        cursor = self._db.execute('''
+            DELETE FROM features WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(size) OVER (ORDER BY last_used DESC, key) AS total FROM features
+                ) WHERE total > ?
+            )
+        ''', (max_size,))
+        return cursor.rowcount
+
+    def clear(self, name: Optional[str] = None) -> int:
+        """Remove all values or only the values of the feature with the given name.
+
+        :return: The number of removed values
+        """
+        if name is None:
+            return self._db.execute('DELETE FROM features').rowcount
+        return self._db.execute('DELETE FROM features WHERE feature = ?', (name,)).rowcount
+
+    def stats(self) -> Dict[str, Tuple[int, int]]:
+        """Return the number of values and their size in bytes by feature name."""
+        rows = self._db.execute('SELECT feature, COUNT(*), SUM(size) FROM features GROUP BY feature ORDER BY feature')
+        return {feature: (count, size) for feature, count, size in rows}
+
+    def close(self):
+        self.commit()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def parse_size(size: str) -> int:
+    """Parse a size like "512", "100K", "20M" or "1G" into bytes."""
+    size = size.strip().upper().removesuffix('B')
+    unit = size[-1:] if size[-1:] in _UNITS else ''
+    try:
+        return int(float(size[:len(size) - len(unit)]) * _UNITS[unit])
+    except ValueError:
+        raise click.BadParameter(f'Not a valid size: {size}')
+
+
+def _format_size(size: int) -> str:
+    for unit in ['', 'K', 'M']:
+        if size < 1024:
+            return f'{size:.0f} {unit}B'
+        size /= 1024
+    return f'{size:.1f} GB'
+
+
+_cache_path = click.argument('cache_path', type=click.Path(exists=True, dir_okay=False, path_type=Path))
+
+
+@click.group()
+def cache():
+    """Inspects and prunes a feature cache of the detector.
+
+    CACHE_PATH is the SQLite database passed to `detect.py --cache`.
+    """
+
+
+@cache.command()
+@_cache_path
+def stats(cache_path: Path):
+    """Shows the number and size of the cached values per feature."""
+    with FeatureCache(cache_path) as feature_cache:
+        entries = feature_cache.stats()
+    for feature, (count, size) in entries.items():
+        click.echo(f'{count:>8} {_format_size(size):>10}  {feature}')
+    click.echo(f'{sum(c for c, _ in entries.values()):>8} '
+               f'{_format_size(sum(s for _, s in entries.values())):>10}  in total')
+
+
+@cache.command()
+@_cache_path
+@click.option('-s', '--max-size', required=True, type=str, help='Maximum size of the cached values (e.g. "500M")')
+def prune(cache_path: Path, max_size: str):
+    """Evicts the least recently used values until the cache has the maximum size."""
+    with FeatureCache(cache_path) as feature_cache:
+        click.echo(f'Evicted {feature_cache.prune(parse_size(max_size))} values')
+
+
+@cache.command()
+@_cache_path
+@click.option('-f', '--feature', type=str, help='Only remove the values of this feature (as shown by "stats")')
+def clear(cache_path: Path, feature: Optional[str]):
+    """Removes the cached values."""
+    with FeatureCache(cache_path) as feature_cache:
+        click.echo(f'Removed {feature_cache.clear(feature)} values')
+
+
+if __name__ == '__main__':
+    cache()
@@ -0,0 +1,64 @@
+import http.client
+import json
+import os
+import urllib.error
+import urllib.request
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import click
+
+DEFAULT_PORT = 8765
+"""The port of the server on localhost if none is given."""
+
+
+@click.command()
+@click.option("-i", "--cover-image", type=click.Path(path_type=Path), help="Path to the cover image")
+@click.option("-s", "--stego-image", type=click.Path(path_type=Path), multiple=True,
+              help="Path to a stego image (can be repeated)")
+@click.option("--from-stdin", is_flag=True,
+              help="Read cover and stego images from stdin as pairs of paths separated by a comma")
+@click.option("--batch-size", default=1000, type=click.IntRange(min=1),
+              help="Number of pairs read from stdin sent to the server at once")
+@click.option("--url", default=f"http://127.0.0.1:{DEFAULT_PORT}", help="URL of the server")
+def check(cover_image: Optional[Path], stego_image: Tuple[Path, ...], from_stdin: bool, batch_size: int, url: str):
+    """Checks pairs with a running server of server.py and prints the detections as JSON lines.
+
+    Only the standard library and click are imported, so a check takes milliseconds.
+    The errors of pairs are printed to stderr. Relative paths are resolved in the current directory.
+    """
+    if from_stdin:
+        pairs = ((cover.strip(), stego.strip()) for cover, stego, *_ in
+                 (line.split(",") for line in click.get_text_stream('stdin') if line.strip()))
+    elif cover_image and stego_image:
+        pairs = ((cover_image, s) for s in stego_image)
+    else:
+        raise click.BadParameter("Either provide the cover and stego images or use --from-stdin")
+
+    batch = []
+    for cover, stego in pairs:
+        batch.append([os.path.abspath(cover), os.path.abspath(stego)])
+        if len(batch) == batch_size:
+            _send_batch(url, batch)
+            batch = []
+    if batch:
+        _send_batch(url, batch)
+
+
+def _send_batch(url: str, pairs: List[List[str]]):
+    request = urllib.request.Request(f"{url.rstrip('/')}/check", data=json.dumps({'pairs': pairs}).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request) as response:
+            result = json.load(response)
+    except (urllib.error.URLError, ConnectionError, http.client.HTTPException) as e:
+        # A server stopped during the request resets the connection instead of refusing it
+        raise click.ClickException(f"Cannot reach the server at {url}: {getattr(e, 'reason', e)}")
+    for detection in result['detections']:
+        click.echo(json.dumps(detection))
+    for error in result['errors']:
+        click.echo(f"{error['cover']}, {error['stego']}: {error['error']}", err=True)
+
+
+if __name__ == '__main__':
+    check()
@@ -0,0 +1,113 @@
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import files
+from config import Matcher, Rule
+from eval import Evaluator
+
+COLUMNS: Dict[str, Callable[[Sequence[Path], Sequence[Path]], np.ndarray]] = {
+    Matcher('files.size_diff(cover, stego)', 'True').key: files.size_diffs,
+}
+"""Vectorized implementations of scalar value expressions by their normalized expression.
+
+An implementation computes the values of many pairs from the lists of cover and stego paths at once.
+A value is NaN if it cannot be computed for a pair, e.g. because an image is missing.
+"""
+
+
+class ColumnarEvaluator:
+    """Evaluates the rules of a config for many pairs at once.
+
+    Top-level rules with a range condition like `-2.63 <= value <= -0.25` on a value in `COLUMNS` are evaluated
+    as vectorized masks over the values of all pairs. Only the next rules of the matching pairs and the other
+    rules are evaluated pair by pair with the evaluator. The results are the same as the ones of
+    `Evaluator.check`, but the scalar features of a whole dataset only need a few vector operations.
+    """
+
+    def __init__(self, evaluator: Evaluator, columns: Optional[Dict[str, Callable]] = None):
+        self.evaluator = evaluator
+        self.columns = COLUMNS if columns is None else columns
+        self.vectorized = {
+            position for position, rule in enumerate(evaluator.config.rules)
+            if isinstance(rule, Rule) and isinstance(rule.match, Matcher) and rule.match.interval is not None
+            and rule.match.key in self.columns
+        }
+        """The positions of the top-level rules that are evaluated as masks."""
+
+    def features(self, pairs: Sequence[Tuple[Path, Path]]) -> Dict[str, np.ndarray]:
+        """Compute the values of the vectorized rules for the pairs by their value expressions.
+
+        The result can be turned into a table with `pandas.DataFrame(features)` to explore thresholds.
+        """
+        covers, stegos = [c for c, _ in pairs], [s for _, s in pairs]
+        by_key, values = {}, {}
+        for position in sorted(self.vectorized):
+            matcher = self.evaluator.config.rules[position].match
+            if matcher.key not in by_key:
+                by_key[matcher.key] = self.columns[matcher.key](covers, stegos)
+            values[matcher.value] = by_key[matcher.key]
+        return values
+
+    def masks(self, features: Dict[str, np.ndarray]) -> Dict[int, np.ndarray]:
+        """Evaluate the conditions of the vectorized rules on the values of `features` by rule position."""
+        rules = self.evaluator.config.rules
+        return {p: rules[p].match.interval.mask(features[rules[p].match.value]) for p in self.vectorized}
+
+    def check_all(self, pairs: Sequence[Tuple[Path, Path]]) \
+            -> Iterator[Tuple[Optional[dict], Optional[List[Rule]], Optional[Exception]]]:
+        """Check the pairs and yield the weights and matched rules or the error of each pair in input order."""
+
+        features = self.features(pairs)
+        masks = self.masks(features)
+        # Pairs with values that cannot be computed are checked completely to get the same errors and results
+        invalid = np.zeros(len(pairs), dtype=bool)
+        for values in features.values():
+            invalid |= np.isnan(values)
+
+        rules = self.evaluator.config.rules
+        # Only pairs with matching rules that have next rules or with rules that are not vectorized need a session
+        session = np.full(len(pairs), len(self.vectorized) < len(rules))
+        for position, mask in masks.items():
+            if rules[position].next:
+                session |= mask
+
+        for i, (cover, stego) in enumerate(pairs):
+            if not invalid[i] and not session[i]:
+                yield *self._credit(masks, i), None
+                continue
+
+            result, error = (None, None), None
+            try:
+                if invalid[i]:
+                    self.evaluator.check(cover, stego)
+                    result = dict(self.evaluator.weights), list(self.evaluator.matched_rules)
+                else:
+                    result = self._check_session(cover, stego, masks, i)
+            except Exception as e:
+                error = e
+            yield *result, error
+
+    def _check_session(self, cover: Path, stego: Path, masks: Dict[int, np.ndarray], i: int) \
+            -> Tuple[dict, List[Rule]]:
+        evaluator = self.evaluator
+        with evaluator.session(cover, stego):
+            for position, rule in enumerate(evaluator.config.rules):
+                if position not in masks:
+                    evaluator.eval_rule(rule, position)
+                elif masks[position][i]:
+                    evaluator.credit(rule)
+                    if rule.next:
+                        evaluator.eval_rule(rule.next)
+            return dict(evaluator.weights), list(evaluator.matched_rules)
+
+    def _credit(self, masks: Dict[int, np.ndarray], i: int) -> Tuple[dict, List[Rule]]:
+        weights, matched_rules = {}, []
+        for position in sorted(masks):
+            if masks[position][i]:
+                rule = self.evaluator.config.rules[position]
+                matched_rules.append(rule)
+                for tool in rule.tools:
+                    weights[tool.name] = weights.get(tool.name, 0) + tool.weight
+        return weights, matched_rules
@@ -1,5 +1,24 @@
-from dataclasses import dataclass
-from typing import List, Optional, Union
+import ast
+from dataclasses import dataclass, field, fields
+from types import CodeType
+from typing import Dict, FrozenSet, List, Optional, Union
+
+from intervals import Interval, IntervalIndex
+
+
+def _init_state(obj) -> dict:
+    """Return the fields of a dataclass object that are passed to its constructor as the state to pickle it with.
+
+    The derived fields are left out, because compiled expressions cannot be pickled and the ids of shared rule
+    nodes differ in another process. They are computed again by `__post_init__` when the object is unpickled.
+    """
+    return {f.name: getattr(obj, f.name) for f in fields(obj) if f.init}
+
+
+def _set_init_state(obj, state: dict):
+    """Restore a dataclass object from the state of `_init_state` and compute its derived fields."""
+    obj.__dict__.update(state)
+    obj.__post_init__()
 
 
 def _check_is_type(rule_dict, key: str, _type):
@@ -11,6 +30,40 @@ def _check_is_type(rule_dict, key: str, _type):
     return name
 
 
+def _compile(expr: str, key: str) -> CodeType:
+    """Compile the expression of the given key once. If it is not a valid Python expression, raise a ValueError."""
+    try:
+        return compile(expr.strip(), f'<{key}: {expr}>', 'eval')
+    except SyntaxError as e:
+        raise ValueError(f'The "{key}" field is not a valid expression: {expr} ({e.msg})') from e
+
+
+def _normalize(expr: str) -> str:
+    """Normalize an expression so that formatting differences do not matter when comparing it."""
+    return ast.dump(ast.parse(expr.strip(), mode='eval'))
+
+
+def _names(expr: str) -> FrozenSet[str]:
+    """Return the names of the variables an expression reads."""
+    return frozenset(n.id for n in ast.walk(ast.parse(expr.strip(), mode='eval')) if isinstance(n, ast.Name))
+
+
+def _rule_names(rules: List[Union['Rule', 'CompoundRule']]) -> FrozenSet[str]:
+    """Return the names of the variables the expressions of the rules and all their sub-rules read."""
+    names = set()
+    for rule in rules:
+        if isinstance(rule, CompoundRule):
+            names |= _rule_names(rule.rules)
+            continue
+        if isinstance(rule.match, Matcher):
+            names |= rule.match.names | _names(rule.match.cond)
+        else:
+            names |= _names(rule.match)
+        if rule.next:
+            names |= _rule_names([rule.next])
+    return frozenset(names)
+
+
 @dataclass
 class Tool:
     """Represents a stego tool."""
@@ -57,6 +110,34 @@ class Matcher:
     cond: str
     """The condition to check the value against."""
 
+    value_code: CodeType = field(init=False, repr=False, compare=False)
+    """The compiled value expression."""
+
+    cond_code: CodeType = field(init=False, repr=False, compare=False)
+    """The compiled condition."""
+
+    key: str = field(init=False, repr=False, compare=False)
+    """The normalized value expression used to identify equal values of different rules."""
+
+    interval: Optional[Interval] = field(init=False, repr=False, compare=False)
+    """The range of numbers the value must be in if the condition is a simple range check."""
+
+    names: FrozenSet[str] = field(init=False, repr=False, compare=False)
+    """The names of the variables the value expression reads like "cover" or "stego"."""
+
+    def __post_init__(self):
+        self.value_code = _compile(self.value, 'value')
+        self.cond_code = _compile(self.cond, 'cond')
+        self.key = _normalize(self.value)
+        self.interval = Interval.from_cond(self.cond)
+        self.names = _names(self.value)
+
+    def __getstate__(self):
+        return _init_state(self)
+
+    def __setstate__(self, state):
+        _set_init_state(self, state)
+
     def __str__(self):
         return self.cond + ' with value = ' + self.value
 
@@ -67,7 +148,11 @@ class Matcher:
         if isinstance(match_dict, str):
             return match_dict
         elif isinstance(match_dict, dict):
-            return Matcher(match_dict['value'], match_dict['cond'])
+            if 'value' not in match_dict or 'cond' not in match_dict:
+                raise ValueError('A match expression needs a "value" and a "cond" field')
+            value = _check_is_type(match_dict, 'value', str)
+            cond = _check_is_type(match_dict, 'cond', str)
+            return Matcher(value, cond)
         else:
             raise ValueError(f'Not a valid expression or dictionary: {match_dict}')
 
@@ -102,6 +187,41 @@ class MatchedTool:
         return MatchedTool(name, weight)
 
 
+@dataclass
+class RangeGroup:
+    """Represents sibling rules checking the same value against numeric ranges."""
+
+    index: IntervalIndex
+    """The index of the ranges of the rules."""
+
+    positions: Dict[int, int]
+    """Maps the positions of the rules among their siblings to their positions in the index."""
+
+    rules: List[int]
+    """The positions of the rules among their siblings in the order of the index."""
+
+
+def _group_ranges(rules: List[Union['Rule', 'CompoundRule']]) -> Dict[int, RangeGroup]:
+    """Group sibling rules with range conditions on the same value and map their positions to their group."""
+
+    candidates: Dict[str, List[int]] = {}
+    for position, rule in enumerate(rules):
+        if isinstance(rule, Rule) and isinstance(rule.match, Matcher) and rule.match.interval is not None:
+            candidates.setdefault(rule.match.key, []).append(position)
+
+    groups = {}
+    for positions in candidates.values():
+        if len(positions) < 2:
+            continue
+        group = RangeGroup(
+            IntervalIndex([rules[p].match.interval for p in positions]),
+            {p: i for i, p in enumerate(positions)},
+            positions
+        )
+        groups.update((p, group) for p in positions)
+    return groups
+
+
 @dataclass
 class Rule:
     """Represents a rule that can be applied to detect a stego tool in an image."""
@@ -124,6 +244,18 @@ class Rule:
     next: Optional[Union['Rule', 'CompoundRule']]
     """The next rule to be applied after this rule."""
 
+    match_code: Optional[CodeType] = field(init=False, repr=False, compare=False)
+    """The compiled match expression if it is not split into value and condition."""
+
+    def __post_init__(self):
+        self.match_code = _compile(self.match, 'match') if isinstance(self.match, str) else None
+
+    def __getstate__(self):
+        return _init_state(self)
+
+    def __setstate__(self, state):
+        _set_init_state(self, state)
+
     @staticmethod
     def from_dict(rule_dict: dict) -> Union['Rule', 'CompoundRule']:
         """Create a Rule object from a dictionary."""
@@ -186,6 +318,18 @@ class CompoundRule:
     rules: List[Union['Rule', 'CompoundRule']]
     """The sub-rules of this rule."""
 
+    groups: Dict[int, RangeGroup] = field(init=False, repr=False, compare=False)
+    """The groups of sub-rules with range conditions on the same value by the positions of the sub-rules."""
+
+    def __post_init__(self):
+        self.groups = _group_ranges(self.rules)
+
+    def __getstate__(self):
+        return _init_state(self)
+
+    def __setstate__(self, state):
+        _set_init_state(self, state)
+
     @staticmethod
     def from_dict(rule_dict) -> 'CompoundRule':
         """Create a CompoundRule object from a dictionary."""
@@ -219,7 +363,10 @@ class Config:
     
     `isd` stands for "Image Steganography Detector".
     
-    Current versions: "1", "1.0", "1.0.0
+    Current versions: "1", "1.0", "1.0.0", "1.1", "1.1.0"
+
+    Since version "1.1", rules can be defined once in a "definitions" mapping by name and referenced anywhere
+    a rule is expected with `ref: <name>`.
     """
 
     tools: List[Tool]
@@ -231,6 +378,29 @@ class Config:
     This corresponds to a compound rule with the operator "each".    
     """
 
+    groups: Dict[int, RangeGroup] = field(init=False, repr=False, compare=False)
+    """The groups of rules with range conditions on the same value by the positions of the rules."""
+
+    names: FrozenSet[str] = field(init=False, repr=False, compare=False)
+    """The names of the variables all expressions of the rules read like "files", "lsb" or "cover".
+
+    The feature providers among them are resolved by `features.resolve` when an evaluator is created.
+    """
+
+    shared: FrozenSet[int] = field(init=False, repr=False, compare=False)
+    """The ids of the rule nodes that are referenced by more than one parent, whose results are reused per pair."""
+
+    def __post_init__(self):
+        self.groups = _group_ranges(self.rules)
+        self.names = _rule_names(self.rules)
+        self.shared = _shared_nodes(self.rules)
+
+    def __getstate__(self):
+        return _init_state(self)
+
+    def __setstate__(self, state):
+        _set_init_state(self, state)
+
     @staticmethod
     def from_dict(config_dict):
         """Create a Config object from a dictionary."""
@@ -248,10 +418,76 @@ class Config:
 
         if "rules" not in config_dict:
             raise ValueError("Missing 'rules'")
-        rules = [Rule.from_dict(rule) for rule in config_dict['rules']]
+        rule_dicts = config_dict['rules']
+
+        if 'definitions' in config_dict:
+            if isd not in Config._versions()[3:]:
+                raise ValueError("Rule definitions need at least version '1.1'")
+            definitions = _check_is_type(config_dict, 'definitions', dict)
+            rule_dicts = [_resolve_refs(rule, definitions) for rule in rule_dicts]
+
+        # Structurally identical rules become the same node, so they are evaluated once per pair
+        nodes = {}
+        rules = [_intern(Rule.from_dict(rule), nodes) for rule in rule_dicts]
 
         return Config(isd, tools, rules)
 
     @staticmethod
     def _versions():
-        return ["1", "1.0", "1.0.0"]
+        return ["1", "1.0", "1.0.0", "1.1", "1.1.0"]
+
+
+def _resolve_refs(rule_dict, definitions: dict, refs: tuple = ()):
+    """Replace the references of a rule dict and its sub-rules with the rule dicts of the definitions."""
+
+    if not isinstance(rule_dict, dict):
+        return rule_dict
+    if 'ref' in rule_dict:
+        if len(rule_dict) > 1:
+            raise ValueError('A rule reference must only have the "ref" field')
+        name = _check_is_type(rule_dict, 'ref', str)
+        if name not in definitions:
+            raise ValueError(f'Unknown rule reference "{name}"')
+        if name in refs:
+            raise ValueError(f'Circular rule reference "{" > ".join(refs + (name,))}"')
+        return _resolve_refs(definitions[name], definitions, refs + (name,))
+
+    rule_dict = dict(rule_dict)
+    if rule_dict.get('next') is not None:
+        rule_dict['next'] = _resolve_refs(rule_dict['next'], definitions, refs)
+    if isinstance(rule_dict.get('rules'), list):
+        rule_dict['rules'] = [_resolve_refs(rule, definitions, refs) for rule in rule_dict['rules']]
+    return rule_dict
+
+
+def _intern(rule: Union[Rule, CompoundRule], nodes: dict) -> Union[Rule, CompoundRule]:
+    """Return the node of a structurally identical rule in `nodes` or add the rule after interning its sub-rules."""
+
+    if isinstance(rule, Rule):
+        if rule.next:
+            rule.next = _intern(rule.next, nodes)
+        match = _normalize(rule.match) if isinstance(rule.match, str) \
+            else (rule.match.key, _normalize(rule.match.cond))
+        key = ('rule', rule.name, rule.desc, tuple(rule.tags), match, tuple((t.name, t.weight) for t in rule.tools),
+               id(rule.next))
+    else:
+        rule.rules = [_intern(r, nodes) for r in rule.rules]
+        key = ('compound', rule.name, rule.desc, tuple(rule.tags), rule.operator, tuple(id(r) for r in rule.rules))
+    return nodes.setdefault(key, rule)
+
+
+def _shared_nodes(rules: List[Union[Rule, CompoundRule]]) -> FrozenSet[int]:
+    """Return the ids of the rule nodes with more than one parent."""
+
+    parents: Dict[int, int] = {}
+
+    def _count(children):
+        for child in children:
+            parents[id(child)] = parents.get(id(child), 0) + 1
+            # The sub-rules of a node are only counted once, however often the node is referenced
+            if parents[id(child)] == 1:
+                _count([child.next] if isinstance(child, Rule) and child.next else
+                       child.rules if isinstance(child, CompoundRule) else [])
+
+    _count(rules)
+    return frozenset(node for node, count in parents.items() if count > 1)
@@ -0,0 +1,214 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import combinations
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple, Union
+
+import click
+import numpy as np
+from PIL import Image
+
+INDEX_VERSION = 1
+"""The version of the index format, which is increased on incompatible changes."""
+
+BLOCKS = 4
+"""The number of 16-bit blocks of a fingerprint, which are indexed separately."""
+
+_HASH_SIZE = 8
+_DCT_SIZE = 32
+
+
+def _dct_matrix(size: int) -> np.ndarray:
+    n = np.arange(size)
+    matrix = np.sqrt(2 / size) * np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size))
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_DCT = _dct_matrix(_DCT_SIZE)
+
+
+def fingerprint(image: Union[Path, Image.Image]) -> int:
+    """Compute the 64-bit perceptual hash of an image.
+
+    The image is reduced to 32x32 grayscale pixels, whose lowest 8x8 frequencies of the discrete cosine
+    transform are compared with their median. Changes of the least significant bits, re-encoding and scaling
+    only flip a few bits, so the cover of a stego image has a fingerprint with a small Hamming distance.
+    """
+    if not isinstance(image, Image.Image):
+        with Image.open(image) as opened:
+            return fingerprint(opened)
+    pixels = np.asarray(image.convert('L').resize((_DCT_SIZE, _DCT_SIZE), Image.Resampling.BOX), dtype=np.float64)
+    frequencies = (_DCT @ pixels @ _DCT.T)[:_HASH_SIZE, :_HASH_SIZE].ravel()
+    bits = frequencies > np.median(frequencies[1:])
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def _read(path: Path) -> Tuple[int, int, int]:
+    with Image.open(path) as image:
+        return fingerprint(image), image.width, image.height
+
+
+def _distances(hashes: np.ndarray, value: int) -> np.ndarray:
+    """Return the Hamming distances of the fingerprints to a fingerprint."""
+    xor = np.bitwise_xor(np.asarray(hashes, dtype=np.uint64), np.uint64(value))
+    return np.unpackbits(xor.view(np.uint8)).reshape(len(xor), 64).sum(axis=1)
+
+
+def _masks(distance: int) -> np.ndarray:
+    """Return all 16-bit masks with at most `distance` set bits."""
+    return np.array([sum(1 << b for b in bits) for d in range(distance + 1) for bits in combinations(range(16), d)],
+                    dtype=np.uint64)
+
+
+@dataclass
+class CoverIndex:
+    """Represents the fingerprints of the images of a cover folder, in which the cover of a stego image is looked up.
+
+    The fingerprints are split into `BLOCKS` blocks of 16 bits, whose values are sorted per block. Two
+    fingerprints within a Hamming distance of d have a block within a distance of d // `BLOCKS` by the pigeonhole
+    principle, so the candidates are found by binary searches of the few block values within that distance
+    instead of comparing all fingerprints. The arrays are stored as NumPy files that are memory-mapped when loaded.
+    """
+
+    root: str
+    """The cover folder."""
+
+    names: np.ndarray
+    """The file names of the cover images."""
+
+    hashes: np.ndarray
+    """The fingerprints of the cover images."""
+
+    sizes: np.ndarray
+    """The widths and heights of the cover images of shape (n, 2)."""
+
+    block_values: np.ndarray
+    """The sorted values of each block of the fingerprints of shape (`BLOCKS`, n)."""
+
+    block_rows: np.ndarray
+    """The positions of the cover images of the sorted block values of shape (`BLOCKS`, n)."""
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @classmethod
+    def from_fingerprints(cls, root: Union[str, Path], names: List[str], hashes: List[int],
+                          sizes: List[Tuple[int, int]]) -> 'CoverIndex':
+        hashes = np.array(hashes, dtype=np.uint64)
+        blocks = np.stack([(hashes >> np.uint64(16 * b)) & np.uint64(0xFFFF) for b in range(BLOCKS)])
+        rows = np.argsort(blocks, axis=1, kind='stable')
+        return cls(
+            root=str(root),
+            names=np.array(names, dtype=str),
+            hashes=hashes,
+            sizes=np.array(sizes, dtype=np.int32).reshape(len(names), 2),
+            block_values=np.take_along_axis(blocks, rows, axis=1),
+            block_rows=rows.astype(np.int64)
+        )
+
+    @classmethod
+    def build(cls, folder: Path, *, workers: int = 1,
+              handle_invalid: Optional[Callable[[Path, Exception], None]] = None) -> 'CoverIndex':
+        """Compute the fingerprints of the images of a folder, skipping files that are not readable images.
+
+        :param workers: Number of worker processes computing the fingerprints (0 uses all CPUs)
+        :param handle_invalid: Function called with the path and the error of each skipped file
+        """
+        extensions = Image.registered_extensions()
+        with os.scandir(folder) as entries:
+            paths = sorted(Path(entry.path) for entry in entries
+                           if entry.is_file() and os.path.splitext(entry.name)[1].lower() in extensions)
+
+        names, hashes, sizes = [], [], []
+        with ProcessPoolExecutor(workers or os.cpu_count()) as pool:
+            futures = [pool.submit(_read, path) for path in paths]
+            for path, future in zip(paths, futures):
+                try:
+                    value, width, height = future.result()
+                except Exception as e:
+                    if handle_invalid:
+                        handle_invalid(path, e)
+                    continue
+                names.append(path.name)
+                hashes.append(value)
+                sizes.append((width, height))
+        return cls.from_fingerprints(folder, names, hashes, sizes)
+
+    def candidates(self, value: int, max_distance: int) -> np.ndarray:
+        """Return the positions of the cover images whose fingerprints are within `max_distance` of a fingerprint."""
+        masks = _masks(max_distance // BLOCKS)
+        rows = []
+        for b in range(BLOCKS):
+            queries = np.bitwise_xor(masks, np.uint64((value >> (16 * b)) & 0xFFFF))
+            starts = np.searchsorted(self.block_values[b], queries, side='left')
+            stops = np.searchsorted(self.block_values[b], queries, side='right')
+            rows.extend(self.block_rows[b, start:stop] for start, stop in zip(starts, stops) if start < stop)
+        if not rows:
+            return np.empty(0, dtype=np.int64)
+        rows = np.unique(np.concatenate(rows))
+        return rows[_distances(self.hashes[rows], value) <= max_distance]
+
+    def lookup(self, image_path: Path, max_distance: int = 8) -> Optional[Tuple[Path, int]]:
+        """Find the cover image of an image with the nearest fingerprint within `max_distance` bits.
+
+        Of covers at the same distance, the ones with the size of the image are preferred.
+
+        :return: The path of the cover image and the distance or None if no cover is close enough
+        """
+        with Image.open(image_path) as image:
+            value, size = fingerprint(image), (image.width, image.height)
+        rows = self.candidates(value, max_distance)
+        if len(rows) == 0:
+            return None
+        distances = _distances(self.hashes[rows], value)
+        other_size = np.any(self.sizes[rows] != size, axis=1)
+        best = rows[np.lexsort((rows, other_size, distances))[0]]
+        return Path(self.root) / str(self.names[best]), int(distances[rows == best][0])
+
+    def save(self, path: Path):
+        """Write the index as a folder of NumPy files and a JSON file of its version and root."""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in ('names', 'hashes', 'sizes', 'block_values', 'block_rows'):
+            np.save(path / f'{name}.npy', getattr(self, name))
+        (path / 'index.json').write_text(json.dumps({'version': INDEX_VERSION, 'root': self.root}))
+
+    @classmethod
+    def load(cls, path: Path) -> 'CoverIndex':
+        """Memory-map an index written by `save`, so only the pages of the looked up blocks are read."""
+        path = Path(path)
+        try:
+            meta = json.loads((path / 'index.json').read_text())
+            if meta['version'] != INDEX_VERSION:
+                raise ValueError(f'Unsupported cover index version {meta["version"]} of "{path}"')
+            return cls(meta['root'], **{
+                name: np.load(path / f'{name}.npy', mmap_mode='r')
+                for name in ('names', 'hashes', 'sizes', 'block_values', 'block_rows')
+            })
+        except (KeyError, OSError) as e:
+            raise ValueError(f'Not a cover index: "{path}"') from e
+
+
+@click.command()
+@click.argument('covers', type=click.Path(exists=True, file_okay=False, path_type=Path))
+@click.option("-o", "--output", required=True, type=click.Path(file_okay=False, path_type=Path),
+              help="Folder to write the index to")
+@click.option("-j", "--jobs", default=0, type=click.IntRange(min=0),
+              help="Number of worker processes computing the fingerprints (0 uses all CPUs)")
+def index_covers(covers: Path, output: Path, jobs: int):
+    """Builds an index of the fingerprints of the images in COVERS for `detect.py --cover-index`.
+
+    The fingerprints are perceptual hashes, which are robust to LSB embedding and re-encoding, so the cover of
+    a stego image is found without comparing it to all covers. Files that are not readable images are skipped.
+    """
+    index = CoverIndex.build(covers.resolve(), workers=jobs,
+                             handle_invalid=lambda p, e: click.echo(f"Skipping {p}: {e}", err=True))
+    index.save(output)
+    click.echo(f"Indexed {len(index)} covers", err=True)
+
+
+if __name__ == '__main__':
+    index_covers()
@@ -1,45 +1,176 @@
+import os
 import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from dataclasses import dataclass
+from itertools import chain, groupby, islice
+from operator import itemgetter
 from pathlib import Path
-from typing import List, Tuple, Generator, Optional, Callable
+from typing import Dict, List, Tuple, Generator, Optional, Callable, Iterable, Iterator, Union
 
 import click
 from dataclasses_json import dataclass_json
 import yaml
 
-from eval import Evaluator
+from cache import FeatureCache, parse_size
+from columnar import ColumnarEvaluator
+from eval import Evaluator, ImageFile
+import features
+from journal import Journal, Progress
+from output import FORMATS, create_writer, _to_dict
+import pipeline
+from manifest import Manifest
+import ordering
+from ordering import OrderStats
+from profiling import Profiler, SORT_KEYS
 from config import Config
+from coverindex import CoverIndex
 
 
-@dataclass(frozen=True)
 @dataclass_json
+@dataclass(frozen=True)
 class Detection:
     cover: Path
     stego: Path
     weights: dict
     matched_rules: List[str]
+    decision: Optional[str] = None
+
+
+class CheckError(Exception):
+    """The error of the check of a pair of a cover and a stego image."""
+
+    def __init__(self, cover: Path, stego: Path, error: Exception):
+        super().__init__(cover, stego, error)
+        self.cover = cover
+        self.stego = stego
+        self.error = error
+
+    def __str__(self):
+        return f"{self.cover}, {self.stego}: {self.error}"
 
 
 @click.command()
 @click.option("-i", "--cover-image", type=click.Path(exists=True, path_type=Path),
               help="Path to a cover image")
-@click.option("-s", "--stego-image", type=click.Path(exists=True, path_type=Path),
-              help="Path to a stego image")
+@click.option("-s", "--stego-image", type=click.Path(exists=True, path_type=Path), multiple=True,
+              help="Path to a stego image (can be given multiple times to check them against the same cover)")
 @click.option("--from-stdin", is_flag=True,
               help="Read cover and stego images from stdin as pairs of paths separated by a comma")
+@click.option("--manifest", "manifest_path", type=click.Path(exists=True, dir_okay=False, path_type=Path),
+              help="Read cover and stego images from a manifest written by cs-pair.py --output")
+@click.option("--cover-index", "cover_index_path", type=click.Path(exists=True, file_okay=False, path_type=Path),
+              help="Look up the cover of each stego image in an index of coverindex.py instead of providing it")
+@click.option("--cover-distance", default=8, type=click.IntRange(min=0, max=64),
+              help="Maximum number of differing bits of the fingerprints of a stego image and its cover with --cover-index")
+@click.option("--group-by-cover", is_flag=True,
+              help="Reorder the pairs read from stdin or a manifest in windows, so the pairs of a cover are consecutive")
+@click.option("--group-window", default=10000, type=click.IntRange(min=1),
+              help="Number of pairs held in memory and reordered at once with --group-by-cover")
 @click.option("-c", "--config", required=True, type=click.Path(exists=True, dir_okay=False, path_type=Path),
               help="Path to the config file in YAML format")
 @click.option("--aletheia",
               default='../aletheia',
               type=click.Path(exists=True, file_okay=False, path_type=Path),
               help="Path to the Aletheia root folder")
-def detect(cover_image: Path, stego_image: Path, from_stdin: bool, config: Path, aletheia: Path):
+@click.option("-j", "--jobs", default=1, type=click.IntRange(min=0),
+              help="Number of worker processes to check the pairs with (0 uses all CPUs)")
+@click.option("--chunk-size", default=16, type=click.IntRange(min=1),
+              help="Number of pairs sent to a worker process at once")
+@click.option("--unordered", is_flag=True,
+              help="Print the results of the worker processes as they complete instead of in input order")
+@click.option("-f", "--format", "output_format", default="text", type=click.Choice(FORMATS),
+              help="Format of the detections, which are written as they are produced")
+@click.option("-o", "--output", type=click.Path(dir_okay=False, writable=True, path_type=Path),
+              help="Path to write the detections to instead of stdout (required for parquet)")
+@click.option("--prefetch", default=0, type=click.IntRange(min=0),
+              help="Number of pairs whose images are read ahead of the evaluation by I/O threads (0 disables it)")
+@click.option("--io-threads", default=4, type=click.IntRange(min=1),
+              help="Number of threads reading the images ahead with --prefetch")
+@click.option("--columnar", is_flag=True,
+              help="Evaluate range rules on scalar features like the file size difference for batches of pairs at once")
+@click.option("--batch-size", default=10000, type=click.IntRange(min=1),
+              help="Number of pairs evaluated at once with --columnar")
+@click.option("--reorder", is_flag=True,
+              help="Evaluate the sub-rules of any, all and none compound rules cheapest and most decisive first")
+@click.option("--warm-up", "warm_up", default=200, type=click.IntRange(min=1),
+              help="Number of pairs measured before the run to order the rules with --reorder")
+@click.option("--order-stats", type=click.Path(dir_okay=False, path_type=Path),
+              help="File of the measurements for --reorder, which is read if it exists and written after the warm-up otherwise")
+@click.option("--decision", "decide", is_flag=True,
+              help="Stop evaluating a pair once the tool with the highest weight is determined and output it")
+@click.option("--journal", "journal_path", type=click.Path(dir_okay=False, path_type=Path),
+              help="Path to a SQLite journal of the checked pairs, with which an interrupted run is resumed")
+@click.option("--retry-failed", is_flag=True,
+              help="Check the pairs again whose check failed in the journal instead of skipping them")
+@click.option("--progress", "show_progress", is_flag=True,
+              help="Print the number of checked pairs, the throughput and the ETA to stderr (implied by --journal)")
+@click.option("--profile", is_flag=True,
+              help="Print the time, calls, matches and errors of each rule and value expression to stderr")
+@click.option("--profile-sort", default="seconds", type=click.Choice(SORT_KEYS),
+              help="Column to sort the profile by")
+@click.option("--profile-json", type=click.Path(dir_okay=False, writable=True, path_type=Path),
+              help="Path to write the profile to as JSON")
+@click.option("--profile-trace", type=click.Path(dir_okay=False, writable=True, path_type=Path),
+              help="Path to write the profile to in the Chrome trace event format (chrome://tracing or Perfetto)")
+@click.option("--cache", "cache_path", type=click.Path(dir_okay=False, path_type=Path),
+              help="Path to a SQLite database to cache the values of features across runs")
+@click.option("--cache-size", type=str,
+              help="Maximum size of the cached values (e.g. \"500M\"), the least recently used ones are evicted")
+@click.option("--cache-by-content", is_flag=True,
+              help="Identify cached images by the hash of their content instead of their path, mtime and size")
+def detect(cover_image: Path, stego_image: Tuple[Path, ...], from_stdin: bool, manifest_path: Optional[Path],
+           cover_index_path: Optional[Path], cover_distance: int, group_by_cover: bool, group_window: int,
+           config: Path,
+           aletheia: Path, jobs: int, chunk_size: int, unordered: bool, output_format: str, output: Optional[Path],
+           prefetch: int, io_threads: int, columnar: bool, batch_size: int, reorder: bool, warm_up: int,
+           order_stats: Optional[Path], decide: bool, journal_path: Optional[Path], retry_failed: bool,
+           show_progress: bool, profile: bool, profile_sort: str, profile_json: Optional[Path],
+           profile_trace: Optional[Path], cache_path: Optional[Path], cache_size: Optional[str], cache_by_content: bool):
     """Detects the used stego tool to hide data in the image.
 
     The tool uses a config file to define rules for detecting the stego tool.
     Cover and stego images can be provided as arguments or read from stdin.
     If the images are read from stdin, they should be provided as pairs of paths separated by a comma.
     Only the first two values that are separated by a comma are considered and the rest is currently discarded.
+    The pairs can also be loaded from a manifest of cs-pair.py, whose files were checked when it was built.
+    Consecutive pairs with the same cover share it, so the cover and the features only depending on it are
+    computed once. A cover can also be checked with many stego images by repeating "-s". If the pairs of a cover
+    are scattered, "--group-by-cover" reorders them within windows of "--group-window" pairs, so the input is
+    still streamed with bounded memory.
+
+    With "--cover-index", only stego images are provided with "-s" or one per line on stdin, and the cover of
+    each is the image of the index with the nearest fingerprint. Stego images without a cover within
+    "--cover-distance" bits are skipped.
+
+    The detections are printed as text by default. With "--format jsonl", "csv" or "parquet", they are streamed
+    as JSON lines, CSV rows with a column per tool or Parquet row groups to stdout or the file of "--output".
+    The debug output of the rules is only printed for text checked in-process.
+
+    With "--prefetch", the images are checked and read by a pool of I/O threads ahead of the evaluation, so
+    the latency of slow or network-mounted disks is overlapped with the evaluation. Worker processes read
+    their images themselves.
+
+    With "--columnar", range rules on scalar features like the file size difference are evaluated for batches of
+    pairs at once with vectorized masks, and only the next rules of the matching pairs are evaluated pair by pair.
+
+    With "--reorder", the sub-rules of "any", "all" and "none" compound rules are evaluated in the order of their
+    expected cost divided by the probability that they decide the result. The costs and match rates are measured
+    on the first pairs before the run or read from "--order-stats". A compound rule is only reordered if the config
+    proves that at most one of its sub-rules can match, i.e. they are ranges of the same value that do not overlap,
+    and the chosen orders are printed to stderr.
+
+    With "--decision", the evaluation of a pair stops as soon as no remaining rule can make another tool reach
+    the weight of the leading tool. The decided tool is the one with the unique highest positive weight, which
+    is output as "decision" (or none if there is none), while the weights and matched rules are partial.
+
+    With "--journal", the detections and errors are committed to a journal in batches while the run progresses.
+    If the run is started again with the same journal and config, the pairs of the journal are skipped and its
+    detections are written first, so the output is complete. The failed pairs are only checked again with
+    "--retry-failed". The progress with the throughput and the ETA is printed to stderr every ten seconds.
+
+    With "--profile", the time, calls, matches and errors of each rule and value expression are printed to stderr
+    at the end. They can also be written as JSON or Chrome trace events with "--profile-json" and "--profile-trace".
 
     The config file should be in YAML format and contain a list of rules.
     Each rule should have a match condition and a list of tools with their weights.
@@ -61,87 +192,461 @@ def detect(cover_image: Path, stego_image: Path, from_stdin: bool, config: Path,
               - name: PixelKnot
                 weight: 5
             match:
-              value: attacks.size_diff([(cover.path, stego.path)])[0][3]
+              value: files.size_diff(cover, stego)
               cond: -3 <= value < 0
     """
     sys.path.append(str(aletheia))
+    try:
+        # The config is loaded once and passed to the evaluators of the run and its worker processes
+        config_obj = _load_config(config)
+    except ImportError as e:
+        raise click.ClickException(str(e))
 
-    if from_stdin:
-        pairs = _get_pairs_from_stdin()
+    if cover_index_path:
+        if cover_image or manifest_path:
+            raise click.BadParameter("The covers are looked up in the index, so only provide stego images",
+                                     param_hint="--cover-index")
+        try:
+            cover_index = CoverIndex.load(cover_index_path)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="--cover-index")
+        stegos = _get_stegos_from_stdin() if from_stdin else [s for s in stego_image if _check_image(s)]
+        pairs = _resolve_covers(cover_index, stegos, cover_distance)
+        if group_by_cover:
+            pairs = sort_by_cover(pairs, group_window)
+    elif manifest_path:
+        try:
+            pairs = Manifest.load(manifest_path).pairs()
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="--manifest")
+        if group_by_cover:
+            pairs = sort_by_cover(pairs, group_window)
+    elif from_stdin:
+        # With read-ahead, the paths are checked by the prefetch stage instead
+        pairs = _get_pairs_from_stdin(check=not prefetch or jobs != 1)
+        if group_by_cover:
+            pairs = sort_by_cover(pairs, group_window)
     else:
-        if not _check_image(cover_image) or not _check_image(stego_image):
-            raise click.BadParameter("Either provide the cover and stego images or use --from-stdin")
-        pairs = [(cover_image, stego_image)]
+        if not cover_image or not stego_image or not all(_check_image(p) for p in (cover_image, *stego_image)):
+            raise click.BadParameter("Either provide the cover and stego images or use --from-stdin or --manifest")
+        pairs = [(cover_image, s) for s in stego_image]
+
+    cache_options = {
+        'cache': cache_path,
+        'cache_size': parse_size(cache_size) if cache_size else None,
+        'cache_by_content': cache_by_content
+    }
 
-    config = _load_config(config)
-    evaluator = Evaluator(config, debug=True)
-    for cover_image, stego_image in pairs:
+    if columnar and jobs != 1:
+        raise click.BadParameter("The columnar evaluation runs in-process", param_hint="--jobs")
+    if columnar and decide:
+        raise click.BadParameter("The columnar evaluation evaluates all rules", param_hint="--decision")
+
+    journal = None
+    if journal_path:
         try:
-            evaluator.check(cover_image, stego_image)
-        except Exception as e:
-            click.echo(e, err=True)
+            journal = Journal(journal_path, config)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="--journal")
+        pending = journal.pending(pairs, retry_failed)
+        # Pairs given as list are counted for the progress, other inputs stay lazy
+        pairs = list(pending) if isinstance(pairs, list) else pending
+        if not retry_failed and journal.failed():
+            click.echo(f"Skipping the {len(journal.failed())} failed pairs of the journal "
+                       f"(check them again with --retry-failed)", err=True)
+    progress = None
+    if journal or show_progress:
+        progress = Progress(len(pairs) if isinstance(pairs, list) else None)
+
+    order = None
+    if reorder:
+        pairs, order = _plan_order(pairs, config_obj, warm_up, order_stats)
 
-        click.echo()
-        click.echo(f"Cover: {cover_image.name}, Stego: {stego_image.name}")
-        for tool, weight in evaluator.weights.items():
-            click.echo(f"-> {tool}: {weight:}")
-        click.echo()
+    profiler = None
+    if profile or profile_json or profile_trace:
+        profiler = Profiler(trace=profile_trace is not None)
+    try:
+        _detect(pairs, config_obj, jobs, chunk_size, unordered, output_format, output, prefetch, io_threads,
+                columnar and batch_size, profiler, cache_options, order, decide, journal, progress)
+    finally:
+        if journal:
+            journal.close()
+        if progress:
+            progress.report()
+        if profiler and profile:
+            click.echo(profiler.table(profile_sort), err=True)
+        if profiler and profile_json:
+            profiler.write_json(profile_json)
+        if profiler and profile_trace:
+            profiler.write_trace(profile_trace)
+
+
+def _plan_order(pairs, config: Config, warm_up: int, order_stats: Optional[Path]):
+    """Measure or read the statistics of the rules and return the pairs and the evaluation order of the rules."""
+    if order_stats and order_stats.exists():
+        try:
+            stats = OrderStats.load(order_stats)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="--order-stats")
+    else:
+        # The sample is measured separately and checked again with the other pairs
+        pairs = iter(pairs)
+        sample = list(islice(pairs, warm_up))
+        pairs = chain(sample, pairs)
+        stats = ordering.warm_up(config, sample)
+        if order_stats:
+            stats.save(order_stats)
+
+    order_plan = ordering.plan(config, stats)
+    for line in order_plan.report:
+        click.echo(line, err=True)
+    return pairs, order_plan.orders
+
+
+def _detect(pairs, config: Config, jobs: int, chunk_size: int, unordered: bool, output_format: str,
+            output: Optional[Path], prefetch: int, io_threads: int, columnar: int, profiler: Optional[Profiler],
+            cache_options: dict, order: Optional[dict] = None, decide: bool = False, journal: Optional[Journal] = None,
+            progress: Optional[Progress] = None):
+    # The debug output of the rules is only printed in-process and to text, so it is not mixed into other formats
+    debug = jobs == 1 and output_format == 'text' and not columnar
+    tools = [tool.name for tool in config.tools]
+    with create_writer(output_format, output, tools, decision=decide, flush_every=1 if debug else 1000) as writer:
+        if journal:
+            # The detections of a previous run come first, so the output of a resumed run is complete
+            for d in journal.detections():
+                writer.write(Detection(Path(d['cover']), Path(d['stego']), d['weights'], d['matched_rules'],
+                                       d.get('decision')))
+
+        if not debug:
+            def _echo_errors(errors):
+                for error in errors:
+                    click.echo(error, err=True)
+
+            for detection in detect_tools(pairs, config, handle_errors=_echo_errors, workers=jobs,
+                                          chunk_size=chunk_size, ordered=not unordered, prefetch=prefetch,
+                                          io_threads=io_threads, columnar=columnar, profiler=profiler,
+                                          order=order, decide=decide, journal=journal, progress=progress,
+                                          **cache_options):
+                writer.write(detection)
+            return
+
+        evaluator = _create_evaluator(config, True, profiler=profiler, order=order, decide=decide, **cache_options)
+        if prefetch:
+            pairs = pipeline.prefetch(pairs, depth=prefetch, threads=io_threads, handle_invalid=_echo_invalid)
+        for cover_image, group in groupby(pairs, key=itemgetter(0)):
+            for stego_image, error in evaluator.check_group(cover_image, (s for _, s in group)):
+                if error:
+                    click.echo(error, err=True)
+
+                click.echo(err=True)
+                detection = Detection(
+                    cover=Path(cover_image),
+                    stego=Path(stego_image),
+                    weights=evaluator.weights,
+                    matched_rules=[r.name for r in evaluator.matched_rules],
+                    decision=evaluator.decision
+                )
+                writer.write(detection)
+                if journal:
+                    if error:
+                        journal.add([], [(Path(cover_image), Path(stego_image), str(error))])
+                    else:
+                        journal.add([_to_dict(detection, True)])
+                if progress:
+                    progress.update(0 if error else 1, 1 if error else 0)
+                _close(stego_image)
+            _close(cover_image)
+        click.echo(f"Feature cache: {evaluator.cache_hits} hits, {evaluator.cache_misses} misses", err=True)
+        if evaluator.cache:
+            evaluator.cache.close()
+            click.echo(f"Persistent feature cache: {evaluator.cache.hits} hits, {evaluator.cache.misses} misses",
+                       err=True)
 
 
 def detect_tools(
         pairs: List[Tuple[Path, Path]],
-        config: Path,
+        config: Union[Path, Config],
         *,
         debug=False,
-        handle_errors: Optional[Callable[[List[Exception]], None]] = None
+        handle_errors: Optional[Callable[[List[Exception]], None]] = None,
+        workers: int = 1,
+        chunk_size: int = 16,
+        ordered: bool = True,
+        cache: Optional[Path] = None,
+        cache_size: Optional[int] = None,
+        cache_by_content: bool = False,
+        prefetch: int = 0,
+        io_threads: int = 4,
+        columnar: int = 0,
+        profiler: Optional[Profiler] = None,
+        order: Optional[Dict[str, List[int]]] = None,
+        decide: bool = False,
+        journal: Optional[Journal] = None,
+        progress: Optional[Progress] = None
 ) -> Generator[Detection, None, List[Exception]]:
     """Detects the used stego tool to hide data in the image.
 
     :param pairs: List of pairs of cover and stego images
-    :param config: Path to the config file in YAML format
+    :param config: Path to the config file in YAML format or the loaded config
     :param debug: Whether to print debug information
     :param handle_errors: Function to handle errors
+    :param workers: Number of worker processes to check the pairs with (0 uses all CPUs, 1 checks them in-process)
+    :param chunk_size: Number of pairs sent to a worker process at once
+    :param ordered: Whether to yield the detections of the worker processes in input order or as they complete
+    :param cache: Path to a SQLite database to cache the values of features across runs
+    :param cache_size: Maximum size of the cached values in bytes
+    :param cache_by_content: Whether to identify cached images by the hash of their content
+    :param prefetch: Number of pairs whose images are read ahead of the evaluation in-process (0 disables it)
+    :param io_threads: Number of threads reading the images ahead
+    :param columnar: Number of pairs evaluated at once by a `ColumnarEvaluator` in-process (0 disables it)
+    :param profiler: Profiler to record the time of the rules and values in, which includes the worker processes
+    :param order: Evaluation order of the sub-rules of compound rules by their paths (see `ordering.plan`)
+    :param decide: Whether to stop evaluating a pair once the tool with the highest weight is determined
+    :param journal: Journal to add the detections and errors to as they are produced
+    :param progress: Progress to count the checked and failed pairs in
     """
 
-    config = _load_config(config)
-    evaluator = Evaluator(config, debug=debug)
+    options = {'cache': cache, 'cache_size': cache_size, 'cache_by_content': cache_by_content, 'order': order,
+               'decide': decide}
+    if isinstance(config, Path):
+        config = _load_config(config)
+    evaluator = None
+    if columnar and decide:
+        raise ValueError('The columnar evaluation evaluates all rules and cannot stop at a decision')
+    if columnar:
+        evaluator = _create_evaluator(config, debug, profiler=profiler, **options)
+        results = _check_columnar(ColumnarEvaluator(evaluator), pairs, columnar)
+    elif workers != 1:
+        if profiler:
+            options['profile'] = 'trace' if profiler.trace_events is not None else 'stats'
+        results = _check_parallel(pairs, config, debug, options, workers or os.cpu_count(), chunk_size, ordered)
+    else:
+        evaluator = _create_evaluator(config, debug, profiler=profiler, **options)
+        if prefetch:
+            pairs = pipeline.prefetch(pairs, depth=prefetch, threads=io_threads, handle_invalid=_echo_invalid)
+        results = (([d], [], None) if d else ([], [e], None) for d, e in _iter_checks(evaluator, pairs))
+
     errors = []
-    for cover_image, stego_image in pairs:
-        try:
-            evaluator.check(cover_image, stego_image)
-            yield Detection(
-                cover=cover_image,
-                stego=stego_image,
-                weights=evaluator.weights,
-                matched_rules=[r.name for r in evaluator.matched_rules]
-            )
-        except Exception as e:
-            errors.append(e)
+    try:
+        for detections, chunk_errors, profile in results:
+            errors.extend(chunk_errors)
+            if journal:
+                journal.add((_to_dict(d, True) for d in detections),
+                            ((e.cover, e.stego, str(e.error)) for e in chunk_errors))
+            if progress:
+                progress.update(len(detections), len(chunk_errors))
+            if profile:
+                profiler.merge(profile)
+            yield from detections
+    finally:
+        if evaluator and evaluator.cache:
+            evaluator.cache.close()
     if errors and handle_errors:
         handle_errors(errors)
     return errors
 
 
-def _get_pairs_from_stdin():
+def sort_by_cover(pairs: Iterable[Tuple[Path, Path]], window: Optional[int] = None) -> Iterator[Tuple[Path, Path]]:
+    """Reorder pairs so the pairs of a cover follow each other in the order of the first appearance of the cover.
+
+    :param window: The number of pairs read and reordered at once, so only that many pairs are held in memory.
+        Pairs of a cover further apart than the window are not moved together. All pairs are reordered at once
+        if no window is given.
+    """
+    pairs = iter(pairs)
+    for batch in iter(lambda: list(islice(pairs, window)), []):
+        groups = {}
+        for cover_image, stego_image in batch:
+            groups.setdefault(cover_image, []).append(stego_image)
+        yield from ((cover_image, s) for cover_image, stegos in groups.items() for s in stegos)
+
+
+def _check_pairs(evaluator: Evaluator, pairs: Iterable[Tuple[Path, Path]]) -> Tuple[List[Detection], List[Exception]]:
+    detections, errors = [], []
+    for detection, error in _iter_checks(evaluator, pairs):
+        if error:
+            errors.append(error)
+        else:
+            detections.append(detection)
+    return detections, errors
+
+
+def _iter_checks(evaluator: Evaluator, pairs: Iterable[Tuple[Path, Path]]) \
+        -> Iterator[Tuple[Optional[Detection], Optional[Exception]]]:
+    """Check the pairs while consecutive pairs with the same cover share it (see `Evaluator.check_group`).
+
+    The pairs can also consist of prefetched `ImageFile` objects, which are closed after their checks.
+    Either a detection or an error is yielded per pair.
+    """
+    for cover_image, group in groupby(pairs, key=itemgetter(0)):
+        for stego_image, error in evaluator.check_group(cover_image, (s for _, s in group)):
+            if error:
+                yield None, CheckError(Path(cover_image), Path(stego_image), error)
+            else:
+                yield Detection(
+                    cover=Path(cover_image),
+                    stego=Path(stego_image),
+                    weights=evaluator.weights,
+                    matched_rules=[r.name for r in evaluator.matched_rules],
+                    decision=evaluator.decision
+                ), None
+            _close(stego_image)
+        _close(cover_image)
+
+
+def _close(image):
+    """Release a prefetched image (see `pipeline.prefetch`) once it is checked."""
+    if isinstance(image, ImageFile):
+        image.close()
+
+
+def _check_columnar(evaluator: ColumnarEvaluator, pairs: Iterable[Tuple[Path, Path]], batch_size: int):
+    """Check the pairs in batches with the columnar evaluator and yield the results of the batches."""
+    pairs = iter(pairs)
+    for batch in iter(lambda: list(islice(pairs, batch_size)), []):
+        detections, errors = [], []
+        for (cover_image, stego_image), (weights, matched_rules, error) in zip(batch, evaluator.check_all(batch)):
+            if error:
+                errors.append(CheckError(Path(cover_image), Path(stego_image), error))
+                continue
+            detections.append(Detection(
+                cover=cover_image,
+                stego=stego_image,
+                weights=weights,
+                matched_rules=[r.name for r in matched_rules]
+            ))
+        yield detections, errors, None
+
+
+_worker_evaluator: Optional[Evaluator] = None
+"""The evaluator of a worker process which is created once when the process starts."""
+
+
+def _init_worker(config: Config, debug: bool, options: dict):
+    global _worker_evaluator
+    options = dict(options)
+    profile = options.pop('profile', None)
+    profiler = Profiler(trace=profile == 'trace') if profile else None
+    _worker_evaluator = _create_evaluator(config, debug, profiler=profiler, **options)
+
+
+def _check_chunk(pairs: List[Tuple[Path, Path]]) -> Tuple[List[Detection], List[Exception], Optional[dict]]:
+    detections, errors = _check_pairs(_worker_evaluator, pairs)
+    # The original exceptions may not be picklable, which would lose the results of the whole chunk
+    errors = [CheckError(e.cover, e.stego, RuntimeError(repr(e.error))) for e in errors]
+    if _worker_evaluator.cache:
+        _worker_evaluator.cache.commit()
+    profile = None
+    if _worker_evaluator.profiler:
+        # The measurements of each chunk are sent to the main process and merged there
+        profile = _worker_evaluator.profiler.to_dict()
+        _worker_evaluator.profiler.clear()
+    return detections, errors, profile
+
+
+def _check_parallel(pairs, config: Config, debug: bool, options: dict, workers: int, chunk_size: int, ordered: bool):
+    """Check the pairs in chunks in a pool of worker processes and yield the results of the chunks.
+
+    Only a few chunks per worker are submitted at once, so pairs read from a stream are not all loaded into memory.
+    """
+
+    pairs = iter(pairs)
+    chunks = iter(lambda: list(islice(pairs, chunk_size)), [])
+    max_pending = workers * 2
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(config, debug, options)) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(_check_chunk, chunk))
+            while len(pending) >= max_pending:
+                yield from _completed(pending, ordered)
+        while pending:
+            yield from _completed(pending, ordered)
+
+
+def _completed(pending: deque, ordered: bool):
+    """Remove and yield the results of the next completed futures (or of the oldest one if ordered)."""
+    if ordered:
+        yield pending.popleft().result()
+    else:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            pending.remove(future)
+            yield future.result()
+
+
+def _get_pairs_from_stdin(check: bool = True):
     with click.get_text_stream('stdin') as stdin:
         for line in stdin:
             cover, stego = [Path(p.strip()) for p in line.strip().split(",")][:2]
-            if not _check_image(cover) or not _check_image(stego):
+            if check and (not _check_image(cover) or not _check_image(stego)):
                 continue
             yield cover, stego
 
 
+def _get_stegos_from_stdin():
+    with click.get_text_stream('stdin') as stdin:
+        for line in stdin:
+            if line.strip():
+                stego = Path(line.split(",")[0].strip())
+                if _check_image(stego):
+                    yield stego
+
+
+def _resolve_covers(cover_index: CoverIndex, stegos: Iterable[Path], max_distance: int) \
+        -> Iterator[Tuple[Path, Path]]:
+    """Pair the stego images with the covers of the index with the nearest fingerprints."""
+    for stego_image in stegos:
+        try:
+            found = cover_index.lookup(stego_image, max_distance)
+        except Exception as e:
+            click.echo(f"Cannot look up the cover of {stego_image}: {e}", err=True)
+            continue
+        if found is None:
+            click.echo(f"No cover found for: {stego_image}", err=True)
+            continue
+        yield found[0], stego_image
+
+
+def _echo_invalid(image_path: Path, _error: Exception):
+    click.echo(f"Not a file: {image_path}", err=True)
+
+
 def _check_image(image_path: Path):
     image_valid = True
     if not image_path.is_file():
-        click.echo(f"Not a file: {image_path}")
+        click.echo(f"Not a file: {image_path}", err=True)
         image_valid = False
 
     return image_valid
 
 
+def _create_evaluator(config: Union[Path, Config], debug: bool, cache: Optional[Path] = None, cache_size: Optional[int] = None,
+                     cache_by_content: bool = False, profiler: Optional[Profiler] = None,
+                     order: Optional[Dict[str, List[int]]] = None, decide: bool = False) -> Evaluator:
+    """Create an evaluator of a config or config file with the options of the command line (see `detect`)."""
+    feature_cache = FeatureCache(cache, max_size=cache_size, by_content=cache_by_content) if cache else None
+    config_obj = _load_config(config) if isinstance(config, Path) else config
+    return Evaluator(config_obj, debug=debug, cache=feature_cache, profiler=profiler,
+                     order=ordering.resolve(config_obj, order) if order else None, decide=decide)
+
+
 def _load_config(config_path: Path) -> Config:
-    return Config.from_dict(yaml.safe_load(config_path.read_text()))
+    """Load the config of the rules from a YAML file and import the feature providers its rules read.
+
+    The providers are imported once here, so a provider that cannot be imported fails before any pair is checked
+    instead of in each worker process. Worker processes still import them when they create their evaluators.
+
+    :raises ImportError: If a feature provider cannot be imported
+    """
+    config = Config.from_dict(yaml.safe_load(config_path.read_text()))
+    features.resolve(config.names)
+    return config
+
+
+# The public names of the helpers shared with other commands like the work queue
+create_evaluator = _create_evaluator
+iter_checks = _iter_checks
+load_config = _load_config
 
 
 if __name__ == '__main__':
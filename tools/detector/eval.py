@@ -1,67 +1,390 @@
+import heapq
+import io
 import os
 from pathlib import Path
-from time import sleep
+from time import perf_counter
+from contextlib import contextmanager, nullcontext
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 import click
+import numpy as np
 from PIL import Image
 
-from config import Config, Rule, CompoundRule
+import features
+from cache import FeatureCache
+from config import Config, Rule, CompoundRule, Matcher, RangeGroup
+from profiling import Profiler
 
 
 class ImageFile:
+    """A lazy handle of an image file.
+
+    Cheap properties like the file size, the dimensions or the header bytes are only read on first access
+    without decoding the image. The pixels are decoded once on first access and shared by all features
+    until the image is closed. If the content of the file is read in advance with `load`, the image is
+    decoded from memory and the file is not read again.
+    """
+
+    HEADER_LENGTH = 1024
+    """The number of bytes read as header."""
+
     def __init__(self, path):
         self.path = Path(path)
-        self.image = Image.open(self.path)
+        self._image: Optional[Image.Image] = None
+        self._pixels: Optional[np.ndarray] = None
+        self._stat: Optional[os.stat_result] = None
+        self._header: Optional[bytes] = None
+        self.data: Optional[bytes] = None
+        """The content of the file if it is loaded."""
+        self.features = {}
+        """Values computed by feature providers for this image alone, which are shared as long as it is open."""
+
+    @property
+    def image(self) -> Image.Image:
+        """The Pillow image, which is opened on first access. Opening only reads the header of the file."""
+        if self._image is None:
+            self._image = Image.open(io.BytesIO(self.data) if self.data is not None else self.path)
+        return self._image
+
+    def load(self) -> 'ImageFile':
+        """Read the status and the content of the file at once, e.g. in a thread ahead of the evaluation."""
+        self.stat()
+        with open(self.path, 'rb') as file:
+            self.data = file.read()
+        return self
+
+    def open(self) -> BinaryIO:
+        """Open the content of the file for reading, which is read from memory if it is loaded."""
+        return io.BytesIO(self.data) if self.data is not None else open(self.path, 'rb')
+
+    def stat(self) -> os.stat_result:
+        """Return the status of the file, which is only read once."""
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+    @property
+    def size(self) -> int:
+        """The file size in bytes."""
+        return self.stat().st_size
+
+    @property
+    def format(self) -> Optional[str]:
+        """The format of the image like "PNG" or "JPEG"."""
+        return self.image.format
+
+    @property
+    def mode(self) -> str:
+        """The mode of the image like "RGB" or "RGBA"."""
+        return self.image.mode
+
+    @property
+    def dimensions(self) -> Tuple[int, int]:
+        """The width and height of the image."""
+        return self.image.size
+
+    @property
+    def width(self) -> int:
+        return self.dimensions[0]
+
+    @property
+    def height(self) -> int:
+        return self.dimensions[1]
+
+    @property
+    def header(self) -> bytes:
+        """The first bytes of the file (see `HEADER_LENGTH`)."""
+        if self._header is None:
+            with self.open() as file:
+                self._header = file.read(self.HEADER_LENGTH)
+        return self._header
+
+    @property
+    def is_decoded(self) -> bool:
+        """Whether the pixels of the image are already decoded."""
+        return self._pixels is not None
+
+    @property
+    def pixels(self) -> np.ndarray:
+        """The RGBA pixels of the image, which are decoded once on first access."""
+        if self._pixels is None:
+            self._pixels = np.asarray(self.image.convert('RGBA'))
+        return self._pixels
+
+    def close(self):
+        """Close the Pillow image and release the decoded pixels and computed values."""
+        if self._image is not None:
+            self._image.close()
+            self._image = None
+        self._pixels = None
+        self.data = None
+        self.features = {}
+
+    def __fspath__(self) -> str:
+        return str(self.path)
+
+    def __str__(self) -> str:
+        return str(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _open(image):
+    """Open an image as `ImageFile` unless it already is one, which is then left open."""
+    return nullcontext(image) if isinstance(image, ImageFile) else ImageFile(image)
 
 
 class Evaluator:
-    def __init__(self, config: Config, *, debug: bool = False, _globals=None, limit=1000):
+    def __init__(self, config: Config, *, debug: bool = False, _globals=None, limit=1000,
+                 cache: Optional[FeatureCache] = None, profiler: Optional[Profiler] = None,
+                 order: Optional[Dict[int, List[int]]] = None, decide: bool = False):
         self.config = config
+        self.cache = cache
+        self.profiler = profiler
+        self.order = order or {}
+        """The evaluation order of the sub-rules of compound rules by the ids of the compound rules (see `ordering`)."""
+        self.decide = decide
+        """Whether to stop evaluating a pair once the tool with the unique highest weight is determined."""
+        self.decision: Optional[str] = None
+        """The tool with the unique highest positive weight of the last pair in decision mode, otherwise None."""
+        self.stopped = False
+        """Whether the evaluation of the last pair stopped early in decision mode."""
+        if profiler is not None:
+            profiler.add_config(config)
         self.cover = self.stego = None
         self.weights = {}
         self.debug = debug
         self.limit = limit
         self.matched_rules = []
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._features = {}
+        self._cover_features = {}
+        self._cover_image = None
+        self._hits = {}
+        self._results = {}
+        self._bounds: Dict[int, Tuple[Dict[str, int], Dict[str, int]]] = {}
+        self._dispatch_plans: Dict[int, Tuple[Dict[int, int], List[Tuple[int, int, Optional[RangeGroup]]]]] = {}
+        self._versions: Dict[str, str] = {}
+        self._position = 0
 
-        import aletheialib.attacks as attacks
-        self._globals = _globals or {'os': os, 'attacks': attacks}
+        if _globals is None:
+            # Only the feature providers referenced by the rules are imported
+            _globals = features.resolve(config.names)
+        self._globals = _globals
 
     def check(self, cover_path, stego_path):
-        """Check the given cover and stego images against the configuration."""
+        """Check the given cover and stego images against the configuration.
+
+        The images can also be given as `ImageFile`, which are not closed afterward. This way, a cover can be
+        shared by many stego images (see `check_group`).
+        """
+
+        with self.session(cover_path, stego_path):
+            if self.decide:
+                return self._check_decision()
+            results = [False] * len(self.config.rules)
+            for i in self._dispatch(self.config, self.config.rules, self.config.groups):
+                results[i] = self._eval_rule(self.config.rules[i], group=self.config.groups.get(i), position=i)
+            return results
+
+    def _check_decision(self):
+        """Evaluate the top-level rules until no other tool can reach or overtake the tool with the most weight.
+
+        Before each top-level rule and before the next rules of a matched top-level rule, the weights the rest
+        of the rules can still add are bounded by the sums of the positive and negative weights of their subtrees.
+        Rules of a range group whose range does not contain the already computed value cannot match and are
+        left out of the bounds. If the evaluation stops, the weights are partial, but the tool with the unique
+        highest positive weight (or that there is none) is the same as with all rules.
+        """
+        results = [False] * len(self.config.rules)
+        for i in self._dispatch(self.config, self.config.rules, self.config.groups):
+            if self._is_decided(i):
+                self.stopped = True
+                break
+            self._position = i
+            results[i] = self._eval_rule(self.config.rules[i], group=self.config.groups.get(i), position=i)
+        if not self.stopped:
+            self.decision = _unique_max(self.weights)
+        return results
 
+    def _is_decided(self, start: int, rule: Optional[Union[Rule, CompoundRule]] = None) -> bool:
+        """Check if the tool with the unique highest weight is determined and set it as decision.
+
+        :param start: The position of the first top-level rule that is not evaluated yet
+        :param rule: A rule that is not evaluated yet in addition to the top-level rules
+        """
+        positive, negative = {}, {}
+        remaining = [rule] if rule else []
+        for i in range(start, len(self.config.rules)):
+            group = self.config.groups.get(i)
+            hits = self._hits.get(id(group)) if group else None
+            if hits is None or group.positions[i] in hits:
+                remaining.append(self.config.rules[i])
+        for r in remaining:
+            pos, neg = self._weight_bounds(r)
+            for tool, weight in pos.items():
+                positive[tool] = positive.get(tool, 0) + weight
+            for tool, weight in neg.items():
+                negative[tool] = negative.get(tool, 0) + weight
+
+        tools = set(self.weights) | set(positive)
+        if max((self.weights.get(t, 0) + positive.get(t, 0) for t in tools), default=0) <= 0:
+            # No tool can end up with a positive weight
+            self.decision = None
+            return True
+        leader = _unique_max(self.weights)
+        if leader is None:
+            return False
+        lowest = self.weights[leader] + negative.get(leader, 0)
+        if lowest > 0 and all(self.weights.get(t, 0) + positive.get(t, 0) < lowest for t in tools if t != leader):
+            self.decision = leader
+            return True
+        return False
+
+    def _weight_bounds(self, rule: Union[Rule, CompoundRule]) -> Tuple[Dict[str, int], Dict[str, int]]:
+        """Return the sums of the positive and of the negative weights per tool a rule and its sub-rules can add."""
+        if id(rule) not in self._bounds:
+            positive, negative = {}, {}
+            if isinstance(rule, Rule):
+                for tool in rule.tools:
+                    bound = positive if tool.weight > 0 else negative
+                    bound[tool.name] = bound.get(tool.name, 0) + tool.weight
+                children = [rule.next] if rule.next else []
+            else:
+                children = rule.rules
+            for child in children:
+                pos, neg = self._weight_bounds(child)
+                for tool, weight in pos.items():
+                    positive[tool] = positive.get(tool, 0) + weight
+                for tool, weight in neg.items():
+                    negative[tool] = negative.get(tool, 0) + weight
+            self._bounds[id(rule)] = positive, negative
+        return self._bounds[id(rule)]
+
+    @contextmanager
+    def session(self, cover_path, stego_path):
+        """Prepare the evaluation of rules for a pair of images and reset the results.
+
+        Within the session, single rules can be evaluated with `eval_rule` like `check` does for all rules.
+        """
         self.weights = {}
         self.matched_rules = []
-        self.cover = ImageFile(cover_path)
-        self.stego = ImageFile(stego_path)
-        results = [self._eval_rule(rule) for rule in self.config.rules]
-        self.cover.image.close()
-        self.stego.image.close()
-        return results
+        self.decision = None
+        self.stopped = False
+        self._features = {}
+        self._hits = {}
+        self._results = {}
+        if not isinstance(cover_path, ImageFile) or cover_path is not self._cover_image:
+            self._cover_features = {}
+            self._cover_image = cover_path if isinstance(cover_path, ImageFile) else None
+        with _open(cover_path) as self.cover, _open(stego_path) as self.stego:
+            # A missing file is an error of the pair instead of failing every rule
+            self.cover.stat()
+            self.stego.stat()
+            try:
+                yield self
+            finally:
+                self._features = {}
+                self._hits = {}
+                self._results = {}
+
+    def eval_rule(self, rule: Union[Rule, CompoundRule], position: Optional[int] = None):
+        """Evaluate a rule of the config in a session. The position of a top-level rule enables its range group."""
+        group = self.config.groups.get(position) if position is not None else None
+        return self._eval_rule(rule, group=group, position=position)
+
+    def credit(self, rule: Rule):
+        """Record a matched rule and add the weights of its tools."""
+        self.matched_rules.append(rule)
+        for tool in rule.tools:
+            self.weights[tool.name] = self.weights.get(tool.name, 0) + tool.weight
+
+    def check_group(self, cover_path, stego_paths: Iterable) -> Iterator[Tuple[Path, Optional[Exception]]]:
+        """Check a cover image with many stego images.
+
+        The cover is only opened once, so its file status, header, pixels and all values that only depend on
+        the cover are computed once for all stego images. After each check, the stego image and the error of
+        the check (or None) are yielded while `weights` and `matched_rules` hold the results of the check.
+        The values of the cover are released after the group.
+        """
+        with _open(cover_path) as cover:
+            try:
+                for stego_path in stego_paths:
+                    error = None
+                    try:
+                        self.check(cover, stego_path)
+                    except Exception as e:
+                        error = e
+                    yield stego_path, error
+            finally:
+                self._cover_features = {}
+                self._cover_image = None
+
+    def _eval_rule(self, rule, /, level=0, group: Optional[RangeGroup] = None, position: Optional[int] = None):
+        """Evaluate a rule and its sub-rules.
+
+        If the rule belongs to a group of sibling rules with range conditions on the same value,
+        the range index of the group is used instead of evaluating the condition.
+        A rule node shared by many parents (see `Config.shared`) is only evaluated once per pair. When it is
+        reached again, its result is reused and the rules that matched in it are credited again, so the weights
+        are the same as if it was evaluated again.
+        """
+
+        if self.profiler is not None:
+            # The profiler measures the rule under the path it is evaluated at
+            self.profiler.enter(rule)
+            try:
+                return self._eval_shared(rule, level, group, position)
+            finally:
+                self.profiler.leave()
+        return self._eval_shared(rule, level, group, position)
+
+    def _eval_shared(self, rule, level: int, group: Optional[RangeGroup], position: Optional[int]):
+        if id(rule) not in self.config.shared:
+            return self._eval_node(rule, level, group, position)
+
+        if id(rule) in self._results:
+            res, matched_rules = self._results[id(rule)]
+            self._debug_reuse(rule, level, res)
+            for matched_rule in matched_rules:
+                self.credit(matched_rule)
+            return res
 
-    def _eval_rule(self, rule, /, level=0):
-        """Evaluate a rule and its sub-rules."""
+        start = len(self.matched_rules)
+        res = self._eval_node(rule, level, group, position)
+        self._results[id(rule)] = res, self.matched_rules[start:]
+        return res
 
+    def _eval_node(self, rule, level: int, group: Optional[RangeGroup], position: Optional[int]):
         if isinstance(rule, Rule):
             # Evaluate a simple rule
             self._debug_begin(rule, level)
-            _locals = {'cover': self.cover, 'stego': self.stego}
+            start = perf_counter() if self.profiler is not None else 0.0
             try:
-                if isinstance(rule.match, str):
-                    # This is a simple match rule
-                    res = eval(rule.match, self._globals, _locals)
+                if self.profiler is None:
+                    res = self._match(rule, level, group, position)
                 else:
-                    # This is a match rule split into value and condition
-                    value = eval(rule.match.value, self._globals, _locals)
-                    self._debug_value(value, level)
-                    res = eval(rule.match.cond, self._globals, {**_locals, 'value': value})
+                    res = self._profile_match(rule, level, group, position)
 
                 # Only if the rule matches, we evaluate the next rule
                 if res:
-                    self.matched_rules.append(rule)
                     self._debug_end(True)
-                    for tool in rule.tools:
-                        self.weights[tool.name] = self.weights.get(tool.name, 0) + tool.weight
-                    return self._eval_rule(rule.next, level + 1) if rule.next else True
+                    self.credit(rule)
+                    if rule.next and self.decide and level == 0 and self._is_decided(self._position + 1, rule.next):
+                        # The next rules cannot change the decision
+                        self.stopped = True
+                        return True
+                    if not rule.next:
+                        return True
+                    res = self._eval_rule(rule.next, level + 1)
+                    if self.profiler is not None:
+                        self.profiler.record_chain(rule, start, perf_counter(), bool(res))
+                    return res
                 else:
                     self._debug_end(False)
             except Exception as e:
@@ -69,22 +392,166 @@ class Evaluator:
 
         elif isinstance(rule, CompoundRule):
             # Evaluate a compound rule
-            return self._eval_compound_rule(rule, level + 1)
+            if self.profiler is None:
+                return self._eval_compound_rule(rule, level + 1)
+            return self._profile_compound_rule(rule, level + 1)
 
         return False
 
+    def _match(self, rule: Rule, level: int, group: Optional[RangeGroup], position: Optional[int]):
+        """Evaluate the match expression or the value and condition of a rule."""
+        _locals = {'cover': self.cover, 'stego': self.stego}
+        if isinstance(rule.match, str):
+            # This is a simple match rule
+            return eval(rule.match_code, self._globals, _locals)
+
+        # This is a match rule split into value and condition
+        value = self._eval_value(rule.match, _locals)
+        self._debug_value(value, level)
+        res = self._match_range(group, position, value) if group else None
+        if res is None:
+            res = eval(rule.match.cond_code, self._globals, {**_locals, 'value': value})
+        return res
+
+    def _profile_match(self, rule: Rule, level: int, group: Optional[RangeGroup], position: Optional[int]):
+        start = perf_counter()
+        try:
+            res = self._match(rule, level, group, position)
+        except Exception:
+            self.profiler.record_rule(rule, start, perf_counter(), False, True)
+            raise
+        self.profiler.record_rule(rule, start, perf_counter(), bool(res), False)
+        return res
+
+    def _profile_compound_rule(self, rule: CompoundRule, level: int):
+        start = perf_counter()
+        try:
+            res = self._eval_compound_rule(rule, level)
+        except Exception:
+            self.profiler.record_rule(rule, start, perf_counter(), False, True)
+            raise
+        self.profiler.record_rule(rule, start, perf_counter(), any(res) if isinstance(res, list) else bool(res), False)
+        return res
+
+    def _eval_value(self, matcher: Matcher, _locals: dict):
+        """Evaluate the value expression of a matcher at most once per checked pair.
+
+        The result (or the raised exception) is cached by the normalized expression and the paths of the images,
+        so rules sharing the same value expression do not compute it again. Values that do not depend on the
+        stego image are kept as long as the same cover `ImageFile` is checked.
+        If a persistent feature cache is given, it is consulted before computing the value.
+        """
+        if 'stego' in matcher.names:
+            features, key = self._features, (matcher.key, self.cover.path, self.stego.path)
+        else:
+            features, key = self._cover_features, (matcher.key, self.cover.path)
+        if key in features:
+            self.cache_hits += 1
+            if self.profiler is not None:
+                self.profiler.record_value(matcher.key, matcher.value, 0.0, 0.0, hit=True)
+        else:
+            self.cache_misses += 1
+            start = perf_counter() if self.profiler is not None else 0.0
+            version = self._version(matcher) if self.cache else ''
+            cached, value = self.cache.get(matcher.key, self.cover, self.stego, version) if self.cache \
+                else (False, None)
+            if cached:
+                features[key] = (True, value)
+            else:
+                try:
+                    value = eval(matcher.value_code, self._globals, _locals)
+                    features[key] = (True, value)
+                except Exception as e:
+                    features[key] = (False, e)
+                else:
+                    if self.cache:
+                        self.cache.put(matcher.key, self.cover, self.stego, value, name=matcher.value,
+                                       version=version)
+            if self.profiler is not None:
+                self.profiler.record_value(matcher.key, matcher.value, start, perf_counter(),
+                                           error=not features[key][0], hit=cached)
+
+        success, value = features[key]
+        if not success:
+            raise value
+        return value
+
+    def _version(self, matcher: Matcher) -> str:
+        """Return the versions of the feature providers a value expression reads (see `features.version`)."""
+        if matcher.key not in self._versions:
+            self._versions[matcher.key] = ','.join(f'{name}={features.version(self._globals[name])}'
+                                                   for name in sorted(matcher.names) if name in self._globals)
+        return self._versions[matcher.key]
+
+    def _dispatch(self, owner: Union[Config, CompoundRule], rules: List[Union[Rule, CompoundRule]],
+                  groups: Dict[int, RangeGroup], order: Optional[List[int]] = None) -> Iterator[int]:
+        """Yield the positions of the sibling rules to evaluate in the order of evaluation.
+
+        When the first rule of a range group is reached, the value of the group is looked up in its index and only
+        the rules whose ranges contain it are yielded, in their turn. The other rules of the group cannot match,
+        so they are skipped without being entered, and the work per pair grows with the number of matching rules
+        instead of the number of range rules. If the value cannot be looked up, all rules of the group are yielded.
+        """
+        plan = self._dispatch_plans.get(id(owner))
+        if plan is None:
+            plan = self._dispatch_plans[id(owner)] = _dispatch_plan(groups, order or range(len(rules)))
+        ranks, entries = plan
+        pending = []
+        for rank, position, group in entries:
+            while pending and pending[0][0] < rank:
+                yield heapq.heappop(pending)[1]
+            if group is None:
+                yield position
+                continue
+            hits = self._group_hits(group, rules[position].match)
+            members = group.rules if hits is None else [group.rules[h] for h in hits]
+            for member in members:
+                heapq.heappush(pending, (ranks[member], member))
+        while pending:
+            yield heapq.heappop(pending)[1]
+
+    def _group_hits(self, group: RangeGroup, matcher: Matcher) -> Optional[Tuple[int, ...]]:
+        """Look up the value of a range group in its index once per checked pair.
+
+        Return None if the value is not a number or cannot be computed, in which case the rules are evaluated.
+        """
+        if id(group) not in self._hits:
+            try:
+                value = self._eval_value(matcher, {'cover': self.cover, 'stego': self.stego})
+            except Exception:
+                # Each rule of the group raises the memoized error when it is evaluated
+                return None
+            self._hits[id(group)] = group.index.lookup(value)
+        return self._hits[id(group)]
+
+    def _match_range(self, group: RangeGroup, position: int, value) -> Optional[bool]:
+        """Check if the value is in the range of the rule at the given position of the group.
+
+        The index is only searched once per checked pair and group. Return None if the value cannot be looked up
+        in the index and the condition must be evaluated instead.
+        """
+        if id(group) not in self._hits:
+            self._hits[id(group)] = group.index.lookup(value)
+        hits = self._hits[id(group)]
+        return None if hits is None else group.positions[position] in hits
+
     def _eval_compound_rule(self, rule: CompoundRule, /, level=0):
         """Evaluate a compound rule."""
         next_level = level + 1
+        positions = self.order.get(id(rule)) or range(len(rule.rules))
+        if rule.operator in ('any', 'none') and rule.groups:
+            # The skipped rules cannot match, so they do not change the result
+            positions = self._dispatch(rule, rule.rules, rule.groups, self.order.get(id(rule)))
+        results = (self._eval_rule(rule.rules[i], next_level, rule.groups.get(i), i) for i in positions)
         match rule.operator:
             case 'any':
-                return any(self._eval_rule(r, next_level) for r in rule.rules)
+                return any(results)
             case 'all':
-                return all(self._eval_rule(r, next_level) for r in rule.rules)
+                return all(results)
             case 'none':
-                return not any(self._eval_rule(r, next_level) for r in rule.rules)
+                return not any(results)
             case 'each':
-                return [self._eval_rule(r, next_level) for r in rule.rules]
+                return list(results)
             case _:
                 raise ValueError(f'Unsupported operator: {rule.operator}')
 
@@ -99,10 +566,17 @@ class Evaluator:
                 middle = rule.name if rule.name else ''
                 click.echo(f'{" " * level}|- {middle} => {rule.operator}:')
 
+    def _debug_reuse(self, rule, level, res):
+        """Print the name and the reused result of a shared rule."""
+        if self.debug:
+            name = rule.name if isinstance(rule, Rule) else f'{rule.name or ""} => {rule.operator}'
+            click.echo(f'{" " * level}╰ {name} (reused)', nl=False)
+            self._debug_end(bool(res))
+
     def _debug_value(self, value, level):
         """Print the value being evaluated."""
-        value = str(value)
         if self.debug:
+            value = str(value)
             click.echo()
             click.echo(f'{" " * level}  value : {value[:self.limit] + "..." * (len(value) > self.limit)}', nl=False)
 
@@ -114,5 +588,33 @@ class Evaluator:
             else:
                 click.secho(' ✕', fg='red')
                 if error_msg:
-                    sleep(0.1)
                     click.echo(f'{" " * level} ! {error_msg}', err=True)
+
+
+def _dispatch_plan(groups: Dict[int, RangeGroup], order: Iterable[int]) \
+        -> Tuple[Dict[int, int], List[Tuple[int, int, Optional[RangeGroup]]]]:
+    """Return the ranks of the sibling rules in the order of evaluation and the entries `Evaluator._dispatch` visits.
+
+    An entry is (rank, position, group) of a rule outside of range groups with None as group or of the first rule
+    of a range group in the order of evaluation.
+    """
+    ranks = {position: rank for rank, position in enumerate(order)}
+    entries, seen = [], set()
+    for position, rank in ranks.items():
+        group = groups.get(position)
+        if group is None:
+            entries.append((rank, position, None))
+        elif id(group) not in seen:
+            seen.add(id(group))
+            entries.append((rank, position, group))
+    return ranks, entries
+
+
+def _unique_max(weights: Dict[str, int]) -> Optional[str]:
+    """Return the tool with the highest weight if it is positive and no other tool has it, otherwise None."""
+    if not weights:
+        return None
+    best = max(weights.values())
+    if best <= 0 or list(weights.values()).count(best) > 1:
+        return None
+    return max(weights, key=weights.get)
@@ -0,0 +1,88 @@
+import hashlib
+import importlib
+import inspect
+from functools import lru_cache
+from importlib.metadata import EntryPoint, entry_points
+from types import ModuleType
+from typing import Any, Dict, Iterable, Union
+
+ENTRY_POINT_GROUP = 'isd.features'
+"""The group of the entry points with which packages register feature providers."""
+
+PROVIDERS: Dict[str, Union[str, Any]] = {
+    'os': 'os',
+    'files': 'files',
+    'lsb': 'lsb',
+    'png': 'png',
+    'attacks': 'aletheialib.attacks',
+}
+"""The feature providers by the names the rules reference them with.
+
+A provider is given as the name of its module, which is only imported if a loaded rule references it,
+or as the object itself. Providers of other packages are registered as entry points of the group
+`ENTRY_POINT_GROUP`, e.g. `stegfeatures = "my_package.features"` in the `[project.entry-points."isd.features"]`
+table of their pyproject.toml. The providers of this dict take precedence over entry points of the same name.
+"""
+
+
+def register(name: str, provider: Union[str, Any]):
+    """Register a feature provider as module name or object under the name the rules reference it with."""
+    PROVIDERS[name] = provider
+
+
+def resolve(names: Iterable[str]) -> Dict[str, Any]:
+    """Import the feature providers of the given names, which can be all names read by the rules of a config.
+
+    Names of other variables like "cover", "stego" or "len" are skipped.
+
+    :return: The providers by name to be used as globals of the rules
+    """
+
+    resolved = {}
+    for name in sorted(names):
+        if name in PROVIDERS:
+            provider = PROVIDERS[name]
+        elif name in _entry_points():
+            provider = _entry_points()[name]
+        else:
+            continue
+        resolved[name] = _load(name, provider)
+    return resolved
+
+
+def version(provider: Any) -> str:
+    """Return the implementation version of a feature provider, by which cached values of changed code are not reused.
+
+    It is the hash of the source file of the provider if it has one, so editing a module like lsb.py invalidates
+    its cached values, or the `__version__` of the provider otherwise (an empty string if it has none).
+    """
+    try:
+        path = inspect.getsourcefile(provider)
+    except TypeError:
+        path = None
+    if path:
+        return _file_hash(path)
+    return str(getattr(provider, '__version__', ''))
+
+
+@lru_cache(maxsize=None)
+def _file_hash(path: str) -> str:
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()[:16]
+
+
+def _load(name: str, provider: Union[str, EntryPoint, Any]) -> Union[ModuleType, Any]:
+    try:
+        if isinstance(provider, str):
+            return importlib.import_module(provider)
+        if isinstance(provider, EntryPoint):
+            return provider.load()
+    except ImportError as e:
+        raise ImportError(f'The feature provider "{name}" cannot be imported: {e}') from e
+    return provider
+
+
+@lru_cache(maxsize=None)
+def _entry_points() -> Dict[str, EntryPoint]:
+    """Find the feature providers of installed packages once, whose modules are not imported yet."""
+    return {ep.name: ep for ep in entry_points(group=ENTRY_POINT_GROUP)}
@@ -0,0 +1,48 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Sequence
+
+import numpy as np
+
+
+def size(image) -> int:
+    """Return the file size of an `ImageFile` or of the image at the given path in bytes."""
+    return image.size if hasattr(image, 'size') else os.path.getsize(Path(image))
+
+
+def size_diff(cover, stego) -> float:
+    """Return the difference of the file sizes of the stego and the cover image in percent of the cover size.
+
+    This is the same value as the fourth value of the tuples returned by `attacks.size_diff` of aletheia,
+    but it only needs the sizes that `ImageFile` reads once with `os.stat`.
+    """
+    cover_size = size(cover)
+    return (size(stego) - cover_size) / cover_size * 100
+
+
+def sizes(paths: Sequence, workers: int = 16) -> np.ndarray:
+    """Return the file sizes of many images with a pool of threads as float array.
+
+    Each distinct path is only read once. The size of a missing file is NaN.
+    """
+
+    def _size(path) -> float:
+        try:
+            return float(size(path))
+        except OSError:
+            return np.nan
+
+    unique = list(dict.fromkeys(paths))
+    with ThreadPoolExecutor(workers) as pool:
+        by_path = dict(zip(unique, pool.map(_size, unique)))
+    return np.array([by_path[p] for p in paths], dtype=np.float64)
+
+
+def size_diffs(covers: Sequence, stegos: Sequence, workers: int = 16) -> np.ndarray:
+    """Return `size_diff` of many pairs of images as float array. It is NaN if an image is missing or empty."""
+    cover_sizes, stego_sizes = sizes(covers, workers), sizes(stegos, workers)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        diffs = (stego_sizes - cover_sizes) / cover_sizes * 100
+    diffs[~np.isfinite(diffs)] = np.nan
+    return diffs
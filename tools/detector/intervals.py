@@ -0,0 +1,156 @@
+import ast
+import math
+from bisect import bisect_left
+from dataclasses import dataclass
+from numbers import Real
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+_OPERATORS = (ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Eq)
+
+
+def _constant(node) -> Optional[float]:
+    """Return the numeric value of a constant node like `3`, `-2.63` or `+1`. Otherwise, return None."""
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        value = _constant(node.operand)
+        return None if value is None else (-value if isinstance(node.op, ast.USub) else value)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        return float(node.value)
+    return None
+
+
+def _is_value(node) -> bool:
+    return isinstance(node, ast.Name) and node.id == 'value'
+
+
+@dataclass(frozen=True)
+class Interval:
+    """Represents a range of numbers a value must be in to fulfill a condition."""
+
+    low: float = -math.inf
+    """The lower bound of the range."""
+
+    high: float = math.inf
+    """The upper bound of the range."""
+
+    low_closed: bool = False
+    """Whether the lower bound is part of the range."""
+
+    high_closed: bool = False
+    """Whether the upper bound is part of the range."""
+
+    def __contains__(self, value) -> bool:
+        return ((self.low < value or (self.low_closed and self.low == value))
+                and (value < self.high or (self.high_closed and self.high == value)))
+
+    @property
+    def empty(self) -> bool:
+        """Whether no number is in the range."""
+        return self.low > self.high or (self.low == self.high and not (self.low_closed and self.high_closed))
+
+    def mask(self, values: np.ndarray) -> np.ndarray:
+        """Return which of the values are in the range as boolean array. NaN is never in the range."""
+        low = values >= self.low if self.low_closed else values > self.low
+        high = values <= self.high if self.high_closed else values < self.high
+        return low & high
+
+    def intersect(self, other: 'Interval') -> 'Interval':
+        """Return the range that is contained in both ranges."""
+        if self.low != other.low:
+            low, low_closed = max((self.low, self.low_closed), (other.low, other.low_closed))
+        else:
+            low, low_closed = self.low, self.low_closed and other.low_closed
+        if self.high != other.high:
+            high, high_closed = min((self.high, self.high_closed), (other.high, other.high_closed))
+        else:
+            high, high_closed = self.high, self.high_closed and other.high_closed
+        return Interval(low, high, low_closed, high_closed)
+
+    @staticmethod
+    def from_cond(cond: str) -> Optional['Interval']:
+        """Create an Interval from a condition like `-2.63 <= value <= -0.25` or `47.67 <= value`.
+
+        Chained comparisons of `value` with numeric constants and conjunctions of them are supported.
+        Return None if the condition is anything else.
+        """
+
+        try:
+            node = ast.parse(cond.strip(), mode='eval').body
+        except SyntaxError:
+            return None
+        return Interval._from_node(node)
+
+    @staticmethod
+    def _from_node(node) -> Optional['Interval']:
+        if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And):
+            interval = Interval()
+            for value in node.values:
+                sub = Interval._from_node(value)
+                if sub is None:
+                    return None
+                interval = interval.intersect(sub)
+            return interval
+
+        if not isinstance(node, ast.Compare) or not any(_is_value(n) for n in [node.left, *node.comparators]):
+            return None
+
+        interval = Interval()
+        operands = [node.left, *node.comparators]
+        for op, left, right in zip(node.ops, operands, operands[1:]):
+            if not isinstance(op, _OPERATORS):
+                return None
+            if _is_value(left) and _constant(right) is not None:
+                bound, upper = _constant(right), isinstance(op, (ast.Lt, ast.LtE))
+            elif _is_value(right) and _constant(left) is not None:
+                bound, upper = _constant(left), isinstance(op, (ast.Gt, ast.GtE))
+            else:
+                return None
+
+            closed = not isinstance(op, (ast.Lt, ast.Gt))
+            if isinstance(op, ast.Eq):
+                interval = interval.intersect(Interval(bound, bound, True, True))
+            elif upper:
+                interval = interval.intersect(Interval(high=bound, high_closed=closed))
+            else:
+                interval = interval.intersect(Interval(low=bound, low_closed=closed))
+        return interval
+
+
+class IntervalIndex:
+    """Finds all intervals containing a value in logarithmic time.
+
+    The finite bounds of all intervals split the number line into points and the open segments between them.
+    For each of these regions, the positions of the intervals containing it are computed in advance,
+    so a lookup is a binary search for the region of the value.
+    """
+
+    def __init__(self, intervals: Sequence[Interval]):
+        self.intervals = list(intervals)
+        self._bounds = sorted({b for i in self.intervals for b in (i.low, i.high) if math.isfinite(b)})
+        self._regions: List[Tuple[int, ...]] = []
+        for k, bound in enumerate(self._bounds):
+            self._regions.append(self._containing_segment(k))
+            self._regions.append(tuple(p for p, i in enumerate(self.intervals) if bound in i))
+        self._regions.append(self._containing_segment(len(self._bounds)))
+
+    def _containing_segment(self, k: int) -> Tuple[int, ...]:
+        """Return the positions of the intervals containing the open segment before the k-th bound."""
+        low = self._bounds[k - 1] if k > 0 else -math.inf
+        high = self._bounds[k] if k < len(self._bounds) else math.inf
+        return tuple(p for p, i in enumerate(self.intervals) if i.low <= low and high <= i.high)
+
+    def lookup(self, value) -> Optional[Tuple[int, ...]]:
+        """Return the positions of the intervals containing the value.
+
+        Return None if the value is not a real number, as the conditions may behave differently for it.
+        """
+
+        if not isinstance(value, Real):
+            return None
+        if math.isnan(value):
+            return ()
+        k = bisect_left(self._bounds, value)
+        if k < len(self._bounds) and self._bounds[k] == value:
+            return self._regions[2 * k + 1]
+        return self._regions[2 * k]
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Set, Tuple
+
+import click
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pairs (
+    cover TEXT NOT NULL,
+    stego TEXT NOT NULL,
+    detection TEXT,
+    error TEXT,
+    PRIMARY KEY (cover, stego)
+);
+'''
+
+
+class Journal:
+    """A journal of the checked pairs of a run in a SQLite database, so an interrupted run can be resumed.
+
+    The detection or the error of each pair is stored by the paths of the pair as given. Changes are committed
+    every `batch_size` pairs or at least every `commit_interval` seconds, so a crash only loses the last
+    uncommitted pairs, which are checked again. The journal belongs to the config it was created with and
+    can only be resumed with the same config.
+    """
+
+    def __init__(self, path: Path, config_path: Path, *, batch_size: int = 500, commit_interval: float = 5.0):
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self.commit_interval = commit_interval
+        self._pending = 0
+        self._committed_at = time.monotonic()
+
+        self._db = sqlite3.connect(self.path, timeout=60)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(_SCHEMA)
+
+        digest = hashlib.sha256(Path(config_path).read_bytes()).hexdigest()
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'config'").fetchone()
+        if row is None:
+            self._db.execute("INSERT INTO meta (key, value) VALUES ('config', ?)", (digest,))
+            self._db.commit()
+        elif row[0] != digest:
+            self._db.close()
+            raise ValueError(f'The journal "{path}" was written with a different config than "{config_path}"')
+
+    def done(self) -> Set[Tuple[str, str]]:
+        """Return the pairs with a detection."""
+        return set(self._db.execute('SELECT cover, stego FROM pairs WHERE error IS NULL'))
+
+    def failed(self) -> Set[Tuple[str, str]]:
+        """Return the pairs whose check failed."""
+        return set(self._db.execute('SELECT cover, stego FROM pairs WHERE error IS NOT NULL'))
+
+    def pending(self, pairs: Iterable[Tuple[Path, Path]], retry_failed: bool = False) -> Iterator[Tuple[Path, Path]]:
+        """Iterate over the pairs that are not in the journal yet, and the failed ones if `retry_failed` is set."""
+        skip = self.done() if retry_failed else self.done() | self.failed()
+        for cover, stego in pairs:
+            if (str(cover), str(stego)) not in skip:
+                yield cover, stego
+
+    def detections(self) -> Iterator[dict]:
+        """Iterate over the journaled detections as JSON objects of `output._to_dict` in the order they were added."""
+        for (detection,) in self._db.execute('SELECT detection FROM pairs WHERE error IS NULL ORDER BY rowid'):
+            yield json.loads(detection)
+
+    def add(self, detections: Iterable[dict], errors: Iterable[Tuple[Path, Path, str]] = ()):
+        """Add the detections as JSON objects of `output._to_dict` and the errors of pairs as (cover, stego, error)."""
+        rows = [(d['cover'], d['stego'], json.dumps(d), None) for d in detections]
+        rows += [(str(cover), str(stego), None, error) for cover, stego, error in errors]
+        self._db.executemany('INSERT OR REPLACE INTO pairs (cover, stego, detection, error) VALUES (?, ?, ?, ?)',
+                             rows)
+        self._pending += len(rows)
+        if self._pending >= self.batch_size or time.monotonic() - self._committed_at >= self.commit_interval:
+            self.commit()
+
+    def commit(self):
+        self._db.commit()
+        self._pending = 0
+        self._committed_at = time.monotonic()
+
+    def close(self):
+        self.commit()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class Progress:
+    """Prints the number of checked pairs, the throughput and the estimated remaining time to stderr.
+
+    A line is printed at most every `interval` seconds and once more when the run is finished.
+    """
+
+    def __init__(self, total: Optional[int] = None, *, interval: float = 10.0):
+        self.total = total
+        """The number of pairs to check or None if it is unknown like for pairs read from stdin."""
+        self.interval = interval
+        self.count = 0
+        """The number of checked pairs."""
+        self.failed = 0
+        """The number of pairs whose check failed."""
+
+        self._started_at = time.monotonic()
+        self._reported_at = self._started_at
+
+    def update(self, checked: int, failed: int = 0):
+        self.count += checked + failed
+        self.failed += failed
+        if time.monotonic() - self._reported_at >= self.interval:
+            self.report()
+
+    def report(self):
+        now = time.monotonic()
+        self._reported_at = now
+        rate = self.count / (now - self._started_at) if now > self._started_at else 0.0
+        line = f'{self.count}'
+        if self.total is not None:
+            line += f'/{self.total} pairs ({self.count / self.total if self.total else 1:.1%})'
+        else:
+            line += ' pairs'
+        line += f', {self.failed} failed, {rate:.1f} pairs/s'
+        if self.total is not None and self.count < self.total and rate > 0:
+            line += f', ETA {_format_duration((self.total - self.count) / rate)}'
+        click.echo(line, err=True)
+
+
+def _format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}:{minutes:02d}:{seconds:02d}'
@@ -0,0 +1,257 @@
+import operator
+from math import gcd
+from pathlib import Path
+from typing import Iterator, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+import png
+
+_CHANNELS = {'R': 0, 'G': 1, 'B': 2, 'A': 3}
+
+
+def pixels(image) -> np.ndarray:
+    """Return the decoded pixels of an image as an array of shape (height, width, 4) in RGBA.
+
+    If the image is an `ImageFile` of the evaluator, its pixels are only decoded once and shared by all extractions.
+    Otherwise, the image is read from the given path.
+    """
+    if hasattr(image, 'pixels'):
+        return image.pixels
+    with Image.open(Path(image)) as img:
+        return np.asarray(img.convert('RGBA'))
+
+
+def _check_channels(channels: str, direction: str):
+    if not channels or any(c not in _CHANNELS for c in channels):
+        raise ValueError(f'Invalid channels "{channels}" (a combination of "R", "G", "B" and "A")')
+    if direction not in ('row', 'col'):
+        raise ValueError(f'Invalid direction "{direction}" (one of "row" or "col")')
+
+
+def _check_bits(bits: int, endian: str):
+    if not 1 <= bits <= 8:
+        raise ValueError(f'Invalid number of bits {bits} (1 to 8)')
+    if endian not in ('big', 'little'):
+        raise ValueError(f'Invalid endian "{endian}" (one of "big" or "little")')
+
+
+def _path(image) -> Path:
+    return image.path if hasattr(image, 'path') else Path(image)
+
+
+def _size(image) -> Tuple[int, int]:
+    """Return the width and height of an image without decoding it."""
+    if hasattr(image, 'dimensions'):
+        return image.dimensions
+    with Image.open(_path(image)) as img:
+        return img.size
+
+
+def extract(image, bits: int = 1, channels: str = 'RGB', endian: str = 'big', direction: str = 'row') -> np.ndarray:
+    """Extract the least significant bits of the pixels of an image into bytes.
+
+    :param image: The `ImageFile` or the path of the image
+    :param bits: The number of least significant bits to extract from each channel value (1 to 8)
+    :param channels: The channels to extract the bits from in the given order like "RGB" or "B"
+    :param endian: Whether the first extracted bits are the most ("big") or least ("little") significant bits of a byte
+    :param direction: Whether the pixels are read row by row ("row") or column by column ("col")
+    :return: The extracted bytes as an array of unsigned 8-bit integers
+    """
+    return pack(select(pixels(image), channels, direction), bits, endian)
+
+
+def select(data: np.ndarray, channels: str = 'RGB', direction: str = 'row') -> np.ndarray:
+    """Select the channels of RGBA pixels and flatten them in the given direction."""
+
+    _check_channels(channels, direction)
+    if direction == 'col':
+        data = data.transpose(1, 0, 2)
+
+    if channels != 'RGBA':
+        data = data[..., [_CHANNELS[c] for c in channels]]
+    return data.reshape(-1)
+
+
+def pack(data: np.ndarray, bits: int = 1, endian: str = 'big') -> np.ndarray:
+    """Pack the least significant bits of each value into bytes. An incomplete last byte is discarded.
+
+    If the number of bits divides 8, the values are packed with strided slices. Otherwise, the bits are
+    unpacked into single bits first, which needs eight times the memory.
+    """
+
+    _check_bits(bits, endian)
+    data = np.asarray(data, dtype=np.uint8)
+    mask = np.uint8((1 << bits) - 1)
+    if 8 % bits == 0:
+        div = 8 // bits
+        data = data[:len(data) // div * div]
+        message = np.zeros(len(data) // div, dtype=np.uint8)
+        for i in range(div):
+            shift = 8 - bits * (i + 1) if endian == 'big' else bits * i
+            message |= (data[i::div] & mask) << np.uint8(shift)
+        return message
+
+    unpacked = np.unpackbits((data & mask)[:, np.newaxis], axis=1, bitorder=endian)
+    stream = unpacked[:, 8 - bits:] if endian == 'big' else unpacked[:, :bits]
+    stream = stream.reshape(-1)
+    return np.packbits(stream[:len(stream) // 8 * 8], bitorder=endian)
+
+
+def stream(image, bits: int = 1, channels: str = 'RGB', endian: str = 'big', direction: str = 'row',
+           strip_height: int = 8, max_stream_rows: int = 64) -> 'LsbStream':
+    """Extract the least significant bits of the pixels of an image lazily.
+
+    The returned stream behaves like the bytes of `extract` with the same parameters, but the bytes are only
+    extracted as far as they are accessed. PNG files read row by row are decoded strip by strip, so a condition
+    like `value[:3] == b'@!#'` only decodes the first rows of the image. Once `max_stream_rows` rows are
+    decoded or a row is filtered with Average or Paeth (see `png.iter_rows`), the whole image is decoded by
+    Pillow and the rest is extracted from it, so reading far into the stream costs as much memory as `extract`.
+    Other images are decoded completely, but still packed strip by strip.
+
+    :param strip_height: The number of rows (or columns) extracted at once
+    :param max_stream_rows: The number of rows decoded strip by strip before decoding the whole image with
+        Pillow, which is faster for large reads
+    """
+    _check_channels(channels, direction)
+    _check_bits(bits, endian)
+    return LsbStream(_Extraction(image, bits, channels, endian, direction, strip_height, max_stream_rows))
+
+
+class _Extraction:
+    """Holds the bytes extracted so far from an image and extracts more on request."""
+
+    def __init__(self, image, bits: int, channels: str, endian: str, direction: str, strip_height: int,
+                 max_stream_rows: int):
+        self.image = image
+        self.bits = bits
+        self.channels = channels
+        self.endian = endian
+        self.direction = direction
+        self.strip_height = strip_height
+        self.max_stream_rows = max_stream_rows
+
+        width, height = _size(image)
+        self.length = width * height * len(channels) * bits // 8
+        """The number of bytes of the whole extraction."""
+
+        self.buffer = bytearray()
+        """The bytes extracted so far."""
+
+        self.done = False
+        self._chunks = self._iter_chunks()
+
+    def fill(self, size: int):
+        """Extract strips until at least the given number of bytes is extracted or the image is exhausted."""
+        while len(self.buffer) < size and not self.done:
+            try:
+                self.buffer += next(self._chunks)
+            except StopIteration:
+                self.done = True
+                self.image = None
+
+    def _iter_chunks(self) -> Iterator[bytes]:
+        """Extract the bytes of the strips of the image.
+
+        Values left over at the end of a strip, which do not fill whole bytes, are carried over to the next strip.
+        """
+        group = 8 // gcd(self.bits, 8)
+        carry = np.zeros(0, dtype=np.uint8)
+        for strip in self._iter_strips():
+            values = np.concatenate([carry, select(strip, self.channels)])
+            end = len(values) // group * group
+            carry = values[end:]
+            yield pack(values[:end], self.bits, self.endian).tobytes()
+        yield pack(carry, self.bits, self.endian).tobytes()
+
+    def _iter_strips(self) -> Iterator[np.ndarray]:
+        """Iterate over the pixels of the image in strips of rows (or columns) in the order of the extraction."""
+        done = 0
+        decoded = getattr(self.image, 'is_decoded', False)
+        if self.direction == 'row' and not decoded and png.can_stream(self.image):
+            for strip in png.iter_rows(self.image, self.strip_height):
+                yield strip
+                done += len(strip)
+                if done >= self.max_stream_rows:
+                    break
+
+        data = pixels(self.image)
+        if self.direction == 'col':
+            data = data.transpose(1, 0, 2)
+        for start in range(done, len(data), self.strip_height):
+            yield data[start:start + self.strip_height]
+
+
+class LsbStream:
+    """A lazy sequence of the bytes extracted from the least significant bits of an image.
+
+    Slices with a stop return bytes and only extract as many bytes as needed. Open slices like `value[3:]`
+    return a lazy view. Searching with `in` or `find` extracts strips until the bytes are found.
+    Everything else is done on the complete bytes (see `tobytes`).
+    """
+
+    def __init__(self, extraction: _Extraction, start: int = 0):
+        self._extraction = extraction
+        self._start = start
+
+    def __len__(self) -> int:
+        return max(0, self._extraction.length - self._start)
+
+    def __getitem__(self, key) -> Union[int, bytes, 'LsbStream']:
+        if isinstance(key, slice):
+            start, stop = key.start or 0, key.stop
+            if key.step in (None, 1) and start >= 0 and (stop is None or stop >= 0):
+                if stop is None:
+                    return LsbStream(self._extraction, self._start + start)
+                self._extraction.fill(self._start + stop)
+                return bytes(self._extraction.buffer[self._start + start:self._start + stop])
+            return self.tobytes()[key]
+
+        index = operator.index(key)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('LSB stream index out of range')
+        self._extraction.fill(self._start + index + 1)
+        return self._extraction.buffer[self._start + index]
+
+    def find(self, sub: bytes, start: int = 0) -> int:
+        """Return the lowest index of the bytes in the stream or -1 if they are not found."""
+        buffer = self._extraction.buffer
+        position = self._start + start
+        while True:
+            index = buffer.find(sub, position)
+            if index >= 0:
+                return index - self._start
+            if self._extraction.done:
+                return -1
+            position = max(position, len(buffer) - len(sub) + 1)
+            self._extraction.fill(len(buffer) + 1)
+
+    def __contains__(self, sub: bytes) -> bool:
+        return self.find(sub) >= 0
+
+    def startswith(self, prefix: bytes) -> bool:
+        return self[:len(prefix)] == prefix
+
+    def tobytes(self) -> bytes:
+        """Extract all remaining bytes and return them."""
+        self._extraction.fill(self._extraction.length)
+        return bytes(self._extraction.buffer[self._start:])
+
+    def __bytes__(self) -> bytes:
+        return self.tobytes()
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, LsbStream):
+            other = other.tobytes()
+        if not isinstance(other, (bytes, bytearray)):
+            return NotImplemented
+        return len(self) == len(other) and self.tobytes() == other
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        extracted = bytes(self._extraction.buffer[self._start:self._start + 64])
+        return f'<LSB stream of {len(self)} bytes starting with {extracted!r}...>'
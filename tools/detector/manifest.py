@@ -0,0 +1,133 @@
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+MANIFEST_VERSION = 1
+"""The version of the manifest format, which is increased on incompatible changes."""
+
+
+@dataclass
+class Manifest:
+    """Represents a compact list of cover and stego pairs, which `detect.py --manifest` loads directly.
+
+    The folders of the images are only stored once and the pairs refer to them by position, so a manifest of
+    hundreds of thousands of pairs is only a few megabytes. It is written by `cs-pair.py --output`, whose files
+    were already checked when it was built, so the paths are not checked again by `detect.py`.
+    """
+
+    dirs: List[str]
+    """The folders of the images."""
+
+    cover_dirs: np.ndarray
+    """The positions of the folders of the cover images in `dirs`."""
+
+    covers: np.ndarray
+    """The file names of the cover images."""
+
+    stego_dirs: np.ndarray
+    """The positions of the folders of the stego images in `dirs`."""
+
+    stegos: np.ndarray
+    """The file names of the stego images."""
+
+    methods: List[str]
+    """The distinct embedding methods of the stego images."""
+
+    method_codes: np.ndarray
+    """The positions of the embedding methods of the stego images in `methods` or -1 if unknown."""
+
+    def __len__(self) -> int:
+        return len(self.covers)
+
+    def pairs(self) -> Iterator[Tuple[Path, Path]]:
+        """Iterate over the pairs of cover and stego images in the order of the manifest."""
+        dirs = [Path(d) for d in self.dirs]
+        for cover_dir, cover, stego_dir, stego in zip(self.cover_dirs, self.covers, self.stego_dirs, self.stegos):
+            yield dirs[cover_dir] / cover, dirs[stego_dir] / stego
+
+    def method(self, index: int) -> Optional[str]:
+        """Return the embedding method of the stego image of a pair."""
+        code = self.method_codes[index]
+        return self.methods[code] if code >= 0 else None
+
+    @classmethod
+    def from_pairs(cls, pairs: Iterable[Tuple[Union[str, Path], Union[str, Path]]],
+                   methods: Optional[Iterable[Optional[str]]] = None) -> 'Manifest':
+        """Create a manifest from pairs of paths and optionally the embedding methods of their stego images."""
+        dirs: Dict[str, int] = {}
+        cover_dirs, covers, stego_dirs, stegos = [], [], [], []
+        for cover, stego in pairs:
+            cover_dir, cover = os.path.split(cover)
+            stego_dir, stego = os.path.split(stego)
+            cover_dirs.append(dirs.setdefault(cover_dir, len(dirs)))
+            covers.append(cover)
+            stego_dirs.append(dirs.setdefault(stego_dir, len(dirs)))
+            stegos.append(stego)
+
+        codes: Dict[str, int] = {}
+        method_codes = [-1 if m is None else codes.setdefault(m, len(codes)) for m in methods or []]
+        return cls(
+            dirs=list(dirs),
+            cover_dirs=np.array(cover_dirs, dtype=np.int32),
+            covers=np.array(covers, dtype=str),
+            stego_dirs=np.array(stego_dirs, dtype=np.int32),
+            stegos=np.array(stegos, dtype=str),
+            methods=list(codes),
+            method_codes=np.array(method_codes or [-1] * len(covers), dtype=np.int32)
+        )
+
+    def save(self, path: Path):
+        """Write the manifest as compressed NumPy archive."""
+        with open(path, 'wb') as file:
+            np.savez_compressed(
+                file,
+                version=np.array(MANIFEST_VERSION),
+                dirs=np.array(self.dirs, dtype=str),
+                cover_dirs=self.cover_dirs,
+                covers=self.covers,
+                stego_dirs=self.stego_dirs,
+                stegos=self.stegos,
+                methods=np.array(self.methods, dtype=str),
+                method_codes=self.method_codes
+            )
+
+    @classmethod
+    def load(cls, path: Path) -> 'Manifest':
+        """Read a manifest written by `save`."""
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if int(data['version']) != MANIFEST_VERSION:
+                    raise ValueError(f'Unsupported manifest version {int(data["version"])} of "{path}"')
+                return cls(
+                    dirs=data['dirs'].tolist(),
+                    cover_dirs=data['cover_dirs'],
+                    covers=data['covers'],
+                    stego_dirs=data['stego_dirs'],
+                    stegos=data['stegos'],
+                    methods=data['methods'].tolist(),
+                    method_codes=data['method_codes']
+                )
+        except (KeyError, OSError) as e:
+            raise ValueError(f'Not a manifest: "{path}"') from e
+
+
+def index_dir(path: Path) -> Dict[str, str]:
+    """List the files of a folder once and map their lowercase names to their names.
+
+    Looking up names in the index instead of checking each file makes checking many files of a network mount
+    a single directory listing and matches names regardless of their case, e.g. "1.png" to "1.PNG".
+
+    :raises ValueError: If the folder has files whose names only differ in their case like "1.png" and "1.PNG"
+    """
+    index = {}
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file():
+                name = index.setdefault(entry.name.lower(), entry.name)
+                if name != entry.name:
+                    raise ValueError(f'The names of "{name}" and "{entry.name}" in "{path}" only differ in their case')
+    return index
+
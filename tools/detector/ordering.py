@@ -0,0 +1,249 @@
+import json
+from dataclasses import dataclass, field, asdict
+from itertools import combinations
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple, Union
+
+from config import Config, CompoundRule, Matcher, Rule
+from eval import Evaluator
+
+SHORT_CIRCUIT = ('any', 'all', 'none')
+"""The operators of compound rules that stop evaluating their sub-rules once their result is decided."""
+
+
+@dataclass
+class ChildStats:
+    """Represents the measurements of a sub-rule of a compound rule."""
+
+    calls: int = 0
+    """The number of evaluations of the sub-rule."""
+
+    truthy: int = 0
+    """The number of evaluations with a true result."""
+
+    seconds: float = 0.0
+    """The wall time of the evaluations including the next rules of the sub-rule."""
+
+    @property
+    def cost(self) -> float:
+        """The mean seconds of an evaluation."""
+        return self.seconds / self.calls if self.calls else 0.0
+
+    @property
+    def rate(self) -> float:
+        """The share of evaluations with a true result."""
+        return self.truthy / self.calls if self.calls else 0.0
+
+
+@dataclass
+class CompoundStats:
+    """Represents the measurements of the sub-rules of a short-circuiting compound rule."""
+
+    operator: str
+    """The operator of the compound rule."""
+
+    children: List[ChildStats]
+    """The measurements of the sub-rules in the order of the config."""
+
+
+@dataclass
+class OrderStats:
+    """Represents the measurements of the short-circuiting compound rules of a config by their paths."""
+
+    compounds: Dict[str, CompoundStats] = field(default_factory=dict)
+
+    def save(self, path: Path):
+        Path(path).write_text(json.dumps({'compounds': {p: asdict(s) for p, s in self.compounds.items()}}))
+
+    @staticmethod
+    def load(path: Path) -> 'OrderStats':
+        """Read the measurements written by `save`."""
+        try:
+            data = json.loads(Path(path).read_text())
+            return OrderStats({
+                p: CompoundStats(s['operator'], [ChildStats(**c) for c in s['children']])
+                for p, s in data['compounds'].items()
+            })
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f'Not a file of order statistics: "{path}"') from e
+
+
+class StatsEvaluator(Evaluator):
+    """An evaluator that measures all sub-rules of short-circuiting compound rules.
+
+    Every sub-rule is evaluated, so the costs and match rates are not biased by the order of the config.
+    Only the sub-rules that the config order evaluates are credited, so the results are the same as the ones
+    of `Evaluator`.
+    """
+
+    def __init__(self, config: Config, **kwargs):
+        super().__init__(config, **kwargs)
+        self.stats = OrderStats()
+        self._paths = {}
+        for compound, path in compounds(config.rules):
+            # A shared compound rule is measured under its first path for all its parents
+            self._paths.setdefault(id(compound), path)
+
+    def _eval_compound_rule(self, rule: CompoundRule, /, level=0):
+        if rule.operator not in SHORT_CIRCUIT:
+            return super()._eval_compound_rule(rule, level)
+
+        outcomes = []
+        for i, child in enumerate(rule.rules):
+            weights, start = dict(self.weights), len(self.matched_rules)
+            begin = perf_counter()
+            res = bool(self._eval_rule(child, level + 1, rule.groups.get(i), i))
+            outcomes.append((res, perf_counter() - begin, weights, start))
+
+        results = [res for res, *_ in outcomes]
+        evaluated = _evaluated(rule.operator, results)
+        if evaluated < len(outcomes):
+            # Roll back the credits of the sub-rules the config order does not evaluate
+            _, _, self.weights, start = outcomes[evaluated]
+            del self.matched_rules[start:]
+
+        path = self._paths.get(id(rule), f'{rule.name or ""}({rule.operator})')
+        stats = self.stats.compounds.setdefault(path, CompoundStats(rule.operator, [ChildStats() for _ in rule.rules]))
+        for child, (res, seconds, _, _) in zip(stats.children, outcomes):
+            child.calls += 1
+            child.truthy += res
+            child.seconds += seconds
+        return _result(rule.operator, results)
+
+
+@dataclass
+class Plan:
+    """Represents the evaluation order of the sub-rules of compound rules."""
+
+    orders: Dict[str, List[int]]
+    """The positions of the sub-rules in the order of evaluation by the paths of the reordered compound rules."""
+
+    report: List[str]
+    """A line per short-circuiting compound rule with the chosen order and why it was chosen."""
+
+
+def warm_up(config: Config, pairs: Iterable[Tuple[Path, Path]], **kwargs) -> OrderStats:
+    """Measure the sub-rules of the compound rules on a sample of pairs, whose results are discarded."""
+    evaluator = StatsEvaluator(config, **kwargs)
+    for cover_image, stego_image in pairs:
+        try:
+            evaluator.check(cover_image, stego_image)
+        except Exception:
+            pass
+    return evaluator.stats
+
+
+def plan(config: Config, stats: OrderStats, min_calls: int = 10) -> Plan:
+    """Order the sub-rules of short-circuiting compound rules by their expected cost divided by their decisiveness.
+
+    The decisiveness of a sub-rule is the probability that it decides the result of the compound rule, which is
+    its match rate for "any" and "none" and its mismatch rate for "all". So cheap sub-rules that often stop the
+    evaluation are evaluated first. A compound rule is only reordered if the config proves that every order
+    has the same weights and matched rules (see `_order_independent`), because the sampled pairs cannot show it
+    for all pairs.
+    """
+
+    orders, report, first_paths = {}, [], {}
+    for compound, path in compounds(config.rules):
+        if compound.operator not in SHORT_CIRCUIT:
+            continue
+        first = first_paths.setdefault(id(compound), path)
+        if first != path:
+            # A shared node is evaluated once per pair, so it has one order for all its parents
+            report.append(f'{path}: same rule as {first}, which is measured and ordered for all its parents')
+            continue
+        s = stats.compounds.get(path)
+        if s is None or len(s.children) != len(compound.rules):
+            report.append(f'{path}: kept, not evaluated for the measured pairs')
+            continue
+        if not _order_independent(compound):
+            report.append(f'{path}: kept, its sub-rules can match together, so their order decides the credited rules')
+            continue
+        names = [_name(r) for r in compound.rules]
+        calls = min(c.calls for c in s.children)
+        if calls < min_calls:
+            report.append(f'{path}: kept, only {calls} evaluations measured')
+            continue
+
+        order = sorted(range(len(compound.rules)), key=lambda i: _expected_cost(compound.operator, s.children[i]))
+        details = ', '.join(f'{names[i]} ({s.children[i].cost * 1000:.3f} ms, {s.children[i].rate:.0%} match)'
+                            for i in order)
+        if order == list(range(len(compound.rules))):
+            report.append(f'{path}: kept, already cheapest first: {details}')
+            continue
+        orders[path] = order
+        report.append(f'{path}: reordered to {details}')
+    return Plan(orders, report)
+
+
+def resolve(config: Config, orders: Dict[str, Sequence[int]]) -> Dict[int, List[int]]:
+    """Map the orders of a plan by path to the compound rules of a config, which an `Evaluator` is given.
+
+    A compound rule shared by several parents (see `Config.shared`) is evaluated once per pair, so it takes the
+    order of its first path, under which `StatsEvaluator` measures it for all its parents.
+    """
+    resolved, seen = {}, set()
+    for compound, path in compounds(config.rules):
+        if id(compound) in seen:
+            continue
+        seen.add(id(compound))
+        if path in orders and sorted(orders[path]) == list(range(len(compound.rules))):
+            resolved[id(compound)] = list(orders[path])
+    return resolved
+
+
+def compounds(rules: List[Union[Rule, CompoundRule]], parent: str = '') -> Iterator[Tuple[CompoundRule, str]]:
+    """Iterate over the compound rules of a config with their paths like the ones of `Profiler`."""
+    for rule in rules:
+        if isinstance(rule, Rule):
+            if rule.next:
+                yield from compounds([rule.next], f'{parent} > {rule.name}' if parent else rule.name)
+        elif isinstance(rule, CompoundRule):
+            path = f'{parent} > {_name(rule)}' if parent else _name(rule)
+            yield rule, path
+            yield from compounds(rule.rules, path)
+
+
+def _order_independent(compound: CompoundRule) -> bool:
+    """Check if the config proves that every order of the sub-rules of a compound rule has the same results.
+
+    This holds for "any" and "none" if the sub-rules are range rules on the same value whose ranges do not overlap.
+    Then at most one sub-rule matches, so the same sub-rule is credited and listed as matched in any order. Other
+    sub-rules can match together, so the short-circuit decides which of them are evaluated and listed, even if
+    they credit no tools. For "all", a sub-rule that does not match stops the evaluation, so the sub-rules before
+    it are credited in one order but not in another.
+    """
+    if compound.operator == 'all':
+        return False
+    matchers = [r.match for r in compound.rules if isinstance(r, Rule) and isinstance(r.match, Matcher)
+                and r.match.interval is not None]
+    return (len(matchers) == len(compound.rules) and len({m.key for m in matchers}) == 1
+            and all(a.interval.intersect(b.interval).empty for a, b in combinations(matchers, 2)))
+
+
+def _name(rule: Union[Rule, CompoundRule]) -> str:
+    return rule.name if isinstance(rule, Rule) else f'{rule.name or ""}({rule.operator})'
+
+
+def _expected_cost(operator: str, child: ChildStats) -> float:
+    decisiveness = 1 - child.rate if operator == 'all' else child.rate
+    return child.cost / decisiveness if decisiveness > 0 else float('inf')
+
+
+def _evaluated(operator: str, results: List[bool]) -> int:
+    """Return the number of sub-rules a short-circuiting operator evaluates in order."""
+    decisive = False if operator == 'all' else True
+    return results.index(decisive) + 1 if decisive in results else len(results)
+
+
+def _result(operator: str, results: List[bool]) -> bool:
+    match operator:
+        case 'any':
+            return any(results)
+        case 'all':
+            return all(results)
+        case 'none':
+            return not any(results)
+    raise ValueError(f'Unsupported operator: {operator}')
+
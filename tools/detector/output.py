@@ -0,0 +1,202 @@
+import csv
+import json
+import time
+from pathlib import Path
+from typing import IO, List, Optional, Sequence
+
+import click
+
+FORMATS = ['text', 'jsonl', 'csv', 'parquet']
+"""The supported output formats of the detections."""
+
+_BUFFER_SIZE = 1 << 20
+
+
+class Writer:
+    """Writes detections one by one to a file as they are produced.
+
+    The writes are buffered and the file is flushed every `flush_every` detections or at least every
+    `flush_interval` seconds, so a consumer of a pipe sees the results of long runs as they progress.
+    The file is closed with the writer unless `close_file` is false like for stdout.
+    """
+
+    def __init__(self, file: IO, *, flush_every: int = 1000, flush_interval: float = 5.0, close_file: bool = True):
+        self.file = file
+        self.close_file = close_file
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.count = 0
+        """The number of written detections."""
+
+        self._unflushed = 0
+        self._flushed_at = time.monotonic()
+
+    def write(self, detection):
+        self._write(detection)
+        self.count += 1
+        self._unflushed += 1
+        if self._unflushed >= self.flush_every or time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def _write(self, detection):
+        raise NotImplementedError
+
+    def flush(self):
+        self.file.flush()
+        self._unflushed = 0
+        self._flushed_at = time.monotonic()
+
+    def close(self):
+        self.flush()
+        if self.close_file:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class TextWriter(Writer):
+    """Writes detections as human-readable lines like "Cover: ..., Stego: ..." and "-> tool: weight"."""
+
+    def __init__(self, file: IO, *, decision: bool = False, **kwargs):
+        super().__init__(file, **kwargs)
+        self.decision = decision
+
+    def _write(self, detection):
+        lines = [f"Cover: {detection.cover.name}, Stego: {detection.stego.name}"]
+        lines += [f"-> {tool}: {weight}" for tool, weight in detection.weights.items()]
+        if self.decision:
+            lines.append(f"=> Decision: {detection.decision or 'none'}")
+        self.file.write('\n'.join(lines) + '\n\n')
+
+
+class JsonlWriter(Writer):
+    """Writes each detection as a JSON object on its own line."""
+
+    def __init__(self, file: IO, *, decision: bool = False, **kwargs):
+        super().__init__(file, **kwargs)
+        self.decision = decision
+
+    def _write(self, detection):
+        self.file.write(json.dumps(_to_dict(detection, self.decision)) + '\n')
+
+
+class CsvWriter(Writer):
+    """Writes detections as CSV with a column for the weight of each tool and the matched rules separated by "|".
+
+    With `decision`, a last column holds the decided tool, which is empty if there is none.
+    """
+
+    def __init__(self, file: IO, tools: Sequence[str], *, decision: bool = False, **kwargs):
+        super().__init__(file, **kwargs)
+        self.tools = list(tools)
+        self.decision = decision
+        self._csv = csv.writer(file)
+        self._csv.writerow(['cover', 'stego', *self.tools, 'matched_rules'] + (['decision'] if decision else []))
+
+    def _write(self, detection):
+        self._csv.writerow([
+            detection.cover,
+            detection.stego,
+            *(detection.weights.get(tool, 0) for tool in self.tools),
+            '|'.join(detection.matched_rules)
+        ] + ([detection.decision or ''] if self.decision else []))
+
+
+class ParquetWriter(Writer):
+    """Writes detections to a Parquet file in row groups of `row_group_size` detections.
+
+    Only the detections of the current row group are held in memory. This needs the optional pyarrow package.
+    """
+
+    def __init__(self, path: Path, tools: Sequence[str], *, row_group_size: int = 10000, decision: bool = False,
+                 **kwargs):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise click.UsageError('The parquet format needs pyarrow, install it with "pip install pyarrow"')
+
+        self._pa = pa
+        self.tools = list(tools)
+        self.schema = pa.schema(
+            [('cover', pa.string()), ('stego', pa.string())]
+            + [(tool, pa.int64()) for tool in self.tools]
+            + [('matched_rules', pa.list_(pa.string()))]
+            + ([('decision', pa.string())] if decision else [])
+        )
+        self.decision = decision
+        self.row_group_size = row_group_size
+        self._rows: List[dict] = []
+        self._parquet = pq.ParquetWriter(str(path), self.schema)
+        super().__init__(self._parquet, **kwargs)
+
+    def _write(self, detection):
+        row = {'cover': str(detection.cover), 'stego': str(detection.stego), 'matched_rules': detection.matched_rules}
+        row.update((tool, detection.weights.get(tool, 0)) for tool in self.tools)
+        if self.decision:
+            row['decision'] = detection.decision
+        self._rows.append(row)
+        if len(self._rows) >= self.row_group_size:
+            self._write_row_group()
+
+    def _write_row_group(self):
+        if self._rows:
+            self._parquet.write_table(self._pa.Table.from_pylist(self._rows, schema=self.schema))
+            self._rows = []
+
+    def flush(self):
+        # Row groups are only written when they are full to keep them large
+        self._unflushed = 0
+        self._flushed_at = time.monotonic()
+
+    def close(self):
+        self._write_row_group()
+        self._parquet.close()
+
+
+def create_writer(output_format: str, output: Optional[Path], tools: Sequence[str], **kwargs) -> Writer:
+    """Create a writer of the given format to the output file or to stdout if no output is given.
+
+    :param output_format: One of `FORMATS`
+    :param output: The path of the output file
+    :param tools: The names of the tools, which are the columns of the weights in tabular formats
+    :param kwargs: The options of the writer like `decision` to output the decided tools
+    """
+    if output_format == 'parquet':
+        if output is None:
+            raise click.BadParameter('The parquet format needs an output file', param_hint='--output')
+        return ParquetWriter(output, tools, **kwargs)
+
+    if output is None:
+        file = click.get_text_stream('stdout')
+        kwargs['close_file'] = False
+    else:
+        file = open(output, 'w', buffering=_BUFFER_SIZE, newline='' if output_format == 'csv' else None)
+    if output_format == 'text':
+        return TextWriter(file, **kwargs)
+    if output_format == 'jsonl':
+        return JsonlWriter(file, **kwargs)
+    if output_format == 'csv':
+        return CsvWriter(file, tools, **kwargs)
+    raise ValueError(f'Unknown output format "{output_format}" (one of {", ".join(FORMATS)})')
+
+
+def _to_dict(detection, decision: bool = False) -> dict:
+    """Convert a detection to the JSON object written by `JsonlWriter`, with its decision if `decision` is set."""
+    data = {
+        'cover': str(detection.cover),
+        'stego': str(detection.stego),
+        'weights': detection.weights,
+        'matched_rules': detection.matched_rules
+    }
+    if decision:
+        data['decision'] = detection.decision
+    return data
+
+
+# The public name of the helper shared with other commands like the work queue
+to_dict = _to_dict
@@ -0,0 +1,119 @@
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+from eval import ImageFile
+
+_END = object()
+"""Marks the end of the items of a queue."""
+
+
+class _Failure:
+    """Carries an exception of a stage to the consumer."""
+
+    def __init__(self, error: Exception):
+        self.error = error
+
+
+def prefetch(
+        pairs: Iterable[Tuple[Path, Path]],
+        *,
+        depth: int = 32,
+        threads: int = 4,
+        handle_invalid: Optional[Callable[[Path, Exception], None]] = None
+) -> Iterator[Tuple[ImageFile, ImageFile]]:
+    """Read the images of the pairs ahead of their evaluation in a pipeline of stages.
+
+    A parser thread consumes the pairs (e.g. parsed from stdin) and a pool of I/O threads checks and reads
+    the files of the images (see `ImageFile.load`), while the caller evaluates the yielded pairs. The stages
+    are connected by queues of at most `depth` pairs, so a slow evaluation stops the reading instead of
+    filling the memory. Consecutive pairs with the same cover share its `ImageFile`, which is read once.
+    Pairs are yielded in input order. Pairs with an image that cannot be read are skipped and passed to
+    `handle_invalid` with the error.
+
+    :param pairs: The pairs of paths of cover and stego images
+    :param depth: The maximum number of pairs in each queue
+    :param threads: The number of threads reading the images
+    :param handle_invalid: Function to handle a path of a pair that cannot be read
+    """
+
+    parsed = queue.Queue(depth)
+    loaded = queue.Queue(depth)
+    stop = threading.Event()
+
+    def _put(q: queue.Queue, item) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(q: queue.Queue):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _END
+
+    def _parse():
+        try:
+            for pair in pairs:
+                if not _put(parsed, pair):
+                    return
+        except Exception as e:
+            _put(parsed, _Failure(e))
+        _put(parsed, _END)
+
+    def _submit(pool: ThreadPoolExecutor):
+        cover = None
+        while True:
+            item = _get(parsed)
+            if item is _END or isinstance(item, _Failure):
+                _put(loaded, item)
+                return
+            cover_path, stego_path = item
+            if cover is None or cover[0] != cover_path:
+                cover = (cover_path, pool.submit(_load, cover_path))
+            if not _put(loaded, (cover, (stego_path, pool.submit(_load, stego_path)))):
+                return
+
+    with ThreadPoolExecutor(threads) as pool:
+        # The parser may block on reading its input, so it is not waited for
+        threading.Thread(target=_parse, daemon=True).start()
+        submitter = threading.Thread(target=_submit, args=(pool,), daemon=True)
+        submitter.start()
+        try:
+            while True:
+                item = loaded.get()
+                if item is _END:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.error
+                pair = _result(*item, handle_invalid=handle_invalid)
+                if pair:
+                    yield pair
+        finally:
+            stop.set()
+            submitter.join()
+
+
+def _load(path: Path) -> ImageFile:
+    return ImageFile(path).load()
+
+
+def _result(*loads: Tuple[Path, Future], handle_invalid) -> Optional[Tuple[ImageFile, ImageFile]]:
+    """Return the loaded cover and stego image or None if one of them cannot be read."""
+    pair = []
+    for path, future in loads:
+        try:
+            pair.append(future.result())
+        except OSError as e:
+            if handle_invalid:
+                handle_invalid(path, e)
+            return None
+    return pair[0], pair[1]
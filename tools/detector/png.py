@@ -0,0 +1,336 @@
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, BinaryIO, Collection, Dict, Iterator, List, Tuple
+
+import numpy as np
+
+SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+"""The number of channels per color type."""
+
+
+@dataclass(frozen=True)
+class Header:
+    """Represents the IHDR chunk of a PNG file."""
+
+    width: int
+    height: int
+    bit_depth: int
+    color_type: int
+    compression: int
+    filter: int
+    interlace: int
+
+    @property
+    def channels(self) -> int:
+        """The number of channels of a pixel."""
+        return _CHANNELS[self.color_type]
+
+    @staticmethod
+    def from_bytes(data: bytes) -> 'Header':
+        """Create a Header object from the data of an IHDR chunk."""
+        if len(data) != 13:
+            raise ValueError('Invalid IHDR chunk')
+        return Header(*struct.unpack('>IIBBBBB', data))
+
+
+def iter_chunks(file: BinaryIO, skip: Collection[str] = ()) -> Iterator[Tuple[str, bytes]]:
+    """Iterate over the type and data of the chunks of a PNG file until the IEND chunk.
+
+    The file must be positioned after the signature. The checksums of the chunks are not validated.
+    The data of the chunks with a type in `skip` is not read and empty instead.
+    """
+    while True:
+        head = file.read(8)
+        if len(head) < 8:
+            raise ValueError('Unexpected end of the PNG file')
+        length, chunk_type = struct.unpack('>I4s', head)
+        chunk_type = chunk_type.decode('latin-1')
+        if chunk_type in skip:
+            file.seek(length + 4, os.SEEK_CUR)
+            data = b''
+        else:
+            data = file.read(length)
+            file.read(4)
+            if len(data) < length:
+                raise ValueError('Unexpected end of the PNG file')
+        yield chunk_type, data
+        if chunk_type == 'IEND':
+            return
+
+
+def open_png(path) -> BinaryIO:
+    """Open a PNG file and check its signature.
+
+    The file can also be an `ImageFile` of the evaluator, whose content may already be loaded into memory.
+    """
+    file = path.open() if hasattr(path, 'features') else open(path, 'rb')
+    if file.read(len(SIGNATURE)) != SIGNATURE:
+        file.close()
+        raise ValueError(f'Not a PNG file: {path}')
+    return file
+
+
+def read_header(path: Path) -> Header:
+    """Read the header of a PNG file without reading any other chunk."""
+    with open_png(path) as file:
+        chunk_type, data = next(iter_chunks(file))
+    if chunk_type != 'IHDR':
+        raise ValueError(f'The first chunk is not IHDR: {path}')
+    return Header.from_bytes(data)
+
+
+STREAM_FILTERS = (0, 1, 2)
+"""The filter types of the rows decoded by `iter_rows`: None, Sub and Up."""
+
+
+def can_stream(path: Path) -> bool:
+    """Check if the rows of an image can be decoded strip-wise by `iter_rows`.
+
+    These are non-interlaced 8-bit PNG files in grayscale, RGB or with alpha channel and without transparency chunk.
+    """
+    try:
+        with open_png(path) as file:
+            for chunk_type, data in iter_chunks(file):
+                if chunk_type == 'IHDR':
+                    header = Header.from_bytes(data)
+                    if header.bit_depth != 8 or header.color_type == 3 or header.interlace != 0:
+                        return False
+                elif chunk_type == 'tRNS':
+                    return False
+                elif chunk_type == 'IDAT':
+                    return True
+    except (OSError, ValueError):
+        return False
+    return False
+
+
+def iter_rows(path: Path, strip_height: int = 8) -> Iterator[np.ndarray]:
+    """Decode the rows of a PNG file strip by strip into RGBA arrays of shape (rows, width, 4).
+
+    Only as much image data is read and decompressed as needed for the yielded strips.
+    See `can_stream` for the supported files.
+
+    The rows are unfiltered with NumPy, which only works row-wise for the None, Sub and Up filters. At the first
+    row filtered with Average or Paeth, whose bytes depend on the previous bytes of the same row, the rows decoded
+    so far are yielded and the iteration stops, as Pillow decodes the remaining rows far faster than Python.
+    The caller can tell from the number of yielded rows whether the image was decoded completely.
+    """
+
+    with open_png(path) as file:
+        chunks = iter_chunks(file)
+        _, data = next(chunks)
+        header = Header.from_bytes(data)
+        channels = header.channels
+        stride = header.width * channels
+
+        buffer = bytearray()
+        prior = np.zeros(stride, dtype=np.uint8)
+        rows = []
+        done = 0
+        for data in _decompress(chunks, (stride + 1) * strip_height):
+            buffer += data
+            while len(buffer) > stride and done < header.height:
+                if buffer[0] not in STREAM_FILTERS:
+                    if buffer[0] > 4:
+                        raise ValueError(f'Invalid filter type {buffer[0]}')
+                    if rows:
+                        yield _to_rgba(np.concatenate(rows), len(rows), header)
+                    return
+                prior = _unfilter(buffer[0], np.frombuffer(bytes(buffer[1:stride + 1]), np.uint8), prior, channels)
+                del buffer[:stride + 1]
+                rows.append(prior)
+                done += 1
+                if len(rows) == strip_height or done == header.height:
+                    yield _to_rgba(np.concatenate(rows), len(rows), header)
+                    rows = []
+            if done == header.height:
+                return
+        raise ValueError(f'Missing image data: {path}')
+
+
+def _decompress(chunks: Iterator[Tuple[str, bytes]], max_length: int) -> Iterator[bytes]:
+    """Decompress the data of consecutive IDAT chunks in pieces of at most the given length."""
+    decompressor = zlib.decompressobj()
+    started = False
+    for chunk_type, data in chunks:
+        if chunk_type != 'IDAT':
+            if started or chunk_type in ('tRNS', 'IEND'):
+                return
+            continue
+        started = True
+        while data:
+            yield decompressor.decompress(data, max_length)
+            data = decompressor.unconsumed_tail
+
+
+def _unfilter(filter_type: int, row: np.ndarray, prior: np.ndarray, bpp: int) -> np.ndarray:
+    """Reconstruct a row of a PNG file from its filtered bytes and the reconstructed previous row.
+
+    Only the filters of `STREAM_FILTERS` are supported.
+    """
+
+    if filter_type == 0:
+        return row.copy()
+    if filter_type == 1:
+        return np.cumsum(row.reshape(-1, bpp), axis=0, dtype=np.uint8).reshape(-1)
+    if filter_type == 2:
+        return row + prior
+    raise ValueError(f'Unsupported filter type {filter_type}')
+
+
+def _to_rgba(data: np.ndarray, rows: int, header: Header) -> np.ndarray:
+    """Convert decoded 8-bit rows to RGBA like Pillow does."""
+    data = data.reshape(rows, header.width, header.channels)
+    if header.channels == 4:
+        return data
+    rgba = np.full((rows, header.width, 4), 255, dtype=np.uint8)
+    if header.channels == 3:
+        rgba[..., :3] = data
+    else:
+        rgba[..., :3] = data[..., :1]
+        if header.channels == 2:
+            rgba[..., 3] = data[..., 1]
+    return rgba
+
+
+METADATA_CHUNKS = ('IHDR', 'sBIT')
+"""The chunks read by default for the metadata."""
+
+
+def _parse_ihdr(data: bytes) -> Dict[str, Any]:
+    header = Header.from_bytes(data)
+    return {
+        'PNG:ImageWidth': header.width,
+        'PNG:ImageHeight': header.height,
+        'PNG:BitDepth': header.bit_depth,
+        'PNG:ColorType': header.color_type,
+        'PNG:Compression': header.compression,
+        'PNG:Filter': header.filter,
+        'PNG:Interlace': header.interlace,
+    }
+
+
+def _parse_sbit(data: bytes) -> Dict[str, Any]:
+    return {'PNG:SignificantBits': ' '.join(str(b) for b in data)}
+
+
+def _parse_gama(data: bytes) -> Dict[str, Any]:
+    gamma, = struct.unpack('>I', data)
+    return {'PNG:Gamma': round(100000 / gamma, 4) if gamma else 0}
+
+
+def _parse_srgb(data: bytes) -> Dict[str, Any]:
+    return {'PNG:SRGBRendering': data[0]}
+
+
+def _parse_phys(data: bytes) -> Dict[str, Any]:
+    x, y, unit = struct.unpack('>IIB', data)
+    return {'PNG:PixelsPerUnitX': x, 'PNG:PixelsPerUnitY': y, 'PNG:PixelUnits': unit}
+
+
+def _parse_time(data: bytes) -> Dict[str, Any]:
+    year, month, day, hour, minute, second = struct.unpack('>HBBBBB', data)
+    return {'PNG:ModifyDate': f'{year:04}:{month:02}:{day:02} {hour:02}:{minute:02}:{second:02}'}
+
+
+def _parse_text(data: bytes) -> Dict[str, Any]:
+    keyword, _, text = data.partition(b'\0')
+    return {f'PNG:{keyword.decode("latin-1")}': text.decode('latin-1')}
+
+
+def _parse_ztxt(data: bytes) -> Dict[str, Any]:
+    keyword, _, text = data.partition(b'\0')
+    return {f'PNG:{keyword.decode("latin-1")}': zlib.decompress(text[1:]).decode('latin-1')}
+
+
+def _parse_itxt(data: bytes) -> Dict[str, Any]:
+    keyword, _, rest = data.partition(b'\0')
+    compressed, rest = rest[0], rest[2:]
+    _language, _, rest = rest.partition(b'\0')
+    _translated, _, text = rest.partition(b'\0')
+    return {f'PNG:{keyword.decode("latin-1")}': (zlib.decompress(text) if compressed else text).decode('utf-8')}
+
+
+_PARSERS = {
+    'IHDR': _parse_ihdr,
+    'sBIT': _parse_sbit,
+    'gAMA': _parse_gama,
+    'sRGB': _parse_srgb,
+    'pHYs': _parse_phys,
+    'tIME': _parse_time,
+    'tEXt': _parse_text,
+    'zTXt': _parse_ztxt,
+    'iTXt': _parse_itxt,
+}
+"""The parsers of the chunks supported for the metadata."""
+
+
+def read_metadata(path: Path, chunks: Collection[str] = METADATA_CHUNKS) -> Dict[str, Any]:
+    """Read the metadata of the given chunks of a PNG file without decoding the image data.
+
+    The keys are named like the tags of ExifTool (e.g. "PNG:ColorType" or "PNG:SignificantBits").
+    The file is only read until all requested chunks that must precede the image data are found.
+    Text and time chunks may follow the image data, so the image data is skipped if they are requested.
+    If the file is not a PNG file, no metadata is returned.
+
+    :param path: The path of the PNG file
+    :param chunks: The types of the chunks to read (see `_PARSERS` for the supported ones)
+    """
+    unsupported = set(chunks) - _PARSERS.keys()
+    if unsupported:
+        raise ValueError(f'Unsupported chunks: {", ".join(sorted(unsupported))}')
+
+    try:
+        file = open_png(path)
+    except ValueError:
+        return {}
+
+    after_data = {'tIME', 'tEXt', 'zTXt', 'iTXt'}.intersection(chunks)
+    metadata = {}
+    with file:
+        for chunk_type, data in iter_chunks(file, skip={'IDAT'}):
+            if chunk_type == 'IDAT' and not after_data:
+                break
+            if chunk_type in chunks:
+                metadata.update(_PARSERS[chunk_type](data))
+    return metadata
+
+
+def read_metadata_many(paths: Collection[Path], chunks: Collection[str] = METADATA_CHUNKS,
+                       workers: int = 8) -> List[Dict[str, Any]]:
+    """Read the metadata of many PNG files with a pool of threads in the order of the paths."""
+    with ThreadPoolExecutor(workers) as pool:
+        return list(pool.map(lambda p: read_metadata(p, chunks), paths))
+
+
+def _image_metadata(image, chunks: Collection[str]) -> Dict[str, Any]:
+    """Read the metadata of an image once per `ImageFile`, so a cover shared by many stego images is read once."""
+    if not hasattr(image, 'features'):
+        return read_metadata(Path(image), chunks)
+    key = ('png.metadata', tuple(chunks))
+    if key not in image.features:
+        image.features[key] = read_metadata(image, chunks)
+    return image.features[key]
+
+
+def metadata_diff(cover, stego, chunks: Collection[str] = METADATA_CHUNKS) -> Dict[str, Tuple[Any, Any]]:
+    """Compare the metadata of a cover and a stego image like `attacks.metadata_diff` of aletheia.
+
+    :param cover: The `ImageFile` or the path of the cover image
+    :param stego: The `ImageFile` or the path of the stego image
+    :param chunks: The types of the chunks to compare
+    :return: The differing values as pairs of cover and stego value by key (None if a key is missing)
+    """
+    cover_metadata = _image_metadata(cover, chunks)
+    stego_metadata = _image_metadata(stego, chunks)
+    return {
+        key: (cover_metadata.get(key), stego_metadata.get(key))
+        for key in sorted(cover_metadata.keys() | stego_metadata.keys())
+        if cover_metadata.get(key) != stego_metadata.get(key)
+    }
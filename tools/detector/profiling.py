@@ -0,0 +1,221 @@
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from config import Config, Rule, CompoundRule
+
+SORT_KEYS = ['seconds', 'calls', 'matches', 'errors', 'name']
+"""The columns the profile tables can be sorted by."""
+
+
+@dataclass
+class RuleStats:
+    """Represents the measurements of a rule node of the config."""
+
+    path: str
+    """The names of the rule and the rules it follows separated by " > ", where compound rules are named
+    "name(operator)"."""
+
+    calls: int = 0
+    """The number of evaluations of the rule."""
+
+    matches: int = 0
+    """The number of evaluations in which the rule matched."""
+
+    errors: int = 0
+    """The number of evaluations which raised an error."""
+
+    seconds: float = 0.0
+    """The wall time of the evaluations without the time of the next rules, but with the time of the sub-rules
+    of a compound rule."""
+
+    @property
+    def match_rate(self) -> float:
+        return self.matches / self.calls if self.calls else 0.0
+
+
+@dataclass
+class ValueStats:
+    """Represents the measurements of a distinct value expression."""
+
+    expr: str
+    """The value expression as written in the config."""
+
+    calls: int = 0
+    """The number of computations of the value."""
+
+    hits: int = 0
+    """The number of times the value was taken from the feature cache of a pair or the persistent cache."""
+
+    errors: int = 0
+    """The number of computations which raised an error."""
+
+    seconds: float = 0.0
+    """The wall time of the computations and the lookups in the persistent cache."""
+
+
+class Profiler:
+    """Records the wall time, calls, matches and errors of every rule node and distinct value expression.
+
+    An evaluator only measures if it is given a profiler, so profiling costs nothing when it is disabled.
+    The rules are identified by their paths in the config, so the measurements of evaluators of the same
+    config in other processes can be merged. A rule node shared by several parents (see `Config.shared`) is
+    measured under the path it is evaluated at, which the evaluator tracks with `enter` and `leave`.
+    If `trace` is set, every measurement is also kept as an event of the Chrome trace event format,
+    which can be opened in chrome://tracing or Perfetto. A matched rule with next rules also gets a "chain" span
+    around itself and its next rules, so the spans of compound rules, chains, rules and values are nested.
+    """
+
+    def __init__(self, *, trace: bool = False):
+        self.rules: Dict[str, RuleStats] = {}
+        """The measurements of the rules by their paths in the order of the config."""
+
+        self.values: Dict[str, ValueStats] = {}
+        """The measurements of the value expressions by their normalized expression."""
+
+        self.trace_events: Optional[List[dict]] = [] if trace else None
+        self._trail: List[str] = []
+        self._origin = time.perf_counter()
+
+    def add_config(self, config: Config):
+        """Register the rules of a config, which is done by the evaluator the profiler is given to."""
+        for _, path in _walk(config.rules):
+            self.rules.setdefault(path, RuleStats(path))
+
+    def enter(self, rule: Union[Rule, CompoundRule]):
+        """Start the evaluation of a rule below the rule that is evaluated, which determines its path."""
+        name = _name(rule)
+        self._trail.append(f'{self._trail[-1]} > {name}' if self._trail else name)
+
+    def leave(self):
+        """End the evaluation of the rule of the last `enter`."""
+        self._trail.pop()
+
+    def _path(self, rule: Union[Rule, CompoundRule]) -> str:
+        return self._trail[-1] if self._trail else _name(rule)
+
+    def record_rule(self, rule: Union[Rule, CompoundRule], start: float, end: float, matched: bool, error: bool):
+        """Record an evaluation of the rule that is evaluated between two times of `time.perf_counter`."""
+        path = self._path(rule)
+        stats = self.rules.get(path)
+        if stats is None:
+            stats = self.rules[path] = RuleStats(path)
+        stats.calls += 1
+        stats.matches += matched
+        stats.errors += error
+        stats.seconds += end - start
+        if self.trace_events is not None:
+            category = 'rule' if isinstance(rule, Rule) else 'compound'
+            self._trace(stats.path, category, start, end, {'matched': matched, 'error': error})
+
+    def record_chain(self, rule: Rule, start: float, end: float, matched: bool):
+        """Record the evaluation of a matched rule and its next rules as trace event without measurements."""
+        if self.trace_events is not None:
+            self._trace(self._path(rule), 'chain', start, end, {'matched': matched})
+
+    def record_value(self, key: str, expr: str, start: float, end: float, error: bool = False, hit: bool = False):
+        """Record a computation of a value expression (or a hit in a cache) between two times of `time.perf_counter`."""
+        stats = self.values.get(key)
+        if stats is None:
+            stats = self.values[key] = ValueStats(expr)
+        if hit:
+            stats.hits += 1
+        else:
+            stats.calls += 1
+            stats.errors += error
+        stats.seconds += end - start
+        if self.trace_events is not None and end > start:
+            self._trace(expr, 'value', start, end, {'error': error, 'hit': hit})
+
+    def _trace(self, name: str, category: str, start: float, end: float, args: dict):
+        self.trace_events.append({
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': (start - self._origin) * 1e6,
+            'dur': (end - start) * 1e6,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': args
+        })
+
+    def clear(self):
+        """Remove all measurements."""
+        for stats in self.rules.values():
+            stats.calls = stats.matches = stats.errors = 0
+            stats.seconds = 0.0
+        self.values = {}
+        if self.trace_events is not None:
+            self.trace_events = []
+
+    def to_dict(self) -> dict:
+        """Return the measurements as dict, which can be merged into another profiler."""
+        return {
+            'rules': [asdict(s) | {'match_rate': s.match_rate} for s in self.rules.values()],
+            'values': {key: asdict(s) for key, s in self.values.items()},
+            'trace_events': self.trace_events or []
+        }
+
+    def merge(self, data: dict):
+        """Add the measurements of `to_dict` of another profiler like the one of a worker process."""
+        for other in data['rules']:
+            stats = self.rules.setdefault(other['path'], RuleStats(other['path']))
+            stats.calls += other['calls']
+            stats.matches += other['matches']
+            stats.errors += other['errors']
+            stats.seconds += other['seconds']
+        for key, other in data['values'].items():
+            stats = self.values.setdefault(key, ValueStats(other['expr']))
+            stats.calls += other['calls']
+            stats.hits += other['hits']
+            stats.errors += other['errors']
+            stats.seconds += other['seconds']
+        if self.trace_events is not None:
+            self.trace_events.extend(data['trace_events'])
+
+    def table(self, sort: str = 'seconds', limit: Optional[int] = None) -> str:
+        """Format the measurements of the rules and values as text tables sorted by the given column."""
+
+        def _sort(stats: List[Union[RuleStats, ValueStats]]):
+            if sort == 'name':
+                return sorted(stats, key=lambda s: getattr(s, 'path', None) or getattr(s, 'expr'))[:limit]
+            return sorted(stats, key=lambda s: getattr(s, sort, 0), reverse=True)[:limit]
+
+        lines = [f'{"seconds":>10} {"calls":>8} {"matches":>8} {"rate":>6} {"errors":>7}  rule']
+        for s in _sort(list(self.rules.values())):
+            lines.append(f'{s.seconds:10.4f} {s.calls:8} {s.matches:8} {s.match_rate:6.1%} {s.errors:7}  {s.path}')
+        lines.append('')
+        lines.append(f'{"seconds":>10} {"calls":>8} {"hits":>8} {"mean ms":>9} {"errors":>7}  value')
+        for s in _sort(list(self.values.values())):
+            mean = s.seconds / s.calls * 1000 if s.calls else 0.0
+            lines.append(f'{s.seconds:10.4f} {s.calls:8} {s.hits:8} {mean:9.3f} {s.errors:7}  {s.expr}')
+        return '\n'.join(lines)
+
+    def write_json(self, path: Path):
+        data = self.to_dict()
+        del data['trace_events']
+        Path(path).write_text(json.dumps(data, indent=2))
+
+    def write_trace(self, path: Path):
+        """Write the trace events to a file of the Chrome trace event format."""
+        Path(path).write_text(json.dumps({'traceEvents': self.trace_events or []}))
+
+
+def _walk(rules: List[Union[Rule, CompoundRule]], parent: str = '') -> Iterator[Tuple[Union[Rule, CompoundRule], str]]:
+    """Iterate over all rule nodes of a config with their paths in the order of the config."""
+    for rule in rules:
+        path = f'{parent} > {_name(rule)}' if parent else _name(rule)
+        yield rule, path
+        if isinstance(rule, Rule):
+            if rule.next:
+                yield from _walk([rule.next], path)
+        elif isinstance(rule, CompoundRule):
+            yield from _walk(rule.rules, path)
+
+
+def _name(rule: Union[Rule, CompoundRule]) -> str:
+    return rule.name if isinstance(rule, Rule) else f'{rule.name or ""}({rule.operator})'
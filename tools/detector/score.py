@@ -0,0 +1,233 @@
+import csv
+import json
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import click
+import numpy as np
+
+MODES = ['bool', 'max']
+"""The ways a detection predicts a tool.
+
+- "bool": The tool has a weight greater than 0.
+- "max": The tool has the greatest weight, which is greater than 0 and no other tool has.
+"""
+
+COUNTS = ['true_positives', 'false_positives', 'false_negatives', 'true_negatives']
+
+
+@dataclass
+class Scores:
+    """Represents the confusion matrices and metrics of the tools of a mode."""
+
+    mode: str
+    """The mode of the predictions (see `MODES`)."""
+
+    methods: List[str]
+    """The names of the embedding methods (the tools) in the order of the rows."""
+
+    counts: np.ndarray
+    """The numbers of true positives, false positives, false negatives and true negatives of each method."""
+
+    def metrics(self) -> np.ndarray:
+        """Return the accuracy, precision and recall in percent of each method, which are 0 if undefined."""
+        tp, fp, fn, tn = self.counts.T.astype(np.float64)
+        return np.stack([_ratio(tp + tn, tp + fp + fn + tn), _ratio(tp, tp + fp), _ratio(tp, tp + fn)], axis=1) * 100
+
+    def to_dict(self) -> Dict[str, dict]:
+        """Return the counts and metrics by method like `get_stats_bool` and `get_stats_max` of the notebook."""
+        return {
+            method: {**dict(zip(COUNTS, map(int, counts))),
+                     **dict(zip(['accuracy', 'precision', 'recall'], map(float, metrics)))}
+            for method, counts, metrics in zip(self.methods, self.counts, self.metrics())
+        }
+
+
+def _ratio(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(b > 0, a / np.where(b > 0, b, 1), 0.0)
+
+
+class Encoded:
+    """Detections encoded as integer arrays of the labels and a matrix of the weights of all tools."""
+
+    def __init__(self, methods: List[str]):
+        self.methods = list(methods)
+        """The embedding methods, whose positions are the labels."""
+
+        self.tools: Dict[str, int] = {m: i for i, m in enumerate(self.methods)}
+        """The columns of the tools in the weights, starting with the methods."""
+
+        self.skipped = 0
+        """The number of detections without a known label."""
+
+        self._labels: List[int] = []
+        self._rows: List[int] = []
+        self._columns: List[int] = []
+        self._values: List[int] = []
+
+    def add(self, label: Optional[str], weights: Dict[str, int]):
+        """Add a detection with the embedding method of its stego image."""
+        if label not in self.tools or self.tools[label] >= len(self.methods):
+            self.skipped += 1
+            return
+        row = len(self._labels)
+        self._labels.append(self.tools[label])
+        for tool, weight in weights.items():
+            self._rows.append(row)
+            self._columns.append(self.tools.setdefault(tool, len(self.tools)))
+            self._values.append(weight)
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the labels of shape (n,) and the weights of shape (n, tools)."""
+        labels = np.array(self._labels, dtype=np.int32)
+        weights = np.zeros((len(labels), len(self.tools)), dtype=np.int64)
+        weights[np.array(self._rows, dtype=np.int64), np.array(self._columns, dtype=np.int64)] = self._values
+        return labels, weights
+
+
+def score(labels: np.ndarray, weights: np.ndarray, methods: List[str]) -> Dict[str, Scores]:
+    """Compute the confusion matrices of all methods for all modes at once.
+
+    :param labels: The positions of the embedding methods of the detections in `methods`
+    :param weights: The weights of the tools of the detections, whose first columns are the methods
+    :param methods: The names of the embedding methods
+    """
+
+    actual = labels[:, np.newaxis] == np.arange(len(methods))
+    method_weights = weights[:, :len(methods)]
+
+    max_weight = weights.max(axis=1, initial=0)
+    unique = ((weights == max_weight[:, np.newaxis]).sum(axis=1) == 1) & (max_weight > 0)
+    predicted = {
+        'bool': method_weights > 0,
+        'max': (method_weights == max_weight[:, np.newaxis]) & unique[:, np.newaxis],
+    }
+    return {mode: Scores(mode, methods, _confusion(actual, p)) for mode, p in predicted.items()}
+
+
+def _confusion(actual: np.ndarray, predicted: np.ndarray) -> np.ndarray:
+    return np.stack([
+        (actual & predicted).sum(axis=0),
+        (~actual & predicted).sum(axis=0),
+        (actual & ~predicted).sum(axis=0),
+        (~actual & ~predicted).sum(axis=0),
+    ], axis=1)
+
+
+def read_labels(path: Path) -> Tuple[List[str], Dict[str, str]]:
+    """Read the embedding methods of the stego images from the directory CSV of StegoAppDB.
+
+    :return: The methods in the order of their first appearance and the method by file name of the stego images
+    """
+    methods, labels = {}, {}
+    with open(path, newline='') as file:
+        for row in csv.DictReader(file):
+            methods.setdefault(row['embedding_method'])
+            labels[row['image_filename']] = row['embedding_method']
+    return list(methods), labels
+
+
+def read_detections(file, results_format: str) -> Iterator[Tuple[Optional[str], str, Dict[str, int]]]:
+    """Read detections from a results file of `detect.py` and yield their label, stego image and weights.
+
+    The label is only known for the JSON files of the notebook, which group the detections by embedding method.
+    """
+    if results_format == 'jsonl':
+        for line in file:
+            if line.strip():
+                detection = json.loads(line)
+                yield None, detection['stego'], detection['weights']
+    elif results_format == 'json':
+        for method, detections in json.load(file).items():
+            for detection in detections:
+                yield method, detection['stego'], detection['weights']
+    elif results_format == 'csv':
+        reader = csv.reader(file)
+        header = next(reader)
+        # The weights are between the stego and the matched rules, which can be followed by the decision
+        end = header.index('matched_rules')
+        tools = header[2:end]
+        for row in reader:
+            weights = {tool: int(w) for tool, w in zip(tools, row[2:end]) if int(w)}
+            yield None, row[1], weights
+    else:
+        raise ValueError(f'Unknown results format "{results_format}" (one of jsonl, json or csv)')
+
+
+def encode(detections: Iterable[Tuple[Optional[str], str, Dict[str, int]]], methods: List[str],
+           labels: Optional[Dict[str, str]] = None) -> Encoded:
+    """Encode detections of `read_detections`, whose labels are looked up by the file name of the stego image."""
+    encoded = Encoded(methods)
+    for label, stego, weights in detections:
+        if label is None and labels is not None:
+            label = labels.get(Path(stego).name)
+        encoded.add(label, weights)
+    return encoded
+
+
+@click.command()
+@click.argument('results', type=click.Path(allow_dash=True, dir_okay=False, path_type=Path))
+@click.option('-l', '--labels', type=click.Path(exists=True, dir_okay=False, path_type=Path),
+              help='Path to the directory CSV of StegoAppDB with the embedding methods of the stego images')
+@click.option('-f', '--format', 'results_format', type=click.Choice(['jsonl', 'json', 'csv']),
+              help='Format of the results (by default from the file extension, jsonl for stdin)')
+@click.option('--tables', type=click.Path(file_okay=False, path_type=Path),
+              help='Folder to write the metrics to as "eval-detect_bool.csv" and "eval-detect_max.csv"')
+@click.option('--json', 'as_json', is_flag=True, help='Print the counts and metrics as JSON')
+def score_cli(results: Path, labels: Optional[Path], results_format: Optional[str], tables: Optional[Path],
+              as_json: bool):
+    """Scores the detections of RESULTS against the embedding methods of the stego images.
+
+    RESULTS is a file written by "detect.py --format jsonl" or "csv" (or "-" to read JSONL from stdin),
+    or a JSON file of the notebook with the detections grouped by embedding method. The confusion matrices
+    of each method are computed for predictions by any weight ("bool") and by the greatest weight ("max").
+    """
+    if results_format is None:
+        results_format = 'jsonl' if str(results) == '-' else results.suffix.lstrip('.').lower()
+    if labels is None and results_format != 'json':
+        raise click.BadParameter('The labels are needed unless the results are grouped by method', param_hint='--labels')
+
+    file = sys.stdin if str(results) == '-' else open(results, newline='' if results_format == 'csv' else None)
+    with file:
+        if labels:
+            methods, by_name = read_labels(labels)
+        else:
+            methods, by_name = list(json.load(file)), None
+            file.seek(0)
+        encoded = encode(read_detections(file, results_format), methods, by_name)
+
+    scores = score(*encoded.arrays(), methods)
+    if encoded.skipped:
+        click.echo(f'Skipped {encoded.skipped} detections without a known embedding method', err=True)
+
+    if as_json:
+        click.echo(json.dumps({mode: s.to_dict() for mode, s in scores.items()}, indent=2))
+    else:
+        for mode, s in scores.items():
+            click.echo(f'{mode}:')
+            click.echo(f'  {"method":<16} {"TP":>8} {"FP":>8} {"FN":>8} {"TN":>8} {"acc %":>7} {"prec %":>7} {"rec %":>7}')
+            for method, counts, metrics in zip(s.methods, s.counts, s.metrics()):
+                click.echo(f'  {method:<16} ' + ' '.join(f'{c:8}' for c in counts) + ' '
+                           + ' '.join(f'{m:7.2f}' for m in metrics))
+            click.echo(f'  {"mean":<16} {" " * 35} ' + ' '.join(f'{m:7.2f}' for m in s.metrics().mean(axis=0)))
+
+    if tables:
+        tables.mkdir(parents=True, exist_ok=True)
+        for mode, s in scores.items():
+            _write_table(tables / f'eval-detect_{mode}.csv', s)
+
+
+def _write_table(path: Path, scores: Scores):
+    """Write the metrics like the notebook with ";" as separator and "," as decimal separator."""
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file, delimiter=';')
+        writer.writerow(['Stego-App', 'Genauigkeit', 'Präzision', 'Sensitivität'])
+        for method, metrics in zip(scores.methods, scores.metrics()):
+            writer.writerow([method, *(f'{m:.2f}'.replace('.', ',') for m in metrics)])
+
+
+if __name__ == '__main__':
+    score_cli()
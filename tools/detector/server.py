@@ -0,0 +1,152 @@
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from itertools import groupby
+from operator import itemgetter
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import click
+
+from cache import FeatureCache, parse_size
+from client import DEFAULT_PORT
+from detect import Detection, _load_config
+from eval import Evaluator
+from output import _to_dict
+
+
+class DetectionServer(HTTPServer):
+    """A local HTTP server that keeps a compiled config, the imported feature modules and the caches in memory.
+
+    The config is reloaded when its file is modified, which is checked before each request. If the new config
+    is invalid, the old one is kept. The requests are handled one after another by a single evaluator.
+
+    - `POST /check` with `{"pairs": [[cover, stego], ...]}` or `{"cover": ..., "stego": ...}` answers with
+      `{"detections": [...], "errors": [...]}`, where the detections are JSON objects of `Detection`.
+    - `GET /status` answers with the config file, the number of rules and the number of checked pairs.
+    """
+
+    def __init__(self, address: Tuple[str, int], config_path: Path, *, cache: Optional[FeatureCache] = None,
+                 _globals=None):
+        super().__init__(address, _Handler)
+        self.config_path = config_path
+        self.cache = cache
+        self.evaluator: Optional[Evaluator] = None
+        self._globals = _globals
+        self.checked = 0
+        self._mtime: Optional[int] = None
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self) -> bool:
+        """Load the config again if its file was modified and return whether it was loaded."""
+        mtime = os.stat(self.config_path).st_mtime_ns
+        if mtime == self._mtime:
+            return False
+        config = _load_config(self.config_path)
+        # Feature providers that are already imported are taken from the module cache
+        self.evaluator = Evaluator(config, cache=self.cache, _globals=self._globals)
+        self._mtime = mtime
+        return True
+
+    def check(self, pairs: List[Tuple[Path, Path]]) -> dict:
+        """Check pairs with the warm evaluator and return the detections and errors as JSON objects."""
+        with self._lock:
+            try:
+                if self.reload():
+                    click.echo(f"Reloaded {self.config_path}", err=True)
+            except Exception as e:
+                click.echo(f"Keeping the previous config, because {self.config_path} is invalid: {e}", err=True)
+
+            detections, errors = [], []
+            for cover_image, group in groupby(pairs, key=itemgetter(0)):
+                for stego_image, error in self.evaluator.check_group(cover_image, (s for _, s in group)):
+                    if error:
+                        errors.append({'cover': str(cover_image), 'stego': str(stego_image), 'error': str(error)})
+                        continue
+                    detections.append(_to_dict(Detection(
+                        cover=cover_image,
+                        stego=stego_image,
+                        weights=self.evaluator.weights,
+                        matched_rules=[r.name for r in self.evaluator.matched_rules]
+                    )))
+            self.checked += len(pairs)
+            return {'detections': detections, 'errors': errors}
+
+    def status(self) -> dict:
+        return {
+            'config': str(self.config_path),
+            'rules': len(self.evaluator.config.rules),
+            'checked': self.checked
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: DetectionServer
+
+    def do_GET(self):
+        if self.path != '/status':
+            return self._send(404, {'error': f'Unknown path {self.path}'})
+        self._send(200, self.server.status())
+
+    def do_POST(self):
+        if self.path != '/check':
+            return self._send(404, {'error': f'Unknown path {self.path}'})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            pairs = body['pairs'] if 'pairs' in body else [[body['cover'], body['stego']]]
+            pairs = [(Path(cover), Path(stego)) for cover, stego in pairs]
+        except (ValueError, KeyError, TypeError) as e:
+            return self._send(400, {'error': f'Invalid request: {e}'})
+        self._send(200, self.server.check(pairs))
+
+    def _send(self, status: int, data: dict):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@click.command()
+@click.option("-c", "--config", required=True, type=click.Path(exists=True, dir_okay=False, path_type=Path),
+              help="Path to the config file, which is reloaded when it is modified")
+@click.option("--aletheia",
+              default=Path(__file__).parent.parent / "aletheia",
+              type=click.Path(exists=True, file_okay=False, path_type=Path),
+              help="Path to the aletheia directory")
+@click.option("--host", default="127.0.0.1", help="Address to listen on")
+@click.option("--port", default=DEFAULT_PORT, type=click.IntRange(min=0, max=65535), help="Port to listen on")
+@click.option("--cache", "cache_path", type=click.Path(dir_okay=False, path_type=Path),
+              help="Path to a persistent cache of the computed features")
+@click.option("--cache-size", type=str, help="Maximum size of the persistent cache like 500M or 2G")
+@click.option("--cache-by-content", is_flag=True, help="Identify images in the persistent cache by their content")
+def serve(config: Path, aletheia: Path, host: str, port: int, cache_path: Optional[Path], cache_size: Optional[str],
+          cache_by_content: bool):
+    """Serves checks of cover and stego pairs over HTTP until interrupted.
+
+    The config and the feature modules are only loaded once, so single checks with client.py take milliseconds.
+    The config is reloaded when its file is modified.
+    """
+    sys.path.append(str(aletheia))
+    cache = FeatureCache(cache_path, max_size=parse_size(cache_size) if cache_size else None,
+                         by_content=cache_by_content) if cache_path else None
+    with DetectionServer((host, port), config, cache=cache) as httpd:
+        click.echo(f"Serving {config} on http://{httpd.server_address[0]}:{httpd.server_address[1]}", err=True)
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if cache:
+                cache.close()
+
+
+if __name__ == '__main__':
+    serve()
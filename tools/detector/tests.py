@@ -1,11 +1,96 @@
+import io
+import json
+import multiprocessing
+import os
+import pickle
+import struct
 import sys
+import tempfile
+import threading
+import time
 import unittest
+import urllib.request
+import zlib
 from pathlib import Path
 
+import numpy as np
 import yaml
+from PIL import Image, PngImagePlugin
+
+import lsb
+import png
 
 from config import Config, Rule, MatchedTool, Tool, Matcher, CompoundRule
-from detect import _check_image, _load_config, detect_tools
+from coverindex import CoverIndex, fingerprint
+import detect
+from detect import CheckError, Detection, _check_image, _load_config, detect_tools, sort_by_cover
+import features
+import files
+from cache import FeatureCache, parse_size
+from eval import Evaluator, ImageFile
+from intervals import Interval, IntervalIndex
+from journal import Journal
+from output import CsvWriter, JsonlWriter
+from pipeline import prefetch
+from manifest import Manifest, index_dir
+from columnar import ColumnarEvaluator
+from profiling import Profiler
+import ordering
+from server import DetectionServer
+from workqueue import WorkQueue, merge_results, run_worker
+from score import encode, read_detections, score
+from bench import corpus
+from bench.runner import NATIVE_GLOBALS, TimingEvaluator
+
+
+def _write_image(path: Path, size=(8, 8), color=(0, 0, 0)):
+    Image.new('RGB', size, color).save(path)
+    return path
+
+
+def _write_filtered_png(path: Path, data: np.ndarray, filters: list):
+    """Write the RGBA pixels as PNG file whose rows have the given filter types and the pixel bytes as data."""
+    def chunk(chunk_type: bytes, body: bytes) -> bytes:
+        return struct.pack('>I', len(body)) + chunk_type + body + struct.pack('>I', zlib.crc32(chunk_type + body))
+
+    height, width = data.shape[:2]
+    raw = b''.join(bytes([f]) + data[y].tobytes() for y, f in enumerate(filters))
+    path.write_bytes(b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+                     + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+    return path
+
+
+class FeaturesTest(unittest.TestCase):
+    def test_config_names(self):
+        config = _load_config(Path('rules/stegoapps.yaml'))
+        self.assertTrue({'files', 'lsb', 'png', 'cover', 'stego', 'value'} <= config.names)
+        self.assertNotIn('attacks', config.names)
+
+    def test_resolve(self):
+        self.assertEqual(features.resolve({'files', 'cover', 'len'}), {'files': files})
+
+        features.register('custom', {'value': 7})
+        try:
+            rules = [{'name': 'rule1', 'desc': 'desc1', 'tools': [{'name': 'tool1', 'weight': 1}],
+                      'match': {'value': "custom['value']", 'cond': 'value == 7'}}]
+            evaluator = Evaluator(Config.from_dict({'isd': '1', 'tools': [], 'rules': rules}))
+            self.assertEqual(set(evaluator._globals), {'custom'})
+        finally:
+            del features.PROVIDERS['custom']
+
+        features.register('missing', 'not_a_module')
+        try:
+            with self.assertRaises(ImportError):
+                features.resolve({'missing'})
+            with tempfile.TemporaryDirectory() as tmp:
+                config = Path(tmp) / 'config.yaml'
+                config.write_text(yaml.safe_dump({'isd': '1', 'tools': [], 'rules': [
+                    {'name': 'rule1', 'desc': 'desc1', 'tools': [], 'match': {'value': 'missing.f()', 'cond': 'value'}}
+                ]}))
+                with self.assertRaises(ImportError):
+                    _load_config(config)
+        finally:
+            del features.PROVIDERS['missing']
 
 
 class ConfigTest(unittest.TestCase):
@@ -40,6 +125,18 @@ class ConfigTest(unittest.TestCase):
         self.assertEqual(matcher.value, 'value1')
         self.assertEqual(matcher.cond, 'cond1')
 
+    def test_matcher_invalid(self):
+        matcher_src = '''
+        value: value1 +
+        cond: cond1
+        '''
+        self.assertRaises(ValueError, Matcher.from_dict, yaml.safe_load(matcher_src))
+
+    def test_matcher_normalized(self):
+        first = Matcher.from_dict({'value': 'f(a,b)[0]', 'cond': 'value'})
+        second = Matcher.from_dict({'value': ' f(a, b) [0]', 'cond': 'value > 0'})
+        self.assertEqual(first.key, second.key)
+
     def test_matched_tool(self):
         tool_src = '''
         name: tool1
@@ -170,6 +267,568 @@ class ConfigTest(unittest.TestCase):
         '''
         self.assertRaises(ValueError, Config.from_dict, yaml.safe_load(config_src))
 
+    def test_config_refs(self):
+        config_src = '''
+        isd: "1.1"
+        tools: []
+        definitions:
+          shared:
+            name: rule3
+            desc: desc3
+            match: {value: feature(), cond: value > 0}
+            tools: [{name: tool3, weight: 1}]
+        rules:
+          - name: rule1
+            desc: desc1
+            match: "True"
+            tools: [{name: tool1, weight: 1}]
+            next: {ref: shared}
+          - name: rule2
+            desc: desc2
+            match: "True"
+            tools: [{name: tool2, weight: 1}]
+            next:
+              name: rule3
+              desc: desc3
+              match: {value: feature(), cond: value > 0}
+              tools: [{name: tool3, weight: 1}]
+        '''
+        config = Config.from_dict(yaml.safe_load(config_src))
+        self.assertIs(config.rules[0].next, config.rules[1].next)
+        self.assertEqual(config.shared, {id(config.rules[0].next)})
+
+        config_dict = yaml.safe_load(config_src)
+        config_dict['isd'] = '1'
+        self.assertRaises(ValueError, Config.from_dict, config_dict)
+        config_dict['isd'] = '1.1'
+        config_dict['definitions']['shared']['next'] = {'ref': 'shared'}
+        self.assertRaises(ValueError, Config.from_dict, config_dict)
+        config_dict['definitions']['shared']['next'] = {'ref': 'unknown'}
+        self.assertRaises(ValueError, Config.from_dict, config_dict)
+
+    def test_pickle(self):
+        # Worker processes started with "spawn" receive the loaded config pickled
+        config = _load_config(Path('rules/stegoapps.yaml'))
+        unpickled = pickle.loads(pickle.dumps(config))
+        self.assertEqual(unpickled, config)
+        self.assertEqual(len(unpickled.shared), len(config.shared))
+        self.assertFalse(unpickled.shared & config.shared)
+        self.assertEqual(unpickled.rules[0].match.interval, config.rules[0].match.interval)
+        self.assertIsNotNone(unpickled.rules[0].match.value_code)
+
+
+class IntervalTest(unittest.TestCase):
+    CONDS = ['-2.63 <= value <= -0.25', '0.02 <= value <= 0.23', '4.09 <= value < 5.44', '5.44 <= value < 18.68',
+             '47.67 <= value', 'value > 50 and value <= 60', 'value == 1', '-1 < value']
+
+    def test_from_cond(self):
+        self.assertEqual(Interval.from_cond('4.09 <= value < 5.44'), Interval(4.09, 5.44, True, False))
+        self.assertEqual(Interval.from_cond('-3 < value'), Interval(low=-3))
+        self.assertEqual(Interval.from_cond('value <= 3 and value > 1'), Interval(1, 3, False, True))
+        self.assertIsNone(Interval.from_cond('value[0] < 3'))
+        self.assertIsNone(Interval.from_cond('value < x'))
+        self.assertIsNone(Interval.from_cond('value != 3'))
+
+    def test_index_lookup(self):
+        index = IntervalIndex([Interval.from_cond(c) for c in self.CONDS])
+        for value in [-5, -2.63, -1, -0.25, 0, 0.02, 0.1, 1, 4.09, 5.44, 10, 18.68, 47.67, 50, 55, 60, 61]:
+            expected = tuple(i for i, c in enumerate(self.CONDS) if eval(c, {}, {'value': value}))
+            self.assertEqual(index.lookup(value), expected, f'value = {value}')
+        self.assertEqual(index.lookup(float('nan')), ())
+        self.assertIsNone(index.lookup('1'))
+
+    def test_mask(self):
+        values = np.array([-5, -2.63, -1, -0.25, 0, 0.02, 0.1, 1, 4.09, 5.44, 10, 18.68, 47.67, 50, 55, 60, 61, np.nan])
+        for cond in self.CONDS:
+            expected = [bool(eval(cond, {}, {'value': v})) for v in values]
+            self.assertEqual(Interval.from_cond(cond).mask(values).tolist(), expected, cond)
+
+    def test_config_groups(self):
+        _config = _load_config(Path('rules/stegoapps.yaml'))
+        self.assertEqual(len(_config.groups), len(_config.rules))
+        self.assertEqual(len({id(g) for g in _config.groups.values()}), 1)
+
+
+class LsbTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / 'image.png'
+        self.data = np.random.default_rng(0).integers(0, 256, (5, 7, 4), dtype=np.uint8)
+        Image.fromarray(self.data, 'RGBA').save(self.path)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    @staticmethod
+    def _extract_bits(data, bits: int, endian: str):
+        stream = ''.join(format(int(v), '08b')[8 - bits:][::1 if endian == 'big' else -1] for v in data)
+        byte_strings = [stream[i:i + 8] for i in range(0, len(stream) // 8 * 8, 8)]
+        return bytes(int(b if endian == 'big' else b[::-1], 2) for b in byte_strings)
+
+    def test_extract(self):
+        for bits in range(1, 9):
+            for endian in ['big', 'little']:
+                expected = self._extract_bits(self.data[..., :3].reshape(-1), bits, endian)
+                self.assertEqual(lsb.extract(self.path, bits=bits, endian=endian).tobytes(), expected)
+
+    def test_extract_channels_direction(self):
+        expected = self._extract_bits(self.data[..., 2].T.reshape(-1), 1, 'big')
+        extracted = lsb.extract(self.path, bits=1, channels='B', endian='big', direction='col')
+        self.assertEqual(extracted.tobytes(), expected)
+        self.assertRaises(ValueError, lsb.extract, self.path, channels='X')
+
+    def test_extract_signature(self):
+        message = np.frombuffer(b'@!#hidden#!@', dtype=np.uint8)
+        crumbs = np.stack([(message >> shift) & 3 for shift in (6, 4, 2, 0)], axis=1).reshape(-1)
+        data = self.data[..., :3].reshape(-1).copy()
+        data[:len(crumbs)] = data[:len(crumbs)] & 0xFC | crumbs
+        Image.fromarray(data.reshape(5, 7, 3), 'RGB').save(self.path)
+        value = lsb.extract(self.path, bits=2, endian='big').tobytes()
+        self.assertEqual(value[:3], b'@!#')
+        self.assertIn(b'#!@', value[3:])
+
+        value = lsb.stream(self.path, bits=2, endian='big', strip_height=1)
+        self.assertEqual(value[:3], b'@!#')
+        self.assertIn(b'#!@', value[3:])
+        self.assertLess(len(value._extraction.buffer), len(value))
+
+    def test_stream(self):
+        for bits, channels, direction in [(1, 'B', 'col'), (2, 'RGB', 'row'), (3, 'RGBA', 'row'), (8, 'GR', 'col')]:
+            expected = lsb.extract(self.path, bits, channels, 'big', direction).tobytes()
+            value = lsb.stream(self.path, bits, channels, 'big', direction, strip_height=2, max_stream_rows=2)
+            self.assertEqual(len(value), len(expected))
+            self.assertEqual(value[len(expected) // 2], expected[len(expected) // 2])
+            self.assertEqual(value[-1], expected[-1])
+            self.assertEqual(value[2:4], expected[2:4])
+            self.assertEqual(value[1:].find(expected[-3:]), expected[1:].find(expected[-3:]))
+            self.assertEqual(value, expected)
+            self.assertEqual(value[::2], expected[::2])
+
+    def test_stream_fallback(self):
+        iter_rows = png.iter_rows
+        decoded = []
+
+        def counting_iter_rows(*args):
+            for strip in iter_rows(*args):
+                decoded.append(len(strip))
+                yield strip
+
+        png.iter_rows = counting_iter_rows
+        self.addCleanup(setattr, png, 'iter_rows', iter_rows)
+        for filters, max_stream_rows, streamed in [([0, 1, 2, 1, 0], 2, 2), ([0, 1, 2, 1, 0], 64, 5),
+                                                   ([1, 4, 0, 2, 3], 64, 1), ([3, 0, 0, 0, 0], 64, 0)]:
+            decoded.clear()
+            _write_filtered_png(self.path, self.data, filters)
+            value = lsb.stream(self.path, 2, 'RGBA', strip_height=1, max_stream_rows=max_stream_rows)
+            self.assertEqual(value, lsb.extract(self.path, 2, 'RGBA').tobytes())
+            self.assertEqual(sum(decoded), streamed)
+
+
+class PngTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        tmp_path = Path(self.tmp.name)
+        self.cover = _write_image(tmp_path / 'cover.png')
+        self.stego = tmp_path / 'stego.png'
+        info = PngImagePlugin.PngInfo()
+        info.add(b'sBIT', bytes([8, 8, 8, 8]))
+        info.add_text('Comment', 'stego')
+        Image.new('RGBA', (8, 8)).save(self.stego, pnginfo=info, dpi=(72, 72))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_read_header(self):
+        header = png.read_header(self.stego)
+        self.assertEqual((header.width, header.height, header.bit_depth, header.color_type), (8, 8, 8, 6))
+
+    def test_read_metadata(self):
+        metadata = png.read_metadata(self.stego, ['IHDR', 'sBIT', 'pHYs', 'tEXt'])
+        self.assertEqual(metadata['PNG:ColorType'], 6)
+        self.assertEqual(metadata['PNG:SignificantBits'], '8 8 8 8')
+        self.assertEqual(metadata['PNG:PixelsPerUnitX'], 2835)
+        self.assertEqual(metadata['PNG:Comment'], 'stego')
+        self.assertEqual(png.read_metadata_many([self.cover, self.stego])[1], png.read_metadata(self.stego))
+        self.assertEqual(png.read_metadata(Path('tests.py')), {})
+
+    def test_iter_rows(self):
+        data = np.random.default_rng(0).integers(0, 256, (6, 5, 4), dtype=np.uint8)
+        path = Path(self.tmp.name) / 'filtered.png'
+        for filters, rows in [([0, 1, 2, 2, 1, 0], 6), ([2, 1, 0, 4, 1, 2], 3), ([1, 3, 2, 0, 0, 0], 1)]:
+            _write_filtered_png(path, data, filters)
+            strips = list(png.iter_rows(path, strip_height=4))
+            with Image.open(path) as image:
+                expected = np.asarray(image)
+            self.assertEqual([len(s) for s in strips], [4, rows - 4] if rows > 4 else [rows])
+            np.testing.assert_array_equal(np.concatenate(strips), expected[:rows])
+
+    def test_metadata_diff(self):
+        diff = png.metadata_diff(self.cover, self.stego)
+        self.assertEqual(diff, {'PNG:ColorType': (2, 6), 'PNG:SignificantBits': (None, '8 8 8 8')})
+
+
+class OutputTest(unittest.TestCase):
+    def setUp(self):
+        self.detection = Detection(Path('c.png'), Path('s.png'), {'tool2': 3}, ['rule1', 'rule2'])
+
+    def test_jsonl_writer(self):
+        file = io.StringIO()
+        writer = JsonlWriter(file, close_file=False)
+        writer.write(self.detection)
+        writer.write(self.detection)
+        writer.close()
+        lines = file.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[0]), {
+            'cover': 'c.png', 'stego': 's.png', 'weights': {'tool2': 3}, 'matched_rules': ['rule1', 'rule2']
+        })
+
+    def test_csv_writer(self):
+        file = io.StringIO()
+        with CsvWriter(file, ['tool1', 'tool2'], close_file=False) as writer:
+            writer.write(self.detection)
+        self.assertEqual(file.getvalue().splitlines(), [
+            'cover,stego,tool1,tool2,matched_rules',
+            'c.png,s.png,0,3,rule1|rule2'
+        ])
+
+
+class ManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_save_load(self):
+        pairs = [(Path('covers/1.png'), Path('stegos/2.png')), (Path('covers/1.png'), Path('other/3.PNG'))]
+        manifest = Manifest.from_pairs(pairs, ['PixelKnot', None])
+        self.assertEqual(manifest.dirs, ['covers', 'stegos', 'other'])
+
+        path = Path(self.tmp.name) / 'pairs.npz'
+        manifest.save(path)
+        loaded = Manifest.load(path)
+        self.assertEqual(list(loaded.pairs()), pairs)
+        self.assertEqual([loaded.method(i) for i in range(len(loaded))], ['PixelKnot', None])
+
+        path.write_bytes(b'not a manifest')
+        with self.assertRaises(ValueError):
+            Manifest.load(path)
+
+    def test_index_dir(self):
+        _write_image(Path(self.tmp.name) / '1.PNG')
+        (Path(self.tmp.name) / 'folder').mkdir()
+        self.assertEqual(index_dir(Path(self.tmp.name)), {'1.png': '1.PNG'})
+        _write_image(Path(self.tmp.name) / '1.png')
+        with self.assertRaises(ValueError):
+            index_dir(Path(self.tmp.name))
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.config = Path(self.tmp.name) / 'config.yaml'
+        self.config.write_text('isd: "1"\ntools: []\nrules: []\n')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_resume(self):
+        path = Path(self.tmp.name) / 'journal.db'
+        pairs = [(Path('c1'), Path('s1')), (Path('c1'), Path('s2')), (Path('c2'), Path('s3'))]
+        detection = {'cover': 'c1', 'stego': 's1', 'weights': {'tool1': 1}, 'matched_rules': ['rule1']}
+        with Journal(path, self.config) as journal:
+            journal.add([detection], [(Path('c1'), Path('s2'), 'error')])
+
+        with Journal(path, self.config) as journal:
+            self.assertEqual(list(journal.pending(pairs)), [pairs[2]])
+            self.assertEqual(list(journal.pending(pairs, retry_failed=True)), pairs[1:])
+            self.assertEqual(list(journal.detections()), [detection])
+
+        self.config.write_text('isd: "1"\ntools: []\nrules: []\n# changed\n')
+        with self.assertRaises(ValueError):
+            Journal(path, self.config)
+
+    def test_check_error(self):
+        error = pickle.loads(pickle.dumps(CheckError(Path('c1'), Path('s1'), ValueError('invalid'))))
+        self.assertEqual((error.cover, error.stego, str(error.error)), (Path('c1'), Path('s1'), 'invalid'))
+        self.assertEqual(str(error), 'c1, s1: invalid')
+
+
+class WorkQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+        self.config = self.dir / 'config.yaml'
+        self.config.write_text(yaml.safe_dump({'isd': '1', 'tools': [{'name': 'tool1', 'tags': []}], 'rules': [
+            {'name': 'rule1', 'desc': 'desc1', 'tools': [{'name': 'tool1', 'weight': 1}],
+             'match': {'value': 'files.size_diff(cover, stego)', 'cond': 'value > 0'}}
+        ]}))
+        covers = [_write_image(self.dir / f'cover{i}.png') for i in range(3)]
+        self.pairs = [(covers[i % 3], _write_image(self.dir / f'stego{i}.png', size=(8 + i, 8))) for i in range(10)]
+        Manifest.from_pairs(self.pairs).save(self.dir / 'pairs.npz')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_workers(self):
+        queue_path = self.dir / 'queue.db'
+        WorkQueue.create(queue_path, self.dir / 'pairs.npz', self.config, self.dir / 'results', chunk_size=3).close()
+        workers = [multiprocessing.Process(target=run_worker, args=(queue_path, f'worker{i}'), kwargs={'poll': 0.1})
+                   for i in range(3)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(timeout=60)
+        self.assertEqual([w.exitcode for w in workers], [0, 0, 0])
+
+        with WorkQueue(queue_path) as queue:
+            self.assertEqual(queue.status(), {'done': 4, 'leased': 0, 'expired': 0, 'pending': 0})
+        results, missing = merge_results(queue_path)
+        self.assertEqual(missing, [])
+        expected = list(detect_tools(self.pairs, self.config))
+        self.assertEqual([(r['cover'], r['stego'], r['weights']) for r in results],
+                         [(str(d.cover), str(d.stego), d.weights) for d in expected])
+
+    def test_expired_lease(self):
+        with WorkQueue.create(self.dir / 'queue.db', self.dir / 'pairs.npz', self.config, self.dir / 'results',
+                              chunk_size=4) as queue:
+            chunk = queue.lease('worker1', 0)
+            self.assertEqual((chunk.start, chunk.stop), (0, 4))
+            # The lease of the first worker expired, so its chunk is leased again
+            self.assertEqual(queue.lease('worker2', 60), chunk)
+            self.assertFalse(queue.renew(chunk, 'worker1', 60))
+            self.assertEqual(queue.lease('worker1', 60).start, 4)
+            self.assertFalse(queue.complete(chunk, 'worker1'))
+            self.assertTrue(queue.complete(chunk, 'worker2'))
+            self.assertFalse(queue.renew(chunk, 'worker2', 60))
+            self.assertEqual(queue.status(), {'done': 1, 'leased': 1, 'expired': 0, 'pending': 1})
+
+
+class CoverIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.covers = Path(self.tmp.name) / 'covers'
+        self.covers.mkdir()
+        rng = np.random.default_rng(0)
+        for i in range(20):
+            pixels = rng.integers(0, 256, (4, 4, 3), dtype=np.uint8)
+            Image.fromarray(pixels).resize((32, 32), Image.Resampling.BICUBIC).save(self.covers / f'{i}.png')
+        (self.covers / 'invalid.png').write_bytes(b'not an image')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_lookup(self):
+        invalid = []
+        index = CoverIndex.build(self.covers, handle_invalid=lambda p, e: invalid.append(p.name))
+        self.assertEqual((len(index), invalid), (20, ['invalid.png']))
+        index.save(Path(self.tmp.name) / 'index')
+        index = CoverIndex.load(Path(self.tmp.name) / 'index')
+
+        # Flipping the LSBs and re-encoding as JPEG keeps the fingerprint close to the one of the cover
+        pixels = np.asarray(Image.open(self.covers / '7.png')) ^ 1
+        stego = Path(self.tmp.name) / 'stego.jpg'
+        Image.fromarray(pixels).save(stego, quality=90)
+        cover, distance = index.lookup(stego)
+        self.assertEqual(cover, self.covers / '7.png')
+        self.assertLessEqual(distance, 8)
+
+        # The candidates of the blocks are the same as the ones of comparing all fingerprints
+        value = fingerprint(stego)
+        for max_distance in (0, 4, 12):
+            expected = [i for i, h in enumerate(index.hashes) if bin(int(h) ^ value).count('1') <= max_distance]
+            self.assertEqual(index.candidates(value, max_distance).tolist(), expected)
+
+        with self.assertRaises(ValueError):
+            CoverIndex.load(self.covers)
+
+
+class PipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        tmp_path = Path(self.tmp.name)
+        self.cover = _write_image(tmp_path / 'cover.png')
+        self.stegos = [_write_image(tmp_path / f'stego{i}.png', color=(i, i, i)) for i in range(5)]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_prefetch(self):
+        missing = self.cover.with_name('missing.png')
+        pairs = [(self.cover, s) for s in self.stegos] + [(self.cover, missing)]
+        invalid = []
+        loaded = list(prefetch(pairs, depth=2, threads=2, handle_invalid=lambda p, e: invalid.append(p)))
+        self.assertEqual([(c.path, s.path) for c, s in loaded], pairs[:-1])
+        self.assertTrue(all(c is loaded[0][0] for c, _ in loaded))
+        self.assertEqual(invalid, [missing])
+        self.assertEqual(loaded[0][1].data, self.stegos[0].read_bytes())
+        self.assertEqual(loaded[1][1].pixels[0, 0].tolist(), [1, 1, 1, 255])
+
+    def test_prefetch_close(self):
+        evaluator = Evaluator(_load_config(Path('rules/stegoapps.yaml')), _globals=dict(NATIVE_GLOBALS))
+        loaded = list(prefetch([(self.cover, s) for s in self.stegos]))
+        checks = list(detect._iter_checks(evaluator, loaded))
+        self.assertEqual([error for _, error in checks], [None] * len(self.stegos))
+        self.assertTrue(all(c.data is None and s.data is None and not s.is_decoded for c, s in loaded))
+        self.assertIsNone(evaluator._cover_image)
+        self.assertEqual(evaluator._cover_features, {})
+
+    def test_prefetch_stop(self):
+        pairs = ((self.cover, s) for _ in range(100) for s in self.stegos)
+        for i, _ in enumerate(prefetch(pairs, depth=1)):
+            if i == 2:
+                break
+
+
+class BenchTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_embed(self):
+        pixels = np.random.default_rng(0).integers(0, 256, (6, 5, 3), dtype=np.uint8)
+        rgba = lambda data: np.dstack([data, np.full(data.shape[:2], 255, dtype=np.uint8)])
+        data = corpus.embed(pixels, b'@!#ab#!@', bits=2)
+        self.assertEqual(lsb.pack(lsb.select(rgba(data)), 2)[:8].tobytes(), b'@!#ab#!@')
+        data = corpus.embed(pixels, b'\xa5', bits=1, channels='B', direction='col')
+        self.assertEqual(lsb.pack(lsb.select(rgba(data), 'B', 'col'), 1)[0], 0xa5)
+
+    def test_corpus(self):
+        expected = {
+            'MobiStego': {'MobiStego': 3},
+            'PocketStego': {'PocketStego': 1},
+            'Pictograph': {'Pictograph': 2},
+            'PixelKnot': {'PixelKnot': 1},
+            'Passlok': {'Passlok': 1},
+            'Clean': {},
+        }
+        pairs = corpus.generate(Path(self.tmp.name), 2, size=(64, 48))
+        self.assertEqual({p.kind for p in pairs}, set(corpus.KINDS))
+        evaluator = TimingEvaluator(_load_config(Path('rules/stegoapps.yaml')))
+        for pair in pairs:
+            evaluator.check(pair.cover, pair.stego)
+            self.assertEqual(evaluator.weights, expected[pair.kind], pair.kind)
+        self.assertIn('ISA.MobiStego.LSB-Signature', evaluator.timings)
+
+
+class ColumnarTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_size_diffs(self):
+        cover = _write_image(Path(self.tmp.name) / 'cover.png')
+        stego = _write_image(Path(self.tmp.name) / 'stego.png', size=(64, 64))
+        missing = Path(self.tmp.name) / 'missing.png'
+        diffs = files.size_diffs([cover, cover, missing], [stego, cover, stego])
+        self.assertEqual(diffs[0], files.size_diff(cover, stego))
+        self.assertEqual(diffs[1], 0)
+        self.assertTrue(np.isnan(diffs[2]))
+
+    def test_check_all(self):
+        pairs = [(p.cover, p.stego) for p in corpus.generate(Path(self.tmp.name), 3, size=(32, 32))]
+        pairs.append((Path(self.tmp.name) / 'missing.png', pairs[0][1]))
+        config = _load_config(Path('rules/stegoapps.yaml'))
+        evaluator = Evaluator(config, _globals=dict(NATIVE_GLOBALS))
+        columnar = ColumnarEvaluator(Evaluator(config, _globals=dict(NATIVE_GLOBALS)))
+        self.assertEqual(len(columnar.vectorized), len(config.rules))
+
+        for (cover, stego), (weights, matched_rules, error) in zip(pairs, columnar.check_all(pairs)):
+            try:
+                evaluator.check(cover, stego)
+            except FileNotFoundError:
+                self.assertIsInstance(error, FileNotFoundError)
+                continue
+            self.assertIsNone(error)
+            self.assertEqual(weights, evaluator.weights)
+            self.assertEqual(matched_rules, evaluator.matched_rules)
+
+
+class ScoreTest(unittest.TestCase):
+    def test_score(self):
+        rng = np.random.default_rng(0)
+        methods = ['tool1', 'tool2', 'tool3']
+        tools = methods + ['tool4']
+        detections = {m: [] for m in methods}
+        for i in range(300):
+            method = methods[i % 3]
+            weights = {t: int(w) for t, w in zip(tools, rng.integers(-1, 4, len(tools))) if rng.random() < 0.5}
+            detections[method].append({'cover': f'c{i}.png', 'stego': f's{i}.png', 'weights': weights})
+
+        # The statistics as computed by the loops of the notebook
+        def max_weight(weights):
+            if not weights:
+                return None
+            max_value = max(weights.values())
+            if list(weights.values()).count(max_value) > 1 or max_value <= 0:
+                return None
+            return max_value
+
+        expected = {'bool': {}, 'max': {}}
+        for method in methods:
+            for mode, predict in [('bool', lambda d: d['weights'].get(method, 0) > 0),
+                                  ('max', lambda d: d['weights'].get(method, 0) == max_weight(d['weights']))]:
+                counts = [0, 0, 0, 0]
+                for actual, items in detections.items():
+                    for d in items:
+                        counts[(0 if predict(d) else 2) + (actual != method)] += 1
+                expected[mode][method] = counts
+
+        file = io.StringIO(json.dumps(detections))
+        labels, weights = encode(read_detections(file, 'json'), methods).arrays()
+        for mode, scores in score(labels, weights, methods).items():
+            for method, counts, metrics in zip(scores.methods, scores.counts, scores.metrics()):
+                tp, fp, fn, tn = expected[mode][method]
+                self.assertEqual(list(counts), [tp, fp, fn, tn])
+                self.assertAlmostEqual(metrics[0], (tp + tn) / (tp + fp + fn + tn) * 100)
+                self.assertAlmostEqual(metrics[1], tp / (tp + fp) * 100 if tp + fp else 0)
+                self.assertAlmostEqual(metrics[2], tp / (tp + fn) * 100 if tp + fn else 0)
+
+
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _post(self, url: str, data: dict) -> dict:
+        request = urllib.request.Request(url, data=json.dumps(data).encode())
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)
+
+    def test_check(self):
+        cover = _write_image(Path(self.tmp.name) / 'cover.png')
+        stego = _write_image(Path(self.tmp.name) / 'stego.png', size=(64, 64))
+        config = Path(self.tmp.name) / 'config.yaml'
+        rule = {'name': 'rule1', 'desc': 'desc1', 'tools': [{'name': 'tool1', 'weight': 1}], 'match': 'stego.size > cover.size'}
+        config.write_text(yaml.safe_dump({'isd': '1', 'tools': [{'name': 'tool1', 'tags': []}], 'rules': [rule]}))
+
+        with DetectionServer(('127.0.0.1', 0), config, _globals=dict(NATIVE_GLOBALS)) as server:
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            url = f'http://127.0.0.1:{server.server_address[1]}/check'
+            try:
+                result = self._post(url, {'pairs': [[str(cover), str(stego)], [str(cover), 'missing.png']]})
+                self.assertEqual(result['detections'], [{
+                    'cover': str(cover), 'stego': str(stego), 'weights': {'tool1': 1}, 'matched_rules': ['rule1']
+                }])
+                self.assertEqual(len(result['errors']), 1)
+
+                # The modified config is loaded by the next request
+                rule['tools'][0]['weight'] = 3
+                config.write_text(yaml.safe_dump({'isd': '1', 'tools': [{'name': 'tool1', 'tags': []}], 'rules': [rule]}))
+                os.utime(config, ns=(0, server._mtime + 1))
+                result = self._post(url, {'cover': str(cover), 'stego': str(stego)})
+                self.assertEqual(result['detections'][0]['weights'], {'tool1': 3})
+            finally:
+                server.shutdown()
+
 
 class DetectTest(unittest.TestCase):
     def test_check_image(self):
@@ -202,6 +861,424 @@ class DetectTest(unittest.TestCase):
         self.assertEqual(0, len(errors))
 
 
+class ParallelTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        tmp_path = Path(self.tmp.name)
+        self.config = tmp_path / 'config.yaml'
+        self.config.write_text(yaml.safe_dump({'isd': '1', 'tools': [{'name': 'tool1', 'tags': []}], 'rules': [
+            {'name': 'rule1', 'desc': 'desc1', 'tools': [{'name': 'tool1', 'weight': 1}],
+             'match': {'value': 'files.size_diff(cover, stego)', 'cond': 'value > 10'}}
+        ]}))
+        covers = [_write_image(tmp_path / f'cover{i}.png') for i in range(3)]
+        rng = np.random.default_rng(0)
+        self.pairs = []
+        for i in range(9):
+            # Noise of more and more pixels makes the stego images larger, so only some of them match
+            pixels = np.zeros((8, 8, 3), dtype=np.uint8)
+            pixels.reshape(-1)[:i * 8] = rng.integers(0, 256, i * 8, dtype=np.uint8)
+            Image.fromarray(pixels).save(tmp_path / f'stego{i}.png')
+            self.pairs.append((covers[i % 3], tmp_path / f'stego{i}.png'))
+        # A missing stego image fails only its own pair
+        self.pairs.insert(4, (covers[1], tmp_path / 'missing.png'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _detect(self, **kwargs):
+        errors = []
+        detections = list(detect_tools(self.pairs, self.config, handle_errors=errors.extend, chunk_size=2, **kwargs))
+        return [(d.cover, d.stego, d.weights, d.matched_rules) for d in detections], errors
+
+    def test_workers(self):
+        serial, serial_errors = self._detect()
+        self.assertEqual(len(serial), 9)
+        self.assertEqual([(e.cover, e.stego) for e in serial_errors], [self.pairs[4]])
+
+        ordered, errors = self._detect(workers=2)
+        self.assertEqual(ordered, serial)
+        self.assertEqual([(e.cover, e.stego) for e in errors], [self.pairs[4]])
+
+        unordered, errors = self._detect(workers=2, ordered=False)
+        self.assertEqual(sorted(unordered, key=str), sorted(serial, key=str))
+        self.assertEqual(len(errors), 1)
+
+        self.config = _load_config(self.config)
+        loaded, errors = self._detect(workers=2)
+        self.assertEqual(loaded, serial)
+        self.assertEqual(len(errors), 1)
+
+    def test_unpicklable_error(self):
+        class _Error(Exception):
+            def __init__(self):
+                super().__init__('unpicklable')
+                self.handle = threading.Lock()
+
+        def _check(cover, stego):
+            raise _Error()
+
+        evaluator = Evaluator(_load_config(self.config))
+        evaluator.check = _check
+        detect._worker_evaluator = evaluator
+        try:
+            _, errors, _ = pickle.loads(pickle.dumps(detect._check_chunk(self.pairs[:2])))
+        finally:
+            detect._worker_evaluator = None
+        self.assertEqual([(e.cover, e.stego) for e in errors], self.pairs[:2])
+        self.assertIn('unpicklable', str(errors[0]))
+
+
+class EvaluatorTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        tmp_path = Path(self.tmp.name)
+        self.cover = _write_image(tmp_path / 'cover.png')
+        self.stego = _write_image(tmp_path / 'stego.png', color=(1, 1, 1))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_feature_cache(self):
+        config_src = '''
+        isd: "1"
+        tools:
+          - name: tool1
+            tags: [tag1]
+          - name: tool2
+            tags: [tag2]
+        rules:
+          - name: rule1
+            desc: desc1
+            match: {value: "feature(cover.path,stego.path)", cond: value > 0}
+            tools: [{name: tool1, weight: 1}]
+          - name: rule2
+            desc: desc2
+            match: {value: "feature(cover.path, stego.path)", cond: value > 1}
+            tools: [{name: tool2, weight: 1}]
+        '''
+        calls = []
+
+        def feature(cover, stego):
+            calls.append((cover, stego))
+            return 1
+
+        config = Config.from_dict(yaml.safe_load(config_src))
+        evaluator = Evaluator(config, _globals={'feature': feature})
+        evaluator.check(self.cover, self.stego)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(evaluator.cache_misses, 1)
+        self.assertEqual(evaluator.cache_hits, 1)
+        self.assertEqual(evaluator.weights, {'tool1': 1})
+
+        evaluator.check(self.cover, self.stego)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(evaluator.cache_misses, 2)
+        self.assertEqual(evaluator.cache_hits, 2)
+
+    def test_check_group(self):
+        config_src = '''
+        isd: "1"
+        tools:
+          - name: tool1
+            tags: [tag1]
+        rules:
+          - name: rule1
+            desc: desc1
+            match: {value: "cover_feature(cover.path)", cond: value > 0}
+            tools: [{name: tool1, weight: 1}]
+          - name: rule2
+            desc: desc2
+            match: {value: "stego_feature(stego.path)", cond: value > 0}
+            tools: [{name: tool1, weight: 1}]
+        '''
+        calls = []
+
+        def feature(path):
+            calls.append(path)
+            return 1
+
+        config = Config.from_dict(yaml.safe_load(config_src))
+        evaluator = Evaluator(config, _globals={'cover_feature': feature, 'stego_feature': feature})
+        missing = self.stego.with_name('missing.png')
+        results = list(evaluator.check_group(self.cover, [self.stego, missing, self.stego]))
+        self.assertEqual([s for s, _ in results], [self.stego, missing, self.stego])
+        self.assertIsNone(results[0][1])
+        self.assertIsInstance(results[1][1], FileNotFoundError)
+        self.assertEqual(calls, [self.cover, self.stego, self.stego])
+        self.assertEqual(evaluator.weights, {'tool1': 2})
+
+    def test_profiler(self):
+        config_src = '''
+        isd: "1"
+        tools:
+          - name: tool1
+            tags: [tag1]
+        rules:
+          - name: rule1
+            desc: desc1
+            match: {value: "feature(stego)", cond: value > 0}
+            tools: [{name: tool1, weight: 1}]
+            next:
+              name: rule2
+              desc: desc2
+              match: {value: "feature(stego)", cond: value.missing}
+              tools: [{name: tool1, weight: 1}]
+          - name: compound
+            operator: any
+            rules:
+              - name: rule3
+                desc: desc3
+                match: "feature(cover) == 1"
+                tools: [{name: tool1, weight: 1}]
+        '''
+        config = Config.from_dict(yaml.safe_load(config_src))
+        profiler = Profiler(trace=True)
+        evaluator = Evaluator(config, _globals={'feature': lambda image: 1}, profiler=profiler)
+        evaluator.check(self.cover, self.stego)
+        evaluator.check(self.cover, self.stego)
+
+        rule1, rule2 = profiler.rules['rule1'], profiler.rules['rule1 > rule2']
+        self.assertEqual((rule1.calls, rule1.matches, rule1.errors), (2, 2, 0))
+        self.assertEqual((rule2.calls, rule2.matches, rule2.errors), (2, 0, 2))
+        value, = profiler.values.values()
+        self.assertEqual((value.expr, value.calls, value.hits), ('feature(stego)', 2, 2))
+        compound = profiler.rules['compound(any)']
+        self.assertEqual((compound.calls, compound.matches, compound.errors), (2, 2, 0))
+        self.assertEqual(profiler.rules['compound(any) > rule3'].calls, 2)
+        events = {}
+        for event in profiler.trace_events:
+            events.setdefault(event['cat'], []).append(event)
+        self.assertEqual({c: len(e) for c, e in events.items()}, {'rule': 6, 'value': 2, 'chain': 2, 'compound': 2})
+        for outer, inner in [('chain', 'rule1 > rule2'), ('compound', 'compound(any) > rule3')]:
+            span = events[outer][0]
+            nested = next(e for e in events['rule'] if e['name'] == inner)
+            self.assertLessEqual(span['ts'], nested['ts'])
+            self.assertGreaterEqual(span['ts'] + span['dur'], nested['ts'] + nested['dur'])
+        self.assertIn('rule1 > rule2', profiler.table())
+
+        merged = Profiler()
+        merged.merge(profiler.to_dict())
+        merged.merge(profiler.to_dict())
+        self.assertEqual(merged.rules['rule1'].calls, 4)
+        self.assertEqual(merged.values[config.rules[0].match.key].hits, 4)
+
+    def test_shared_rules(self):
+        rule3 = {'name': 'rule3', 'desc': 'desc3', 'tools': [{'name': 'tool3', 'weight': 2}], 'match': 'count()'}
+        rules = [
+            {'name': f'rule{i}', 'desc': 'desc', 'tools': [{'name': f'tool{i}', 'weight': 1}], 'match': 'True',
+             'next': dict(rule3)}
+            for i in (1, 2)
+        ]
+        calls = []
+        evaluator = Evaluator(Config.from_dict({'isd': '1', 'tools': [], 'rules': rules}),
+                              _globals={'count': lambda: calls.append(1) or True})
+        evaluator.check(self.cover, self.stego)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(evaluator.weights, {'tool1': 1, 'tool2': 1, 'tool3': 4})
+        self.assertEqual([r.name for r in evaluator.matched_rules], ['rule1', 'rule3', 'rule2', 'rule3'])
+
+        evaluator.check(self.cover, self.stego)
+        self.assertEqual(len(calls), 2)
+
+        # The shared rule is measured under the path it is evaluated at
+        rules[0]['match'] = 'False'
+        profiler = Profiler()
+        evaluator = Evaluator(Config.from_dict({'isd': '1', 'tools': [], 'rules': rules}),
+                              _globals={'count': lambda: True}, profiler=profiler)
+        evaluator.check(self.cover, self.stego)
+        self.assertEqual(profiler.rules['rule1 > rule3'].calls, 0)
+        self.assertEqual(profiler.rules['rule2 > rule3'].calls, 1)
+
+    def test_reorder(self):
+        def _config(children):
+            return Config.from_dict({'isd': '1', 'tools': [], 'rules': [
+                {'name': 'rule1', 'desc': 'desc', 'tools': [{'name': 'tool1', 'weight': 1}], 'match': 'True',
+                 'next': {'operator': 'any', 'rules': children}}]})
+
+        def _rule(name, match, tools=True):
+            return {'name': name, 'desc': 'desc', 'tools': [{'name': name, 'weight': 1}] if tools else [],
+                    'match': match}
+
+        calls = []
+        _globals = {'slow': lambda: calls.append(1) or time.sleep(0.001) or True, 'size': lambda: 5}
+        pairs = [(self.cover, self.stego)] * 10
+
+        # The ranges do not overlap, so at most one sub-rule matches in any order
+        config = _config([_rule('small', {'value': 'size()', 'cond': 'value < 3'}),
+                          _rule('large', {'value': 'size()', 'cond': '3 <= value'})])
+        plan = ordering.plan(config, ordering.warm_up(config, pairs, _globals=_globals))
+        self.assertEqual(plan.orders, {'rule1 > (any)': [1, 0]})
+        evaluator = Evaluator(config, _globals=_globals, order=ordering.resolve(config, plan.orders))
+        evaluator.check(self.cover, self.stego)
+        self.assertEqual(evaluator.weights, {'tool1': 1, 'large': 1})
+        self.assertEqual([r.name for r in evaluator.matched_rules], ['rule1', 'large'])
+
+        # A compound rule shared by two parents has one order, which is measured under its first path
+        children = [_rule('small', {'value': 'size()', 'cond': 'value < 3'}),
+                    _rule('large', {'value': 'size()', 'cond': '3 <= value'})]
+        shared = Config.from_dict({'isd': '1', 'tools': [], 'rules': [
+            {'name': name, 'desc': 'desc', 'tools': [], 'match': 'True', 'next': {'operator': 'any', 'rules': children}}
+            for name in ('rule1', 'rule2')
+        ]})
+        plan = ordering.plan(shared, ordering.warm_up(shared, pairs, _globals=_globals))
+        self.assertEqual(plan.orders, {'rule1 > (any)': [1, 0]})
+        self.assertIn('rule2 > (any): same rule as rule1 > (any)', plan.report[1])
+        self.assertEqual(list(ordering.resolve(shared, plan.orders).values()), [[1, 0]])
+
+        # The slow sub-rule never matched for the measured pairs, but nothing proves that it cannot
+        config = _config([_rule('slow', 'slow() and False'), _rule('fast', 'True')])
+        stats = ordering.warm_up(config, pairs, _globals=_globals)
+        self.assertEqual(ordering.plan(config, stats).orders, {})
+
+        # Without tools, the order still decides which sub-rules are listed as matched
+        config = _config([_rule('slow', 'slow() and False', tools=False), _rule('fast', 'True', tools=False)])
+        self.assertEqual(ordering.plan(config, ordering.warm_up(config, pairs, _globals=_globals)).orders, {})
+
+        path = Path(self.cover).parent / 'stats.json'
+        stats.save(path)
+        self.assertEqual(ordering.OrderStats.load(path), stats)
+
+    def test_decision(self):
+        def _config(weight: int):
+            return Config.from_dict({'isd': '1', 'tools': [], 'rules': [
+                {'name': 'rule1', 'desc': 'desc', 'tools': [{'name': 'tool1', 'weight': weight}], 'match': 'True',
+                 'next': {'name': 'rule2', 'desc': 'desc', 'tools': [{'name': 'tool1', 'weight': 1}],
+                          'match': 'slow()'}},
+                {'name': 'rule3', 'desc': 'desc', 'tools': [{'name': 'tool2', 'weight': 2}], 'match': 'slow()'},
+                {'name': 'rule4', 'desc': 'desc', 'tools': [{'name': 'tool1', 'weight': -1}], 'match': 'slow()'},
+            ]})
+
+        calls = []
+        _globals = {'slow': lambda: calls.append(1) or True}
+
+        evaluator = Evaluator(_config(4), _globals=_globals)
+        evaluator.check(self.cover, self.stego)
+        self.assertEqual(evaluator.weights, {'tool1': 4, 'tool2': 2})
+        self.assertEqual(len(calls), 3)
+
+        # tool2 can reach 2 and tool1 keeps at least 4 - 1 after rule1, so the rest is skipped
+        calls.clear()
+        evaluator = Evaluator(_config(4), _globals=_globals, decide=True)
+        evaluator.check(self.cover, self.stego)
+        self.assertEqual(calls, [])
+        self.assertEqual(evaluator.weights, {'tool1': 4})
+        self.assertEqual(evaluator.decision, 'tool1')
+        self.assertTrue(evaluator.stopped)
+
+        # A tie is no decision, which is only known after all rules
+        calls.clear()
+        evaluator = Evaluator(_config(2), _globals=_globals, decide=True)
+        evaluator.check(self.cover, self.stego)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(evaluator.weights, {'tool1': 2, 'tool2': 2})
+        self.assertIsNone(evaluator.decision)
+        self.assertFalse(evaluator.stopped)
+
+    def test_sort_by_cover(self):
+        pairs = [(Path('a'), Path('1')), (Path('b'), Path('2')), (Path('a'), Path('3'))]
+        self.assertEqual(list(sort_by_cover(pairs)), [pairs[0], pairs[2], pairs[1]])
+        self.assertEqual(list(sort_by_cover(pairs, window=2)), pairs)
+
+    def test_persistent_cache(self):
+        config = Config.from_dict({'isd': '1', 'tools': [], 'rules': [
+            {'name': 'rule1', 'desc': 'desc1', 'match': {'value': 'feature(stego)', 'cond': 'value > 0'},
+             'tools': [{'name': 'tool1', 'weight': 1}]}
+        ]})
+        calls = []
+
+        def feature(image):
+            calls.append(image)
+            return 1.5
+
+        cache_path = Path(self.tmp.name) / 'cache.db'
+        for by_content in [False, True, True]:
+            with FeatureCache(cache_path, by_content=by_content) as cache:
+                evaluator = Evaluator(config, _globals={'feature': feature}, cache=cache)
+                evaluator.check(self.cover, self.stego)
+                self.assertEqual(evaluator.weights, {'tool1': 1})
+        self.assertEqual(len(calls), 2)
+
+        with FeatureCache(cache_path) as cache:
+            self.assertEqual(cache.stats(), {'feature(stego)': (2, cache.stats()['feature(stego)'][1])})
+            self.assertFalse(cache.put('lazy', ImageFile(self.cover), ImageFile(self.stego), object()))
+            self.assertEqual(cache.prune(0), 2)
+            self.assertEqual(cache.stats(), {})
+
+            # Lazy LSB streams are not stored, so storing them does not extract them
+            cover, stego = ImageFile(self.cover), ImageFile(self.stego)
+            stream = lsb.stream(stego)
+            self.assertFalse(cache.put('lsb', cover, stego, stream))
+            self.assertEqual(len(stream._extraction.buffer), 0)
+
+            # Values of another version of the code are not reused
+            self.assertTrue(cache.put('lsb', cover, stego, lsb.extract(stego), version='1'))
+            cached, value = cache.get('lsb', cover, stego, version='1')
+            self.assertTrue(cached)
+            np.testing.assert_array_equal(value, lsb.extract(stego))
+            self.assertFalse(cache.get('lsb', cover, stego, version='2')[0])
+
+    def test_feature_version(self):
+        self.assertEqual(features.version(lsb), features.version(lsb.stream))
+        self.assertNotEqual(features.version(lsb), features.version(png))
+        self.assertEqual(features.version({'value': 7}), '')
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size('512'), 512)
+        self.assertEqual(parse_size('1.5k'), 1536)
+        self.assertEqual(parse_size('20MB'), 20 * 1024 ** 2)
+
+    def test_image_file(self):
+        with ImageFile(self.stego) as image:
+            self.assertEqual(image.size, self.stego.stat().st_size)
+            self.assertEqual(image.header[:8], png.SIGNATURE)
+            self.assertIsNone(image._image)
+            self.assertEqual((image.format, image.mode, image.dimensions), ('PNG', 'RGB', (8, 8)))
+            self.assertFalse(image.is_decoded)
+            self.assertIs(image.pixels, image.pixels)
+            self.assertEqual(image.pixels.shape, (8, 8, 4))
+        self.assertFalse(image.is_decoded)
+        self.assertIsNone(image._image)
+
+    def test_size_diff(self):
+        cover_size, stego_size = self.cover.stat().st_size, self.stego.stat().st_size
+        expected = (stego_size - cover_size) / cover_size * 100
+        self.assertEqual(files.size_diff(self.cover, self.stego), expected)
+        self.assertEqual(files.size_diff(ImageFile(self.cover), ImageFile(self.stego)), expected)
+
+    def test_missing_image(self):
+        evaluator = Evaluator(Config('1', [], []), _globals={})
+        self.assertRaises(FileNotFoundError, evaluator.check, self.cover, Path(self.tmp.name) / 'missing.png')
+
+    def test_range_rules(self):
+        rules = [
+            {'name': f'rule{i}', 'desc': cond, 'match': {'value': 'feature', 'cond': cond},
+             'tools': [{'name': f'tool{i}', 'weight': 1}]}
+            for i, cond in enumerate(['value < 0', '0 <= value < 10', '5 <= value', 'value == 7'])
+        ]
+        config = Config.from_dict({'isd': '1', 'tools': [], 'rules': rules})
+        for feature, expected in [(-1, {'tool0': 1}), (7, {'tool1': 1, 'tool2': 1, 'tool3': 1}), ('x', {})]:
+            evaluator = Evaluator(config, _globals={'feature': feature})
+            evaluator.check(self.cover, self.stego)
+            self.assertEqual(evaluator.weights, expected)
+
+        # Only the rules whose ranges contain the value are entered, in the order of the config
+        profiler = Profiler()
+        evaluator = Evaluator(config, _globals={'feature': 12}, profiler=profiler)
+        evaluator.check(self.cover, self.stego)
+        self.assertEqual({path: stats.calls for path, stats in profiler.rules.items() if stats.calls}, {'rule2': 1})
+
+        children = [dict(rule, name=f'sub{i}') for i, rule in enumerate(rules)]
+        children.insert(2, {'name': 'other', 'desc': 'desc', 'match': 'True', 'tools': []})
+        config = Config.from_dict({'isd': '1', 'tools': [], 'rules': [
+            {'name': 'rule', 'desc': 'desc', 'match': 'True', 'tools': [],
+             'next': {'operator': 'any', 'rules': children}}
+        ]})
+        for feature, calls in [(12, {'other': 1}), (-1, {'sub0': 1})]:
+            profiler = Profiler()
+            evaluator = Evaluator(config, _globals={'feature': feature}, profiler=profiler)
+            evaluator.check(self.cover, self.stego)
+            self.assertEqual({path.split(' > ')[-1]: stats.calls for path, stats in profiler.rules.items()
+                              if stats.calls and path.count(' > ') == 2}, calls)
 
 if __name__ == '__main__':
     unittest.main()
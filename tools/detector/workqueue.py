@@ -0,0 +1,341 @@
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import click
+
+from detect import Detection, create_evaluator, iter_checks, load_config
+from manifest import Manifest
+from output import FORMATS, create_writer, to_dict
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY,
+    start INTEGER NOT NULL,
+    stop INTEGER NOT NULL,
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    done INTEGER NOT NULL DEFAULT 0
+);
+'''
+
+
+@dataclass(frozen=True)
+class Chunk:
+    """Represents a range of pairs of the manifest of a work queue."""
+
+    id: int
+    """The position of the chunk in the queue."""
+
+    start: int
+    """The position of the first pair in the manifest."""
+
+    stop: int
+    """The position after the last pair in the manifest."""
+
+
+class WorkQueue:
+    """A queue of the chunks of a manifest in a SQLite database, from which workers on many hosts lease chunks.
+
+    A worker leases a chunk for a duration, which it renews while it checks the pairs. If the worker dies, the
+    lease expires and the chunk is leased to another worker. The workers append their results to their own file
+    in the results folder and `merge_results` combines them in the order of the manifest.
+
+    The queue, the manifest, the config and the results folder must be on a filesystem shared by the workers
+    whose file locks work (e.g. NFS with locking), because SQLite locks the database file for each lease.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        # Without a journal in the shared memory of WAL, the database also works on network filesystems
+        self._db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        self._db.executescript(_SCHEMA)
+        self.meta: Dict[str, str] = dict(self._db.execute('SELECT key, value FROM meta'))
+        """The manifest, the config, the config digest, the results folder and the number of pairs of the queue."""
+
+    @classmethod
+    def create(cls, path: Path, manifest: Path, config: Path, results: Path, chunk_size: int = 256) -> 'WorkQueue':
+        """Create a queue of the pairs of a manifest in chunks of `chunk_size` pairs.
+
+        :raise ValueError: If the queue already exists or the manifest is invalid
+        """
+        if Path(path).exists():
+            raise ValueError(f'The queue "{path}" already exists')
+        total = len(Manifest.load(manifest))
+        Path(results).mkdir(parents=True, exist_ok=True)
+
+        queue = cls(path)
+        meta = {
+            'manifest': str(Path(manifest).resolve()),
+            'config': str(Path(config).resolve()),
+            'config_digest': hashlib.sha256(Path(config).read_bytes()).hexdigest(),
+            'results': str(Path(results).resolve()),
+            'total': str(total)
+        }
+        with queue._transaction():
+            queue._db.executemany('INSERT INTO meta (key, value) VALUES (?, ?)', meta.items())
+            queue._db.executemany('INSERT INTO chunks (start, stop) VALUES (?, ?)',
+                                  ((start, min(start + chunk_size, total)) for start in range(0, total, chunk_size)))
+        queue.meta = meta
+        return queue
+
+    @contextmanager
+    def _transaction(self):
+        # The database is locked for writing at once, so two workers never lease the same chunk
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        self._db.execute('COMMIT')
+
+    def lease(self, worker: str, duration: float) -> Optional[Chunk]:
+        """Lease the first chunk that is not done and not leased or whose lease expired.
+
+        :return: The leased chunk or None if all chunks are done or leased
+        """
+        now = time.time()
+        with self._transaction():
+            row = self._db.execute(
+                'SELECT id, start, stop FROM chunks WHERE done = 0 AND (lease_until IS NULL OR lease_until < ?) '
+                'ORDER BY id LIMIT 1', (now,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute('UPDATE chunks SET worker = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?',
+                             (worker, now + duration, row[0]))
+        return Chunk(*row)
+
+    def renew(self, chunk: Chunk, worker: str, duration: float) -> bool:
+        """Extend the lease of a chunk and return whether the worker still holds it."""
+        cursor = self._db.execute('UPDATE chunks SET lease_until = ? WHERE id = ? AND worker = ? AND done = 0',
+                                  (time.time() + duration, chunk.id, worker))
+        return cursor.rowcount == 1
+
+    def complete(self, chunk: Chunk, worker: str) -> bool:
+        """Mark a chunk as done, whose results were written by the worker, and return whether it still held it.
+
+        A chunk whose lease expired and was leased to another worker is left to that worker.
+        """
+        cursor = self._db.execute('UPDATE chunks SET done = 1, lease_until = NULL WHERE id = ? AND worker = ? '
+                                  'AND done = 0', (chunk.id, worker))
+        return cursor.rowcount == 1
+
+    def status(self) -> Dict[str, int]:
+        """Return the number of chunks that are done, leased, expired and pending."""
+        now = time.time()
+        done, leased, expired, pending = self._db.execute('''
+            SELECT
+                COALESCE(SUM(done = 1), 0),
+                COALESCE(SUM(done = 0 AND lease_until >= ?), 0),
+                COALESCE(SUM(done = 0 AND lease_until < ?), 0),
+                COALESCE(SUM(done = 0 AND lease_until IS NULL), 0)
+            FROM chunks
+        ''', (now, now)).fetchone()
+        return {'done': done, 'leased': leased, 'expired': expired, 'pending': pending}
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def run_worker(queue_path: Path, worker: Optional[str] = None, *, lease: float = 600.0, poll: float = 5.0,
+               **options) -> int:
+    """Check the chunks of a queue until all are done and append the results to the file of the worker.
+
+    While chunks are leased by other workers, the worker waits for them to be done or for their leases to expire.
+    The pairs of a chunk are checked grouped by cover. A result is a JSON line of a detection of
+    `output._to_dict` or of the cover, stego and error of a failed pair with the position of the pair in the
+    manifest as "index". The file is synced before a chunk is marked as done. If the worker lost the lease of a
+    chunk, because it was too slow to renew it, it stops checking the chunk and leaves it to the new worker.
+
+    :param worker: The unique name of the worker, by default the host name and the process id
+    :param lease: The seconds a chunk is leased for, which are renewed while its pairs are checked
+    :param poll: The seconds to wait for leased chunks
+    :param options: The options of `detect._create_evaluator` like `cache`
+    :return: The number of checked pairs of the chunks the worker completed
+    """
+    worker = worker or f'{socket.gethostname()}-{os.getpid()}'
+    with WorkQueue(queue_path) as queue:
+        config = Path(queue.meta['config'])
+        if hashlib.sha256(config.read_bytes()).hexdigest() != queue.meta['config_digest']:
+            raise ValueError(f'The config "{config}" was modified after the queue was created')
+        pairs = list(Manifest.load(Path(queue.meta['manifest'])).pairs())
+        evaluator = create_evaluator(config, False, **options)
+
+        checked = 0
+        with open(Path(queue.meta['results']) / f'{worker}.jsonl', 'a') as results:
+            while True:
+                chunk = queue.lease(worker, lease)
+                if chunk is None:
+                    status = queue.status()
+                    if status['leased'] + status['expired'] + status['pending'] == 0:
+                        break
+                    time.sleep(poll)
+                    continue
+
+                renewed_at = time.monotonic()
+                held = True
+                first = {}
+                indices = sorted(range(chunk.start, chunk.stop), key=lambda i: first.setdefault(pairs[i][0], i))
+                for index, (detection, error) in zip(indices, iter_checks(evaluator, (pairs[i] for i in indices))):
+                    record = to_dict(detection) if detection else {
+                        'cover': str(error.cover), 'stego': str(error.stego), 'error': str(error.error)
+                    }
+                    results.write(json.dumps({'index': index, **record}) + '\n')
+                    if time.monotonic() - renewed_at > lease / 3:
+                        # The lease expired and the chunk was leased to another worker, which checks it again
+                        held = queue.renew(chunk, worker, lease)
+                        renewed_at = time.monotonic()
+                        if not held:
+                            break
+
+                results.flush()
+                os.fsync(results.fileno())
+                if held and queue.complete(chunk, worker):
+                    checked += chunk.stop - chunk.start
+        if evaluator.cache:
+            evaluator.cache.close()
+    return checked
+
+
+def merge_results(queue_path: Path) -> Tuple[List[dict], List[int]]:
+    """Combine the results of all workers of a queue in the order of the manifest.
+
+    A pair checked by several workers, because a lease expired, is taken from the file of the first worker by
+    name, preferring detections over errors. Incomplete lines of workers that died are skipped.
+
+    :return: The results by position in the manifest and the positions of the pairs without a result
+    """
+    with WorkQueue(queue_path) as queue:
+        total = int(queue.meta['total'])
+        folder = Path(queue.meta['results'])
+
+    merged: Dict[int, dict] = {}
+    for path in sorted(folder.glob('*.jsonl')):
+        for record in _read_results(path):
+            index = record.pop('index')
+            if index not in merged or ('error' in merged[index] and 'error' not in record):
+                merged[index] = record
+    return [merged[i] for i in sorted(merged)], [i for i in range(total) if i not in merged]
+
+
+def _read_results(path: Path) -> Iterator[dict]:
+    with open(path) as file:
+        for line in file:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+_queue_path = click.argument('queue_path', type=click.Path(dir_okay=False, path_type=Path))
+
+
+@click.group()
+def queue():
+    """Splits the pairs of a manifest among detection workers on many hosts.
+
+    QUEUE_PATH is a SQLite database on a filesystem shared by the workers. Create it with "init", start any
+    number of workers with "work" and combine their results with "merge" once "status" shows all chunks as done.
+    """
+
+
+@queue.command()
+@_queue_path
+@click.option("-m", "--manifest", "manifest_path", required=True,
+              type=click.Path(exists=True, dir_okay=False, path_type=Path), help="Manifest of the pairs to check")
+@click.option("-c", "--config", required=True, type=click.Path(exists=True, dir_okay=False, path_type=Path),
+              help="Path to the config file, which must not change until the queue is done")
+@click.option("-r", "--results", required=True, type=click.Path(file_okay=False, path_type=Path),
+              help="Folder the workers write their results to")
+@click.option("--chunk-size", default=256, type=click.IntRange(min=1), help="Number of pairs leased at once")
+def init(queue_path: Path, manifest_path: Path, config: Path, results: Path, chunk_size: int):
+    """Creates a queue of the pairs of a manifest."""
+    try:
+        with WorkQueue.create(queue_path, manifest_path, config, results, chunk_size) as work_queue:
+            click.echo(f"Created {sum(work_queue.status().values())} chunks of {work_queue.meta['total']} pairs")
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+@queue.command()
+@click.argument('queue_path', type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.option("--worker", help="Unique name of the worker (the host name and process id by default)")
+@click.option("--lease", default=600.0, type=click.FloatRange(min=1),
+              help="Seconds a chunk is leased for before another worker takes it over")
+@click.option("--aletheia",
+              default='../aletheia',
+              type=click.Path(exists=True, file_okay=False, path_type=Path),
+              help="Path to the Aletheia root folder")
+@click.option("--cache", "cache_path", type=click.Path(dir_okay=False, path_type=Path),
+              help="Path to a SQLite database to cache the values of features, which should be local to the host")
+def work(queue_path: Path, worker: Optional[str], lease: float, aletheia: Path, cache_path: Optional[Path]):
+    """Checks chunks of a queue until all chunks are done.
+
+    Run it once per CPU on each host, as each worker checks its pairs in-process.
+    """
+    sys.path.append(str(aletheia))
+    try:
+        checked = run_worker(queue_path, worker, lease=lease, cache=cache_path)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Checked {checked} pairs", err=True)
+
+
+@queue.command()
+@click.argument('queue_path', type=click.Path(exists=True, dir_okay=False, path_type=Path))
+def status(queue_path: Path):
+    """Shows the number of done, leased, expired and pending chunks."""
+    with WorkQueue(queue_path) as work_queue:
+        click.echo(', '.join(f'{count} {state}' for state, count in work_queue.status().items()))
+
+
+@queue.command()
+@click.argument('queue_path', type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.option("-f", "--format", "output_format", default="jsonl", type=click.Choice(FORMATS),
+              help="Format of the merged detections")
+@click.option("-o", "--output", type=click.Path(dir_okay=False, writable=True, path_type=Path),
+              help="Path to write the detections to instead of stdout (required for parquet)")
+@click.option("--partial", is_flag=True, help="Merge the results even if pairs were not checked yet")
+def merge(queue_path: Path, output_format: str, output: Optional[Path], partial: bool):
+    """Combines the results of the workers in the order of the manifest.
+
+    The errors of failed pairs are printed to stderr.
+    """
+    results, missing = merge_results(queue_path)
+    if missing and not partial:
+        raise click.ClickException(f"{len(missing)} pairs were not checked yet (merge them anyway with --partial)")
+
+    with WorkQueue(queue_path) as work_queue:
+        tools = [tool.name for tool in load_config(Path(work_queue.meta['config'])).tools]
+    with create_writer(output_format, output, tools, decision=any('decision' in r for r in results)) as writer:
+        for record in results:
+            if 'error' in record:
+                click.echo(f"{record['cover']}, {record['stego']}: {record['error']}", err=True)
+                continue
+            writer.write(Detection(Path(record['cover']), Path(record['stego']), record['weights'],
+                                   record['matched_rules'], record.get('decision')))
+
+
+if __name__ == '__main__':
+    queue()